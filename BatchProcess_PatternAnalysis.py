@@ -0,0 +1,174 @@
+#!/Users/roy/mambaforge/bin/python
+
+# Batch segmentation and pattern analysis of all *Lipid.tif stacks in a directory.
+# Prefixes are processed in a pool of worker processes that import the segmentation and analysis scripts once, on their first prefix.
+# Steps whose outputs are newer than their inputs and were made with the same parameters are skipped.
+
+import argparse
+import os
+import glob
+import json
+import sys
+import shlex
+import time
+import traceback
+import multiprocessing as mp
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tiff_stack import outName
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser()
+
+    # Directory with image stacks
+    parser.add_argument("directory",
+                        help = "(default = current directory) Directory with <prefix>C=Lipid.tif, C=Total.tif and C=Active.tif stacks",
+                        nargs = '?',
+                        default = '.')
+
+    # Background data
+    parser.add_argument("--background",
+                        help = "(default = background_dict.p in the directory) Background data file (.p) or per-pixel background model (.npz)",
+                        default = None)
+
+    # Segmentation options
+    parser.add_argument("--segmentation_options",
+                        help = "(default = none) Options passed to autoSegmentation_LipidPatch.py, e.g. \"--solver cg_mg --denoiser cv2_nlm\"",
+                        default = '')
+
+    # Number of processes
+    parser.add_argument("--processes",
+                        help = "(default = all cores) Number of cores; prefixes are processed in parallel and share the cores for segmentation",
+                        default = mp.cpu_count(),
+                        type = int)
+
+    # Rerun everything
+    parser.add_argument("--force",
+                        help = "(default = False) Rerun all steps even if their outputs are up to date",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    args = parser.parse_args(argv)
+
+    return args
+
+# Prefixes of lipid channel stacks, as in BatchProcess_PatternAnalysis.sh
+def get_prefixes(directory):
+    filenames = sorted(glob.glob(os.path.join(directory, '*Lipid.tif')))
+    return [filename.split('C=')[0] for filename in filenames]
+
+# Parameters recorded for every output
+def read_manifest(filename):
+    if not os.path.exists(filename):
+        return {}
+
+    with open(filename) as fh:
+        return json.load(fh)
+
+def write_manifest(manifest, filename):
+    with open(filename + '.tmp', 'w') as fh:
+        json.dump(manifest, fh, indent=4)
+    os.replace(filename + '.tmp', filename)
+
+# Outputs exist, are newer than all inputs and were made with the same parameters
+# Outputs are recorded by file name, since the manifest is kept next to them
+def up_to_date(outputs, inputs, params, manifest):
+    if not all(os.path.exists(output) for output in outputs):
+        return False
+    if min(os.path.getmtime(output) for output in outputs) < max(os.path.getmtime(file) for file in inputs):
+        return False
+
+    return all(manifest.get(os.path.basename(output)) == params for output in outputs)
+
+# Segment and analyse one prefix with a number of segmentation processes; returns the parameters of every output that was made
+def process_prefix(prefix, segmentation_argv, background, manifest, force=False, processes=1):
+    # the scripts are imported by every worker on its first prefix, not when this script starts
+    import autoSegmentation_LipidPatch as segmentation
+    import GTPase_patterning_analysis as patterning
+
+    lipid_file = f'{prefix}C=Lipid.tif'
+    channel_files = [lipid_file, f'{prefix}C=Total.tif', f'{prefix}C=Active.tif']
+
+    # segmentation runs in this worker's process
+    seg_argv = [lipid_file] + segmentation_argv + ['--processes', str(processes)]
+    seg_args = segmentation.get_args(seg_argv)
+    seg_params = {key: value for key, value in vars(seg_args).items() if key not in ['filename', 'processes', 'resume', 'profile']}
+    segmented_file = outName(lipid_file, 'segmented', seg_args.mask_format)
+
+    made = {}
+    steps = []
+    start = time.perf_counter()
+
+    if force or not up_to_date([segmented_file], [lipid_file], seg_params, manifest):
+        segmentation.main(seg_argv)
+        made[os.path.basename(segmented_file)] = seg_params
+        steps.append('segmented')
+
+    # pattern analysis
+    outprefix = '-'.join(segmented_file.split('_C=')[:-1])
+    outputs = [f'{outprefix}-analyzed.csv', f'{outprefix}-patches.csv']
+    analysis_params = {'background': os.path.abspath(background)}
+
+    if force or made or not up_to_date(outputs, [segmented_file, background] + channel_files, analysis_params, manifest):
+        patterning.main([segmented_file] + channel_files + [background])
+        made.update({os.path.basename(output): analysis_params for output in outputs})
+        steps.append('analysed')
+
+    return prefix, made, steps or ['up to date'], time.perf_counter() - start
+
+# Errors are caught per prefix, so that one failing stack does not stop the others
+def process_job(job):
+    start = time.perf_counter()
+    try:
+        return process_prefix(*job)
+    except Exception as error:
+        traceback.print_exc()
+        return job[0], {}, [f'failed: {type(error).__name__}: {error}'], time.perf_counter() - start
+
+def main(argv=None):
+    args = get_args(argv)
+
+    prefixes = get_prefixes(args.directory)
+    segmentation_argv = shlex.split(args.segmentation_options)
+    manifest_file = os.path.join(args.directory, 'batch_params.json')
+    manifest = read_manifest(manifest_file)
+    background = args.background or os.path.join(args.directory, 'background_dict.p')
+
+    # workers keep their interpreter, and the imported scripts, for all prefixes they process
+    # cores are split between workers, so that a few stacks still use all cores for segmentation;
+    # executor workers are not daemonic, so their segmentations can start worker processes of their own
+    processes = max(1, min(args.processes, len(prefixes)))
+    seg_processes = max(1, args.processes // processes)
+
+    jobs = [(prefix, segmentation_argv, background, manifest, args.force == 'True', seg_processes) for prefix in prefixes]
+    with (ProcessPoolExecutor(processes) if processes > 1 else nullcontext()) as executor:
+        if executor is None:
+            results = map(process_job, jobs)
+        else:
+            results = (future.result() for future in as_completed([executor.submit(process_job, job) for job in jobs]))
+
+        # parameters are recorded as soon as a prefix is done, so interrupted batches resume where they stopped;
+        # failed prefixes are recorded with their error until they succeed
+        failed = manifest.setdefault('failed_prefixes', {})
+        for n, (prefix, made, steps, runtime) in enumerate(results):
+            manifest.update(made)
+            if steps[0].startswith('failed'):
+                failed[os.path.basename(prefix)] = steps[0]
+            else:
+                failed.pop(os.path.basename(prefix), None)
+            write_manifest(manifest, manifest_file)
+            print(f"{n+1:>4d} of {len(jobs)}    {os.path.basename(prefix)}    {', '.join(steps)}    {runtime:8.1f} s")
+
+    failures = [os.path.basename(prefix) for prefix in prefixes if os.path.basename(prefix) in failed]
+    if failures:
+        print(f"{len(failures)} of {len(jobs)} prefixes failed: {', '.join(failures)}; errors are recorded in {manifest_file}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
+
+# Ankit Roy
+# 19th October, 2026
+# Cores are split between prefixes processed in parallel and used by their segmentation (--processes)
+# The segmentation and analysis scripts are imported by the workers that use them (faster start)
+# Errors are caught per prefix and recorded in the manifest; the other prefixes are still processed
@@ -0,0 +1,475 @@
+#!/Users/roy/anaconda3/bin/python3
+
+"""
+Runs the colocalization analysis for every parameter row of input_parameters.csv as a pipeline of cached stages.
+
+Stages per parameter row:
+--> SpotColocalization.py: colocalized spots (--outfile)
+--> getStat_TracksColocalized.py: colocalized track subset (<outfile>_subset.csv); fails if the subset is empty
+--> calc_ColocalizationProbability_Classes.py: recruitment/extraction/internal probabilities (<subset>_probPlot.csv)
+--> calc_ColocalizationProbability_positionSpecific.py: position specific probabilities (<subset>_posProbPlot.csv)
+--> create_colocHeatMap.py: colocalization heat map data (<subset>_heatPlotData.csv)
+
+Every stage is keyed on a hash of its script and the local modules it imports, the parameters it receives and the contents of its input files.
+A stage only runs again if its key changes, e.g. changing --recruitment_frames reruns getStat_TracksColocalized.py
+and the stages after it, but not SpotColocalization.py. Outputs of every key are kept in a content-addressed cache,
+so outputs overwritten by other parameter rows are restored instead of recomputed. Independent stages run in parallel.
+Stages that produce identical outputs with identical parameters in several rows run once.
+
+Stages are scheduled under a core budget (--cores). SpotColocalization.py runs get an equal share of the budget as
+worker processes, all other stages use one core, and a stage only starts once enough cores are free.
+Output of every stage is written to its own log as it runs and a table of all stages, with their timings, is
+written at the end (--summary).
+"""
+
+import argparse
+import ast
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+__author__ = "Ankit Roy"
+__copyright__ = "Copyright 2026, Bieling Lab, Max Planck Institute of Molecular Physiology"
+__license__ = "GPL"
+__maintainer__ = "Ankit Roy"
+__status__ = "Development"
+
+#--- Directory with the analysis scripts
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+#--- Default arguments, as in BatchProcess_ColocalizationAnalysis.sh
+DEFAULTS = {
+	"-d" : "0.5",
+	"-fov" : "1.00",
+	"-ps" : "0.178",
+	"-is" : "512",
+	"--first_frame" : "1",
+	"--last_frame" : "1000",
+	"--control" : "False",
+	"--control_frame_limit" : "3",
+	"--outfile" : "Colocalization.csv",
+	"--gtpase_track_min_length" : "5",
+	"--limit_free_gdi" : "True",
+}
+
+#--- Long argument names used in parameter files
+ALIASES = {
+	"--dist" : "-d",
+	"--field" : "-fov",
+	"--pixel_size" : "-ps",
+	"--image_size" : "-is",
+	"--gtpase" : "-gp",
+	"--gdi" : "-gd",
+	"--time_resolution" : "-tr",
+}
+
+#--- Parameters passed to each script
+COLOCALIZATION_ARGS = ["-d", "-fov", "-ps", "-is", "--first_frame", "--last_frame", "--control", "--control_frame_limit", "--gtpase_track_min_length"]
+SUBSET_ARGS = ["-fov", "-ps", "-is", "-tr", "--limit_free_gdi", "--max_gdi_free_frames", "--recruitment_frames", "--extraction_frames"]
+
+#--- Fetch arguments
+def get_args(argv=None):
+	parser = argparse.ArgumentParser()
+
+	# Parameter file
+	parser.add_argument("-p", "--parameters",
+								help = "(default = input_parameters.csv) Parameter file; the first line lists argument names, every further line is one analysis",
+								default = "input_parameters.csv")
+
+	# Core budget
+	parser.add_argument("-c", "--cores",
+								help = "(default = all cores) Number of cores shared by all running stages",
+								default = mp.cpu_count(),
+								type = int)
+
+	# Cache directory
+	parser.add_argument("--cache",
+								help = "(default = pipeline_cache) Directory for stage records, cached outputs and logs",
+								default = "pipeline_cache")
+
+	# Summary table
+	parser.add_argument("--summary",
+								help = "(default = pipeline_summary.csv) Table of all stages with their status and timings",
+								default = "pipeline_summary.csv")
+
+	# Dry run
+	parser.add_argument("--dry_run",
+								help = "(default = False) Only report which stages are up to date",
+								choices = ['True', 'False'],
+								default = 'False')
+
+	args = parser.parse_args(argv)
+
+	return args
+
+#--- Read parameter rows
+# Fields are cleaned as in BatchProcess_ColocalizationAnalysis.sh: outer whitespace removed, inner whitespace replaced with _
+def read_parameters(filename):
+	with open(filename, newline='') as fh:
+		lines = [[field.strip().replace(' ', '_') for field in line] for line in csv.reader(fh) if line]
+
+	names = [ALIASES.get(name, name) for name in lines[0]]
+
+	rows = []
+	for line in lines[1:]:
+		row = dict(DEFAULTS)
+		row.update({name: value for name, value in zip(names, line) if value != ''})
+		rows.append(row)
+
+	return rows
+
+#--- Stage of the pipeline
+# Inputs are (argument, file) pairs; an empty argument passes the file as a positional argument
+# Stages with a worker argument are passed their number of cores with it; it is not part of the stage key
+# A check returns an error message for outputs that later stages cannot use, which fails the stage
+class Stage:
+
+	def __init__(self, script, params, inputs, outputs, deps=(), workers=None, check=None):
+		self.script = script
+		self.params = params
+		self.inputs = inputs
+		self.outputs = outputs
+		self.deps = list(deps)
+		self.workers = workers
+		self.check = check
+		self.cores = 1
+		self.rows = []
+		self.status = None
+		self.start = 0
+		self.runtime = 0
+		self.log = ""
+		self.message = ""
+
+	# stages with the same script, parameters and input files are the same stage
+	def spec(self):
+		return (self.script, tuple(sorted(self.params.items())), tuple(self.inputs))
+
+	def command(self):
+		argv = [sys.executable, os.path.join(SCRIPT_DIR, self.script)]
+		for name, value in list(self.params.items()) + list(self.inputs):
+			argv += [name, value] if name else [value]
+		if self.workers:
+			argv += [self.workers, str(self.cores)]
+		return argv
+
+	def __str__(self):
+		return f"{self.script} -> {', '.join(self.outputs)}"
+
+#--- Subset without colocalized tracks
+def empty_subset(outputs):
+	with open(outputs[0]) as fh:
+		rows = sum(1 for line in fh if line.strip() and not line.startswith("#")) - 1
+
+	if rows <= 0:
+		return f"{outputs[0]} has no colocalized tracks, so there is nothing to calculate probabilities or heat maps from"
+	return None
+
+#--- Stages of one parameter row
+def build_stages(row):
+	outfile = row["--outfile"]
+	subset_file = "{}_subset.csv".format(outfile.split('.csv')[0])
+
+	colocalization = Stage("SpotColocalization.py",
+						{name: row[name] for name in COLOCALIZATION_ARGS if name in row} | {"--outfile": outfile},
+						[("-gp", row["-gp"]), ("-gd", row["-gd"])],
+						[outfile],
+						workers = "--processes")
+
+	subset = Stage("getStat_TracksColocalized.py",
+						{name: row[name] for name in SUBSET_ARGS if name in row},
+						[("-cf", outfile)],
+						[subset_file],
+						[colocalization],
+						check = empty_subset)
+
+	plots = [Stage(script, {}, [("", subset_file)], [f"{subset_file[:-4]}_{suffix}.csv"], [subset])
+				for script, suffix in [("calc_ColocalizationProbability_Classes.py", "probPlot"),
+									   ("calc_ColocalizationProbability_positionSpecific.py", "posProbPlot"),
+									   ("create_colocHeatMap.py", "heatPlotData")]]
+
+	return [colocalization, subset] + plots
+
+#--- Combine stages of all rows; identical stages are merged and different stages may not share outputs
+def build_pipeline(rows):
+	stages = {}
+	owners = {}
+
+	for n, row in enumerate(rows):
+		merged = {}
+		for stage in build_stages(row):
+			stage.deps = [merged[id(dep)] for dep in stage.deps]
+			unique = stages.setdefault(stage.spec(), stage)
+			unique.rows.append(n+1)
+			merged[id(stage)] = unique
+
+			for output in unique.outputs:
+				if owners.setdefault(output, unique) is not unique:
+					raise ValueError(f"{output} is written by different stages: {owners[output]} and {unique}; use a different --outfile for each parameter row")
+
+	return list(stages.values())
+
+#--- Share the core budget among stages with workers
+# A few rows on a large machine get many workers each, many rows get one worker each and run side by side
+def assign_cores(stages, budget):
+	parallel = [stage for stage in stages if stage.workers]
+	share, spare = divmod(budget, max(1, len(parallel)))
+	for n, stage in enumerate(parallel):
+		stage.cores = max(1, share + (n < spare))
+
+#--- Local modules imported by a script, directly or through other local modules
+def local_modules(script):
+	modules = set()
+	scripts = [script]
+	while scripts:
+		with open(os.path.join(SCRIPT_DIR, scripts.pop())) as fh:
+			tree = ast.parse(fh.read())
+
+		names = set()
+		for node in ast.walk(tree):
+			if isinstance(node, ast.Import):
+				names.update(alias.name for alias in node.names)
+			elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+				names.add(node.module)
+
+		for name in names:
+			module = name.split('.')[0] + ".py"
+			if module not in modules and module != script and os.path.exists(os.path.join(SCRIPT_DIR, module)):
+				modules.add(module)
+				scripts.append(module)
+
+	return sorted(modules)
+
+#--- File content hashes
+# Hashes are remembered by file size and modification time, so unchanged files are read only once
+class FileHashes:
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.lock = threading.Lock()
+		self.hashes = {}
+		if os.path.exists(filename):
+			with open(filename) as fh:
+				self.hashes = json.load(fh)
+
+	def __call__(self, path):
+		stat = os.stat(path)
+		fingerprint = [stat.st_size, stat.st_mtime_ns]
+		key = os.path.abspath(path)
+
+		with self.lock:
+			if key in self.hashes and self.hashes[key][:2] == fingerprint:
+				return self.hashes[key][2]
+
+		digest = hashlib.sha256()
+		with open(path, "rb") as fh:
+			for block in iter(lambda: fh.read(2**20), b""):
+				digest.update(block)
+
+		with self.lock:
+			self.hashes[key] = fingerprint + [digest.hexdigest()]
+
+		return digest.hexdigest()
+
+	def save(self):
+		with self.lock:
+			with open(self.filename, "w") as fh:
+				json.dump(self.hashes, fh)
+
+#--- Stage cache
+# records/<key>.json lists the content hashes of the outputs of a stage key, objects/<hash> holds the outputs
+class StageCache:
+
+	def __init__(self, directory):
+		self.directory = directory
+		for sub in ["records", "objects", "logs"]:
+			os.makedirs(os.path.join(directory, sub), exist_ok=True)
+		self.hashes = FileHashes(os.path.join(directory, "hashes.json"))
+
+	def key(self, stage):
+		description = {
+			"script" : stage.script,
+			"script_hash" : self.hashes(os.path.join(SCRIPT_DIR, stage.script)),
+			"modules" : [(module, self.hashes(os.path.join(SCRIPT_DIR, module))) for module in local_modules(stage.script)],
+			"params" : stage.params,
+			"inputs" : [(name, self.hashes(path)) for name, path in stage.inputs],
+			"outputs" : stage.outputs,
+		}
+		return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+	def record(self, key):
+		path = os.path.join(self.directory, "records", f"{key}.json")
+		if not os.path.exists(path):
+			return None
+		with open(path) as fh:
+			return json.load(fh)
+
+	def object(self, digest):
+		return os.path.join(self.directory, "objects", digest)
+
+	# outputs of a cached key are restored if they are missing or were overwritten
+	def restore(self, record):
+		restored = False
+		for output, digest in record.items():
+			if not os.path.exists(self.object(digest)):
+				return None
+			if not os.path.exists(output) or self.hashes(output) != digest:
+				shutil.copyfile(self.object(digest), output)
+				restored = True
+
+		return 'restored' if restored else 'cached'
+
+	def store(self, key, outputs):
+		record = {}
+		for output in outputs:
+			digest = self.hashes(output)
+			if not os.path.exists(self.object(digest)):
+				shutil.copyfile(output, self.object(digest) + ".tmp")
+				os.replace(self.object(digest) + ".tmp", self.object(digest))
+			record[output] = digest
+
+		with open(os.path.join(self.directory, "records", f"{key}.json"), "w") as fh:
+			json.dump(record, fh, indent=4)
+
+	def log(self, key):
+		return os.path.join(self.directory, "logs", f"{key}.log")
+
+#--- Run a stage unless its key is cached
+def run_stage(stage, cache, dry_run=False):
+	start = time.perf_counter()
+	key = cache.key(stage)
+	stage.log = cache.log(key)
+
+	record = cache.record(key)
+	status = cache.restore(record) if record is not None and not dry_run else None
+	if record is not None and dry_run:
+		status = 'cached'
+
+	if status is None and dry_run:
+		status = 'would run'
+	elif status is None:
+		with open(stage.log, "w") as fh:
+			completed = subprocess.run(stage.command(), stdout=fh, stderr=subprocess.STDOUT, env=dict(os.environ, PYTHONUNBUFFERED="1"))
+
+		if completed.returncode == 0 and all(os.path.exists(output) for output in stage.outputs):
+			cache.store(key, stage.outputs)
+			status = 'ran'
+		else:
+			status = 'failed'
+
+	# checks also apply to cached outputs, which may have been made by earlier versions of the scripts
+	if status in ['ran', 'cached', 'restored'] and stage.check:
+		stage.message = stage.check(stage.outputs) or ""
+		if stage.message:
+			status = 'failed'
+
+	stage.status = status
+	stage.runtime = time.perf_counter() - start
+
+	return stage
+
+#--- Run all stages; a stage starts once all stages it depends on are done and enough cores are free
+def run_pipeline(stages, cache, cores=1, dry_run=False):
+	pending = list(stages)
+	running = {}
+	busy = 0
+	finished = 0
+	start = time.perf_counter()
+
+	with ThreadPoolExecutor(max(1, cores)) as executor:
+		while pending or running:
+
+			# stages after failed stages are skipped, stages after stages that would run would run too
+			for stage in list(pending):
+				if any(dep.status in ['failed', 'skipped'] for dep in stage.deps):
+					stage.status = 'skipped'
+				elif any(dep.status == 'would run' for dep in stage.deps):
+					stage.status = 'would run'
+				else:
+					continue
+				pending.remove(stage)
+				finished += 1
+				report(stage, finished, len(stages))
+
+			ready = [stage for stage in pending if all(dep.status in ['ran', 'cached', 'restored'] for dep in stage.deps)]
+			for stage in ready:
+				# a stage larger than the free cores waits, unless nothing is running
+				if busy + stage.cores > cores and running:
+					continue
+				pending.remove(stage)
+				busy += stage.cores
+				stage.start = time.perf_counter() - start
+				running[executor.submit(run_stage, stage, cache, dry_run)] = stage
+
+			if not running:
+				continue
+
+			done, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in done:
+				stage = future.result()
+				del running[future]
+				busy -= stage.cores
+				finished += 1
+				report(stage, finished, len(stages))
+
+	cache.hashes.save()
+
+#--- Progress status
+def report(stage, finished, total):
+	print("# {:>4d} of {:<4d} {:>10s} {:8.1f} s {:>4d} cores    {}".format(finished, total, stage.status, stage.runtime, stage.cores, stage), flush=True)
+	if stage.message:
+		print("#      {}".format(stage.message), flush=True)
+
+#--- Table of all stages
+def dataOUT(stages, outname):
+	with open(outname, "w", newline='') as fh:
+		writer = csv.writer(fh)
+		writer.writerow(["ROWS", "SCRIPT", "OUTPUTS", "STATUS", "CORES", "START", "RUNTIME", "LOG", "MESSAGE"])
+		for stage in sorted(stages, key=lambda stage: stage.start):
+			writer.writerow([" ".join(str(row) for row in stage.rows), stage.script, " ".join(stage.outputs), stage.status,
+							 stage.cores, "{:.1f}".format(stage.start), "{:.1f}".format(stage.runtime), stage.log, stage.message])
+
+#--- Main function
+def main(argv=None):
+	args = get_args(argv)
+
+	rows = read_parameters(args.parameters)
+	stages = build_pipeline(rows)
+	cache = StageCache(args.cache)
+	assign_cores(stages, args.cores)
+
+	print("# {} parameter rows, {} stages, {} cores".format(len(rows), len(stages), args.cores))
+	start = time.perf_counter()
+	run_pipeline(stages, cache, args.cores, args.dry_run == 'True')
+	wall_time = time.perf_counter() - start
+
+	dataOUT(stages, args.summary)
+
+	statuses = [stage.status for stage in stages]
+	print("# " + ", ".join("{} {}".format(statuses.count(status), status) for status in ['ran', 'cached', 'restored', 'would run', 'failed', 'skipped'] if status in statuses))
+
+	# share of the core budget used by running stages
+	core_time = sum(stage.cores * stage.runtime for stage in stages if stage.status in ['ran', 'failed'])
+	print("# {:.1f} s wall time, {:.0%} of the core budget used; summary in {}".format(wall_time, core_time / max(wall_time * args.cores, 1e-9), args.summary))
+
+	if 'failed' in statuses:
+		print("# Logs of failed stages are in {}".format(os.path.join(args.cache, "logs")))
+		sys.exit(1)
+
+#--- Run main function
+if __name__ == '__main__':
+	main()
+
+# Ankit Roy
+# 19th October, 2026
+#	--> Stages are scheduled under a core budget, SpotColocalization.py runs get a share of it as worker processes.
+#	--> Writes a summary table with the status and timings of all stages.
+#	--> Stage keys include the local modules a script imports (e.g. instrumentation.py), so changes to them rerun the stage.
+#	--> getStat_TracksColocalized.py stages fail with a message when the colocalized track subset is empty, instead of failing the stages after them.
@@ -1,42 +1,108 @@
 #!/Users/roy/mambaforge/bin/python
 
-import sys
+import argparse
 import pickle
 import numpy as np
 import pandas as pd
-from skimage import img_as_float, img_as_ubyte, io
+from scipy import ndimage as nd
+from tiff_stack import TiffStack
+from mask_archive import openMask
+from instrumentation import Instrumentation, timed
 
 # Import images
+# Frames are read lazily as float32
 def readImg(filename):
-    img = img_as_float(io.imread(filename))
+    img = TiffStack(filename)
     return img
 
+# Import segmentation masks from TIFF stacks or mask archives (.npz)
+# Frames are read lazily as booleans
+@timed
+def readMask(filename):
+    mask = openMask(filename)
+    return mask
+
 # Import background data
 def getBackground(background_file):
     with open(background_file, "rb") as fh:
         ch_background = pickle.load(fh)
     return ch_background
 
-# Calculate patterning index
-def calcPatterningRatio(img, segmented_img, channel, background):
+# Import per-pixel background models (background_model.npz from pickle_background.py)
+# Returns the mean background per channel and the per-pixel background mean images
+@timed
+def getBackgroundModel(background_file, channels):
+    with np.load(background_file) as model:
+        ch_background = {ch: float(model[f"{ch}_scalar"]) for ch in channels}
+        ch_images = {ch: model[f"{ch}_mean"] for ch in channels}
+    return ch_background, ch_images
+
+# Flat-field corrected image stack
+# Frames are background subtracted pixel by pixel and divided by the illumination profile,
+# taken as the background image normalised to a mean of 1
+class FlatField:
+
+    def __init__(self, img, background):
+        if tuple(background.shape) != tuple(img.shape[1:]):
+            raise ValueError(f"background image shape {background.shape} does not match frame shape {img.shape[1:]}")
+
+        self.img = img
+        self.shape = img.shape
+        self.background = background.astype(np.float32)
+        self.gain = (background.mean() / np.maximum(background, np.finfo(np.float32).eps)).astype(np.float32)
+
+    def __len__(self):
+        return len(self.img)
+
+    def __getitem__(self, t):
+        return (self.img[t] - self.background) * self.gain
+
+# Calculate per-frame intensity sums inside and outside segmented regions for all channels
+# Frames are processed in small blocks, which keeps temporaries in cache; each mask block is read once and shared by all channels
+@timed
+def calcPatternSums(imgs, segmented_img, block_size=4):
 
     total_t = len(segmented_img)            # total time in timeseries
 
+    # pixel counts inside and outside segmented regions
+    n_in = np.zeros(total_t)
+    n_out = np.zeros(total_t)
+    # intensity sums inside and outside segmented regions
+    sums = {channel: (np.zeros(total_t), np.zeros(total_t)) for channel in imgs}
+
+    for start in range(0, total_t, block_size):
+        stop = min(start + block_size, total_t)
+
+        # masks as float32 weights, flattened per frame
+        mask = segmented_img[start:stop].reshape(stop - start, -1)
+        weights = mask.astype(np.float32)
+
+        n_in[start:stop] = np.count_nonzero(mask, axis=1)
+        n_out[start:stop] = mask.shape[1] - n_in[start:stop]
+
+        # masked sums inside; sums outside from frame totals
+        for channel, img in imgs.items():
+            frames = img[start:stop].reshape(stop - start, -1)
+            # both sums are accumulated in float64, so that sums outside keep the precision of sums inside
+            sum_in = np.sum(frames * weights, axis=1, dtype=np.float64)
+            sums[channel][0][start:stop] = sum_in
+            sums[channel][1][start:stop] = np.sum(frames, axis=1, dtype=np.float64) - sum_in
+
+    return sums, n_in, n_out
+
+# Calculate patterning index
+# Background subtracted statistics use flat-field corrected sums if given, else the mean background of the channel
+def calcPatterningRatio(sum_in, sum_out, n_in, n_out, channel, background, sums_BS=None):
+
     # store pattern data
     patternData = {
-        'frame' : np.zeros(total_t),
-        'avgI_in' : np.zeros(total_t),
-        'avgI_out' : np.zeros(total_t),
-    }
-
-    # calculate pattern statistics
-    for t in range(total_t):
         # current frame
-        patternData['frame'][t] = t
+        'frame' : np.arange(len(n_in), dtype=float),
         # average instensity inside segmented regions
-        patternData['avgI_in'][t] = np.sum(img[t]*segmented_img[t]) / np.sum(segmented_img[t])
+        'avgI_in' : sum_in / n_in,
         # average instensity outside segmented regions
-        patternData['avgI_out'][t] = np.sum(img[t]*~segmented_img[t]) / np.sum(~segmented_img[t])
+        'avgI_out' : sum_out / n_out,
+    }
 
     # create data frame from pattern data
     patternData = pd.DataFrame.from_dict(patternData)
@@ -45,8 +111,12 @@ def calcPatterningRatio(img, segmented_img, channel, background):
     patternData['PI'] = patternData['avgI_in'] / patternData['avgI_out']
 
     # caculate pattern statistics with background subtraction
-    patternData['avgI_in_BS'] = patternData['avgI_in'] - background[channel]
-    patternData['avgI_out_BS'] = patternData['avgI_out'] - background[channel]
+    if sums_BS is None:
+        patternData['avgI_in_BS'] = patternData['avgI_in'] - background[channel]
+        patternData['avgI_out_BS'] = patternData['avgI_out'] - background[channel]
+    else:
+        patternData['avgI_in_BS'] = sums_BS[0] / n_in
+        patternData['avgI_out_BS'] = sums_BS[1] / n_out
     patternData['PI_BS'] = patternData['avgI_in_BS'] / patternData['avgI_out_BS']
     
     # set frame as index
@@ -57,6 +127,117 @@ def calcPatterningRatio(img, segmented_img, channel, background):
 
     return patternData
 
+# Label connected patches of a block of frames and sum pixel counts, coordinates and intensities per patch
+# The structuring element has depth 1 along time, so patches never connect across frames
+# and labels increase frame by frame
+def labelPatches(imgs, mask, start):
+
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = nd.generate_binary_structure(2, 1)
+    labels, n_labels = nd.label(mask, structure)
+
+    total_t, height, width = mask.shape
+
+    # frame of every patch from the number of patches per frame
+    last_label = np.maximum.accumulate(labels.reshape(total_t, -1).max(axis=1))
+    counts = np.diff(last_label, prepend=0)
+
+    # labeled reductions over patch pixels only
+    pixels = np.flatnonzero(labels)
+    patch = labels.ravel()[pixels] - 1
+    y, x = np.divmod(pixels % (height * width), width)
+
+    area = np.bincount(patch, minlength=n_labels)
+    patchData = {
+        'frame' : np.repeat(np.arange(start, start + total_t), counts).astype(float),
+        'Area' : area,
+        'Centroid_X' : np.bincount(patch, weights=x, minlength=n_labels) / area,
+        'Centroid_Y' : np.bincount(patch, weights=y, minlength=n_labels) / area,
+    }
+    for channel, img in imgs.items():
+        frames = img[start:start + total_t]
+        patchData[f'{channel}_avgI'] = np.bincount(patch, weights=frames.ravel()[pixels], minlength=n_labels) / area
+
+    return labels, n_labels, patchData
+
+# Overlapping patch pairs of consecutive frames and their overlap in pixels
+# Pairs are run-length encoded along image rows before counting, since neighbouring pixels mostly share a pair
+def patchOverlaps(labels):
+    keys = (labels[:-1].astype(np.int64) << 32) | labels[1:]
+    keys = keys.ravel()
+
+    starts = np.flatnonzero(np.diff(keys, prepend=-1))
+    lengths = np.diff(starts, append=len(keys))
+    keys = keys[starts]
+
+    # runs inside patches in both frames
+    overlapping = ((keys >> 32) > 0) & ((keys & 0xFFFFFFFF) > 0)
+    keys, index = np.unique(keys[overlapping], return_inverse=True)
+    overlap = np.bincount(index, weights=lengths[overlapping]).astype(np.int64)
+
+    return keys >> 32, keys & 0xFFFFFFFF, overlap
+
+# Link patches of consecutive frames that are each other's largest overlap
+# Unlinked patches, e.g. the smaller parts of splits and merges, start new tracks
+def linkPatches(previous, current, overlap, n_labels):
+
+    # largest overlap of every patch with the next and the previous frame
+    order = np.lexsort((-overlap, previous))
+    first = np.unique(previous[order], return_index=True)[1]
+    successor = np.zeros(n_labels + 1, dtype=np.int64)
+    successor[previous[order][first]] = current[order][first]
+
+    order = np.lexsort((-overlap, current))
+    first = np.unique(current[order], return_index=True)[1]
+    predecessor = np.zeros(n_labels + 1, dtype=np.int64)
+    predecessor[current[order][first]] = previous[order][first]
+
+    # patches pointing to their mutual best predecessor, followed back to the first patch of each track
+    root = np.arange(n_labels + 1)
+    mutual = successor[predecessor] == root
+    root[mutual & (predecessor > 0)] = predecessor[mutual & (predecessor > 0)]
+    while np.any(root[root] != root):
+        root = root[root]
+
+    # tracks numbered by first appearance
+    track = np.unique(root[1:], return_inverse=True)[1] + 1
+
+    return track
+
+# Calculate per-patch statistics for all channels and link patches over time
+@timed
+def calcPatchStats(imgs, segmented_img, block_size=16):
+
+    total_t = len(segmented_img)            # total time in timeseries
+
+    blocks = []
+    previous, current, overlap = [], [], []
+    offset = 0
+    last_frame = None
+
+    for start in range(0, total_t, block_size):
+        stop = min(start + block_size, total_t)
+
+        labels, n_labels, patchData = labelPatches(imgs, segmented_img[start:stop], start)
+        labels[labels > 0] += offset
+        blocks.append(patchData)
+
+        # overlaps within the block and with the last frame of the previous block
+        if last_frame is not None:
+            labels = np.concatenate([last_frame[None], labels])
+        pairs = patchOverlaps(labels)
+        previous.append(pairs[0])
+        current.append(pairs[1])
+        overlap.append(pairs[2])
+
+        last_frame = labels[-1]
+        offset += n_labels
+
+    patchData = pd.DataFrame({col: np.concatenate([block[col] for block in blocks]) for col in blocks[0]})
+    patchData.insert(1, 'patch', linkPatches(np.concatenate(previous), np.concatenate(current), np.concatenate(overlap), offset))
+
+    return patchData
+
 # Normalize activity channel for enrichment calculations
 def preEnrichment_normalization(data, active, total):
     return data[active]/data[total]
@@ -66,53 +247,53 @@ def calc_enrichment(data, avgI_in, avgI_out):
     return data[avgI_in]/data[avgI_out]
 
 # Write output files
+@timed
 def dataOUT(data, filename):
     outname = '-'.join(filename.split('_C=')[:-1])
     outname = f'{outname}-analyzed.csv'
 
     data.to_csv(outname, index=True)
 
-# Main function
-def main():
-    segmented_file = sys.argv[1]            # segmentation file
-    lipid_file = sys.argv[2]                # lipid channel file
-    total_GTPase_file = sys.argv[3]         # total GTPase channel file
-    active_GTPase_file = sys.argv[4]        # active GTPase channel file
-    background_file = sys.argv[5]           # background data file
-
-    segmentation_map = np.bool_(readImg(segmented_file))    # segmentation map
+# Write per-patch time series
+@timed
+def dataOUT_patches(data, filename):
+    outname = '-'.join(filename.split('_C=')[:-1])
+    outname = f'{outname}-patches.csv'
+
+    data.to_csv(outname, index=False)
+
+# Pattern analysis of one set of image stacks
+def analyse(segmented_file, lipid_file, total_GTPase_file, active_GTPase_file, background_file):
+    segmentation_map = readMask(segmented_file)             # segmentation map
     lipid_img = readImg(lipid_file)                         # lipid channel image data
     total_GTPase_img = readImg(total_GTPase_file)           # total GTPase channel image data
     active_GTPase_img = readImg(active_GTPase_file)         # active GTPase channel image data
-    ch_background = getBackground(background_file)          # background data
-
-    # Pattern statistics for the lipid channel
-    lipid_pattern = calcPatterningRatio(
-        lipid_img,
-        segmentation_map,
-        "Lipid",
-        ch_background
-        )
-    # Pattern statistics for the total GTPase channel
-    total_GTPase_pattern = calcPatterningRatio(
-        total_GTPase_img,
-        segmentation_map,
-        "Total",
-        ch_background
-        )
-    # Pattern statistics for the active GTPase channel
-    active_GTPase_pattern = calcPatterningRatio(
-        active_GTPase_img,
-        segmentation_map,
-        "Active",
-        ch_background
-        )
+
+    channel_imgs = {
+        "Lipid" : lipid_img,
+        "Total" : total_GTPase_img,
+        "Active" : active_GTPase_img,
+        }
+
+    # background data; per-pixel background models add flat-field corrected channels
+    corrected_imgs = {}
+    if background_file.endswith('.npz'):
+        ch_background, ch_images = getBackgroundModel(background_file, channel_imgs)
+        corrected_imgs = {f"{channel}_BS" : FlatField(img, ch_images[channel]) for channel, img in channel_imgs.items()}
+    else:
+        ch_background = getBackground(background_file)
+
+    # Intensity sums inside and outside segmented regions for all channels in one pass
+    sums, n_in, n_out = calcPatternSums({**channel_imgs, **corrected_imgs}, segmentation_map)
+
+    # Pattern statistics for the lipid, total GTPase and active GTPase channels
+    patterns = [
+        calcPatterningRatio(*sums[channel], n_in, n_out, channel, ch_background, sums.get(f"{channel}_BS"))
+        for channel in channel_imgs
+        ]
 
     # Combine pattern statistics from all channels
-    analyzed_data = pd.concat(
-        [lipid_pattern, total_GTPase_pattern, active_GTPase_pattern],
-        axis=1
-    )
+    analyzed_data = pd.concat(patterns, axis=1)
 
     # Normalize active GTPase channel for enrichment calculation
     analyzed_data['Active_Norm_in'] = preEnrichment_normalization(analyzed_data, "Active_avgI_in", "Total_avgI_in")
@@ -124,11 +305,74 @@ def main():
     analyzed_data['Active_Enrichment_in'] = calc_enrichment(analyzed_data, "Active_Norm_in", "Active_Norm_out")
     analyzed_data['Active_Enrichment_in_BS'] = calc_enrichment(analyzed_data, "Active_Norm_in_BS", "Active_Norm_out_BS")
 
+    # Per-patch statistics linked over time
+    patch_data = calcPatchStats({**channel_imgs, **corrected_imgs}, segmentation_map)
+
+    # Per-patch statistics with background subtraction
+    for channel in channel_imgs:
+        if f'{channel}_BS_avgI' in patch_data:
+            patch_data[f'{channel}_avgI_BS'] = patch_data.pop(f'{channel}_BS_avgI')
+        else:
+            patch_data[f'{channel}_avgI_BS'] = patch_data[f'{channel}_avgI'] - ch_background[channel]
+
+    # Normalize active GTPase channel and calculate enrichment against the outside of patches in the same frame
+    patch_data['Active_Norm'] = preEnrichment_normalization(patch_data, "Active_avgI", "Total_avgI")
+    patch_data['Active_Norm_BS'] = preEnrichment_normalization(patch_data, "Active_avgI_BS", "Total_avgI_BS")
+    patch_data['Active_Enrichment'] = patch_data['Active_Norm'] / patch_data['frame'].map(analyzed_data['Active_Norm_out'])
+    patch_data['Active_Enrichment_BS'] = patch_data['Active_Norm_BS'] / patch_data['frame'].map(analyzed_data['Active_Norm_out_BS'])
+
+    # per-patch time series
+    patch_data = patch_data.sort_values(['patch', 'frame'], kind='stable')
+
     # Write output files
     dataOUT(analyzed_data, segmented_file)
+    dataOUT_patches(patch_data, segmented_file)
+
+# Arguments are taken from the command line unless given as a list
+def get_args(argv=None):
+    parser = argparse.ArgumentParser()
+
+    # Segmentation file
+    parser.add_argument("segmented_file",
+                        help = "Segmentation mask stack (_segmented.tif) or mask archive (.npz)")
+
+    # Channel files
+    parser.add_argument("lipid_file",
+                        help = "Lipid channel image stack")
+    parser.add_argument("total_GTPase_file",
+                        help = "Total GTPase channel image stack")
+    parser.add_argument("active_GTPase_file",
+                        help = "Active GTPase channel image stack")
+
+    # Background data
+    parser.add_argument("background_file",
+                        help = "Background data file (.p) or per-pixel background model (.npz)")
+
+    # Profiling
+    parser.add_argument("--profile",
+                        help = "(default = False) Write cProfile stats of the run (-profile.prof)",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    args = parser.parse_args(argv)
+
+    return args
+
+# Main function
+def main(argv=None):
+    args = get_args(argv)
+
+    instrument = Instrumentation(args.profile == 'True')   # stage timings
+    with instrument:
+        analyse(args.segmented_file, args.lipid_file, args.total_GTPase_file, args.active_GTPase_file, args.background_file)
+
+    # Write stage timings
+    outname = '-'.join(args.segmented_file.split('_C=')[:-1])
+    instrument.dataOUT(f'{outname}-timings.json', f'{outname}-profile.prof')
 
 # Run main function
-main()
+if __name__ == '__main__':
+    main()
 
 # Ankit Roy
 # 9th January, 2023
@@ -136,4 +380,14 @@ main()
 # 20th June, 2023           >>      Revamped entire script to be more Pythonic.
 #                           >>      Added calculations for all metrics with background subtraction.
 #                           >>      Uses background data from a pre-generated pickle file.
-#                           >>      Added comments.
\ No newline at end of file
+#                           >>      Added comments.
+# 19th October, 2026        >>      Image stacks and segmentation maps are read lazily frame by frame.
+#                           >>      Segmentation maps can be read from compressed mask archives (.npz).
+#                           >>      In/out intensity sums of all channels are computed in one vectorized pass over blocks of frames.
+#                           >>      Added per-patch statistics of labeled segmentation patches linked over time by overlap (-patches.csv).
+#                           >>      Background subtracted metrics are flat-field corrected with per-pixel background models (.npz).
+#                           >>      main can be imported and called with a list of arguments (batch processing).
+#                           >>      Records wall time, CPU time, peak memory and row counts of every stage (-timings.json).
+#                           >>      Optional --profile flag writes cProfile stats (-profile.prof).
+#                           >>      Intensity sums inside and outside patches are accumulated in float64.
+#                           >>      Arguments are parsed with argparse (--help); --profile takes True or False.
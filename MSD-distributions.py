@@ -1,95 +1,475 @@
 #!/Users/roy/mambaforge/bin/python
 
 # This script is used to calculate the distribution of Mean Squared Displacement for Single Molecule tracks.
-# Input: Step size data file generated using StepSize-distribution.R
+# Input: TrackMate spot statistics file or step size data file generated using StepSize-distribution.R
 
+import argparse
+import multiprocessing as mp
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import sys
+from instrumentation import Instrumentation, timed
+
+# Fetch arguments
+def get_args(argv=None):
+    parser = argparse.ArgumentParser()
+
+    # Track data files
+    parser.add_argument("files",
+                        help = "TrackMate spot statistics files or step size data files generated using StepSize-distribution.R",
+                        nargs = "+")
+
+    # Write step size data
+    parser.add_argument("--write_stepsize",
+                        help = "(default = False) Write step size data (_stepsize-data.csv) for TrackMate input files.",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    # Step size histogram bin width
+    parser.add_argument("--hist_binwidth",
+                        help = "(default = 0.01 µm) Bin width of the step size histogram.",
+                        default = 0.01,
+                        type = float)
+
+    # Step size histogram range
+    parser.add_argument("--hist_max",
+                        help = "(default = 0.81 µm) Largest step size in the step size histogram.",
+                        default = 0.81,
+                        type = float)
+
+    # Time resolution
+    parser.add_argument("-tr", "--time_resolution",
+                        help = "(default = 0.022 s) Time resolution",
+                        default = 0.022,
+                        type = float)
+
+    # Per-track analysis
+    parser.add_argument("--per_track",
+                        help = "(default = False) Also fit diffusion coefficient and anomalous exponent for every track.",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    # Lags used for per-track fits
+    parser.add_argument("--fit_lags",
+                        help = "(default = 4) Number of initial lags used to fit per-track MSDs.",
+                        default = 4,
+                        type = int)
+
+    # Jump distance analysis
+    parser.add_argument("--jump_distance",
+                        help = "(default = False) Fit Rayleigh mixtures to jump distance distributions to resolve diffusive sub-populations.",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    # Lags used for jump distance analysis
+    parser.add_argument("--jd_lags",
+                        help = "(default = 4) Number of lags for jump distance analysis.",
+                        default = 4,
+                        type = int)
+
+    # Maximum number of diffusive components
+    parser.add_argument("--jd_components",
+                        help = "(default = 3) Fit mixtures with 1 up to this number of components.",
+                        choices = [1, 2, 3],
+                        default = 3,
+                        type = int)
+
+    # Maximum number of EM iterations
+    parser.add_argument("--jd_max_iter",
+                        help = "(default = 500) Maximum number of EM iterations.",
+                        default = 500,
+                        type = int)
+
+    # Number of processes
+    parser.add_argument("--processes",
+                        help = "(default = all cores) Number of files analysed in parallel.",
+                        default = mp.cpu_count(),
+                        type = int)
+
+    # Profiling
+    parser.add_argument("--profile",
+                        help = "(default = False) Write cProfile stats for every input file (_profile.prof).",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    args = parser.parse_args(argv)
+
+    return args
 
 # Get data
+# Reads only the track columns from TrackMate exports or step size data files
+@timed
 def dataIN(filename):
-    return pd.read_csv(filename)
+    data = pd.read_csv(filename,
+        comment = "#",
+        usecols = ["TRACK_ID", "FRAME", "POSITION_X", "POSITION_Y"],
+        dtype = {"TRACK_ID" : str},
+        keep_default_na = False)
+
+    # Remove spots that are not part of tracks; columns are set on a copy, not a view of the full table
+    data = data[data.TRACK_ID != "None"].copy()
+
+    # Drop descriptive header rows of newer TrackMate exports
+    for col in ["FRAME", "POSITION_X", "POSITION_Y"]:
+        data[col] = pd.to_numeric(data[col], errors="coerce")
+    data = data.dropna()
+
+    data = data.astype({"TRACK_ID" : np.int64, "FRAME" : np.int64})
+
+    # Sort spots along tracks
+    data = data.sort_values(["TRACK_ID", "FRAME"], kind="stable").reset_index(drop=True)
+
+    return data
+
+# Calculate step sizes between consecutive spots of every track
+# Spots are sorted by track and frame; the first spot of a track has a step of 0
+# DEL_FRAME is the number of frames spanned by a step and exceeds 1 across frame gaps
+@timed
+def calc_StepSize(data):
+    track = data.TRACK_ID.to_numpy()
+    same_track = np.concatenate(([False], track[1:] == track[:-1]))
+
+    for col, delta in [("FRAME", "DEL_FRAME"), ("POSITION_X", "DEL_X"), ("POSITION_Y", "DEL_Y")]:
+        values = data[col].to_numpy()
+        data[delta] = np.where(same_track, values - np.concatenate((values[:1], values[:-1])), 0)
+
+    data["SQ_DISP"] = data.DEL_X**2 + data.DEL_Y**2
+    data["STEP_SIZE"] = np.sqrt(data.SQ_DISP)
+
+    return data
+
+# Histogram of single frame step sizes
+@timed
+def calc_StepHistogram(data, binwidth=0.01, max_step=0.81):
+    steps = data.loc[data.DEL_FRAME == 1, "STEP_SIZE"].to_numpy()
+    edges = np.arange(0, max_step + binwidth / 2, binwidth)
+    counts, edges = np.histogram(steps, bins=edges)
+
+    hist_data = pd.DataFrame(
+        {
+            'BIN_START' : edges[:-1],
+            'BIN_END' : edges[1:],
+            'COUNT' : counts,
+            'DENSITY' : counts / max(len(steps), 1) / binwidth
+        }
+    )
+
+    return hist_data
 
 # Calculate time from frames
+@timed
 def calc_time(data, interval=0.022):
     data['TIME'] = data.FRAME * interval
     return data
 
 # Calculate lifetime for each track
+@timed
 def calc_lifetime(data):
-    data["LIFETIME"] = data.groupby("TRACK_ID")["FRAME"].transform(lambda x: x - x.min())
+    data["LIFETIME"] = data.FRAME - data.groupby("TRACK_ID")["FRAME"].transform("min")
     return data
 
-# Calculate MSD for each time window
+# Next power of two large enough for a linear (non-circular) correlation
+def fft_length(span):
+    return 1 << int(2 * span - 1).bit_length()
+
+# Correlation sum_i a[i] * b[i+k] for all lags k along the last axis
+def correlate(a_fft, b_fft, nfft, nlags):
+    return np.fft.irfft(np.conj(a_fft) * b_fft, nfft, axis=-1)[..., :nlags]
+
+# Time-averaged squared displacements of tracks laid out on a frame grid
+# x, y and mask have shape (tracks, frames); missing frames are masked out
+def calc_TrackMSD(x, y, mask, nlags):
+    nfft = fft_length(x.shape[1])
+    r2 = x**2 + y**2
+
+    m_fft = np.fft.rfft(mask, nfft, axis=-1)
+    mx_fft = np.fft.rfft(mask * x, nfft, axis=-1)
+    my_fft = np.fft.rfft(mask * y, nfft, axis=-1)
+    mr2_fft = np.fft.rfft(mask * r2, nfft, axis=-1)
+
+    # |r(i+k) - r(i)|^2 = r2(i+k) + r2(i) - 2 r(i).r(i+k), summed over valid pairs
+    sq_sums = correlate(m_fft, mr2_fft, nfft, nlags) \
+        + correlate(mr2_fft, m_fft, nfft, nlags) \
+        - 2 * (correlate(mx_fft, mx_fft, nfft, nlags) + correlate(my_fft, my_fft, nfft, nlags))
+    counts = np.rint(correlate(m_fft, m_fft, nfft, nlags)).astype(np.int64)
+
+    # remove round-off where no displacement pairs exist
+    sq_sums[counts == 0] = 0
+    sq_sums = np.clip(sq_sums, 0, None)
+
+    return sq_sums, counts
+
+# Iterate over batches of tracks with similar lifetimes
+# Yields track IDs, sums of squared displacements and pair counts for lags 0 to max_lag
+def iter_TrackBatches(data, max_lag=None, batch_size=2**22):
+    track_ids, track_index = np.unique(data.TRACK_ID.to_numpy(), return_inverse=True)
+    lifetime = data.LIFETIME.to_numpy(dtype=np.int64)
+
+    # centre coordinates on each track to keep FFT round-off small
+    x = data.POSITION_X.to_numpy(dtype=float)
+    y = data.POSITION_Y.to_numpy(dtype=float)
+    nspots = np.bincount(track_index)
+    x = x - (np.bincount(track_index, weights=x) / nspots)[track_index]
+    y = y - (np.bincount(track_index, weights=y) / nspots)[track_index]
+
+    # frame span of each track and the FFT length it needs
+    span = np.zeros(len(track_ids), dtype=np.int64)
+    np.maximum.at(span, track_index, lifetime + 1)
+    nfft = np.array([fft_length(n) for n in span], dtype=np.int64)
+
+    # tracks grouped by FFT length, spots ordered to match
+    track_order = np.lexsort((np.arange(len(track_ids)), nfft))
+    track_rank = np.empty_like(track_order)
+    track_rank[track_order] = np.arange(len(track_order))
+    spot_order = np.argsort(track_rank[track_index], kind="stable")
+    spot_start = np.concatenate(([0], np.cumsum(nspots[track_order])))
+
+    for length in np.unique(nfft):
+        bucket = np.flatnonzero(nfft[track_order] == length)
+        chunk = max(1, batch_size // int(length))
+
+        for first in range(bucket[0], bucket[-1] + 1, chunk):
+            last = min(first + chunk, bucket[-1] + 1)
+            tracks = track_order[first:last]
+            width = int(span[tracks].max())
+            nlags = width if max_lag is None else min(width, max_lag + 1)
+
+            # spots of the tracks in this batch
+            spots = spot_order[spot_start[first]:spot_start[last]]
+            row = track_rank[track_index[spots]] - first
+
+            # tracks on a frame grid
+            grid_x = np.zeros((len(tracks), width))
+            grid_y = np.zeros((len(tracks), width))
+            grid_mask = np.zeros((len(tracks), width))
+            grid_x[row, lifetime[spots]] = x[spots]
+            grid_y[row, lifetime[spots]] = y[spots]
+            grid_mask[row, lifetime[spots]] = 1
+
+            sq_sums, counts = calc_TrackMSD(grid_x, grid_y, grid_mask, nlags)
+
+            yield track_ids[tracks], sq_sums, counts
+
+# Calculate time-averaged MSD for every lag, pooled over all tracks
+@timed
 def calc_MSD(data, time_interval = 0.022):
     # Maximum lifetime
-    max_lifetime = data.LIFETIME.max()
-    
-    # Array of step sizes from 1 to the largest lifetime
-    step_size = np.arange(1, max_lifetime)
-    
-    all_steps = np.empty(0)         # store steps where MSD was calculated
-    all_msds = np.empty(0)          # store MSD
-    all_counts = np.empty(0)        # store number of events from which MSD was calculated
-
-    # Iterate through different step sizes
-    for step in step_size:
-        # Break points of tracks with specific step size
-        breaks = np.arange(0, max_lifetime+1, step)[1:]
-        # Initiate array to store squared displacements
-        all_sq_disp = np.empty(0)
-
-        # Iterate through different break points
-        for brk in breaks:
-            # Calculate the sum of squared displacements for broken tracks
-            # Makes sure tracks fall within breakpoints and end at the breakpoint
-            sq_disp = data.loc[
-                (data.LIFETIME >= brk-step) &
-                (data.LIFETIME <= brk), :]\
-                .groupby("TRACK_ID")[["TRACK_ID", "LIFETIME", "SQ_DISP"]]\
-                .filter(lambda x: x["LIFETIME"].max() == step)\
-                .groupby("TRACK_ID")["SQ_DISP"]\
-                .aggregate(lambda x: x.sum())
-            
-            # Store the sum of squared displacements for all breakpoints with the current step size
-            all_sq_disp = np.concatenate((all_sq_disp, np.array(sq_disp)), axis = 0)
-
-        # Count number of tracks in current step size
-        ncount = len(all_sq_disp)
-
-        # Continue if no tracks with current step size found
-        if ncount == 0:
-            continue
-        
-        # Calculate MSD at current step size
-        msd = all_sq_disp.mean()
-        
-        # Store step size, MSD and counts
-        all_steps = np.append(all_steps, step)
-        all_msds = np.append(all_msds, msd)
-        all_counts = np.append(all_counts, ncount)
-
-        # Show progress
-        if step%100 == 0:
-            print(f"Step: {step:5}/{max_lifetime}, MSD: {msd:5.2f}, NCOUNT: {ncount:6}")
-        
+    max_lifetime = int(data.LIFETIME.max())
+
+    all_sq_sums = np.zeros(max_lifetime + 1)                        # summed squared displacements
+    all_pairs = np.zeros(max_lifetime + 1, dtype=np.int64)          # number of displacements
+    all_counts = np.zeros(max_lifetime + 1, dtype=np.int64)         # number of tracks
+
+    # Accumulate displacements from batches of tracks
+    for track_ids, sq_sums, counts in iter_TrackBatches(data):
+        nlags = sq_sums.shape[1]
+        all_sq_sums[:nlags] += sq_sums.sum(axis=0)
+        all_pairs[:nlags] += counts.sum(axis=0)
+        all_counts[:nlags] += (counts > 0).sum(axis=0)
+
+    # Lags with at least one displacement
+    all_steps = np.flatnonzero(all_pairs)
+    all_steps = all_steps[all_steps > 0]
+
     # Generate dataframe for MSD data
     msd_data = pd.DataFrame(
         {
             'Step' : all_steps,
-            'Time' : round(all_steps * time_interval, 3),
-            'Count' : all_counts,
-            'MSD' : all_msds
+            'Time' : np.round(all_steps * time_interval, 3),
+            'Count' : all_counts[all_steps],
+            'MSD' : all_sq_sums[all_steps] / all_pairs[all_steps]
         }
     )
 
     return msd_data
 
+# Calculate MSD for the first lags of every track
+def calc_TrackMSD_table(data, max_lag):
+    all_ids = []
+    all_sq_sums = []
+    all_pairs = []
+
+    # Collect batches padded to a common number of lags
+    for track_ids, sq_sums, counts in iter_TrackBatches(data, max_lag):
+        pad = ((0, 0), (0, max_lag + 1 - sq_sums.shape[1]))
+        all_ids.append(track_ids)
+        all_sq_sums.append(np.pad(sq_sums, pad))
+        all_pairs.append(np.pad(counts, pad))
+
+    # Restore track order
+    all_ids = np.concatenate(all_ids)
+    order = np.argsort(all_ids, kind="stable")
+
+    return all_ids[order], np.concatenate(all_sq_sums)[order], np.concatenate(all_pairs)[order]
+
+# Weighted least squares y = slope * x + intercept for every row at once
+def fit_lines(x, y, weights):
+    sw = weights.sum(axis=1)
+    sx = (weights * x).sum(axis=1)
+    sy = (weights * y).sum(axis=1)
+    sxx = (weights * x * x).sum(axis=1)
+    sxy = (weights * x * y).sum(axis=1)
+
+    # rows with fewer than two points are not fitted
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denominator = sw * sxx - sx**2
+        slope = np.where(sw >= 2, (sw * sxy - sx * sy) / denominator, np.nan)
+        intercept = np.where(sw >= 2, (sy - slope * sx) / sw, np.nan)
+
+    return slope, intercept
+
+# Fit diffusion coefficient and anomalous exponent for every track
+# MSD = 4 D t^alpha on log-log axes, and MSD = 4 D t + offset for the linear estimate
+@timed
+def fit_TrackDiffusion(data, fit_lags=4, time_interval=0.022):
+    track_ids, sq_sums, pairs = calc_TrackMSD_table(data, fit_lags)
+
+    # MSD at lags 1 to fit_lags
+    valid = pairs[:, 1:] > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        msd = np.where(valid, sq_sums[:, 1:] / pairs[:, 1:], 0)
+    time = np.broadcast_to(np.arange(1, fit_lags + 1) * time_interval, msd.shape)
+
+    # anomalous diffusion fit on log-log axes
+    positive = valid & (msd > 0)
+    log_msd = np.log(np.where(positive, msd, 1))
+    alpha, log_intercept = fit_lines(np.log(time), log_msd, positive.astype(float))
+
+    # linear fit with localization offset
+    slope, offset = fit_lines(time, msd, valid.astype(float))
+
+    track_data = pd.DataFrame(
+        {
+            'TRACK_ID' : track_ids,
+            'N_SPOTS' : pairs[:, 0],
+            'N_FIT_LAGS' : valid.sum(axis=1),
+            'D' : np.exp(log_intercept) / 4,
+            'ALPHA' : alpha,
+            'D_LINEAR' : slope / 4,
+            'OFFSET' : offset
+        }
+    )
+
+    return track_data
+
+# Squared jump distances for lags 1 to max_lag
+# Spots are sorted by track and frame; jumps are only taken between spots exactly lag frames apart
+def calc_JumpDistances(data, max_lag):
+    track_index = np.unique(data.TRACK_ID.to_numpy(), return_inverse=True)[1]
+    frame = data.FRAME.to_numpy(dtype=np.int64)
+    x = data.POSITION_X.to_numpy(dtype=float)
+    y = data.POSITION_Y.to_numpy(dtype=float)
+
+    # sorted spot keys unique to track and frame
+    key = track_index * (int(frame.max()) + max_lag + 1) + frame
+
+    all_sq_jumps = []
+    for lag in range(1, max_lag + 1):
+        partner = np.minimum(np.searchsorted(key, key + lag), len(key) - 1)
+        found = key[partner] == key + lag
+        sq_jumps = (x[partner] - x)**2 + (y[partner] - y)**2
+        all_sq_jumps.append(sq_jumps[found])
+
+    return all_sq_jumps
+
+# Fit mixtures of Rayleigh distributions to jump distances of all lags at once
+# In squared jump distance u each component is exponential with mean theta = 4 D t
+# Sums over jumps are taken over the flat jump array of every lag in chunks,
+# so memory beyond the jumps is bounded by the chunk size and not by lags x jumps x components
+def fit_RayleighMixture(all_sq_jumps, ncomponents, max_iter=500, tol=1e-6, chunk_size=2**18):
+    nlags = len(all_sq_jumps)
+    counts = np.array([len(u) for u in all_sq_jumps])
+
+    # initial component means from quantile bins of every lag
+    edges = np.linspace(0, 1, ncomponents + 1)
+    theta = np.array([[np.mean(np.quantile(v, np.linspace(lo, hi, 5))) if len(v) else 1.0
+                       for lo, hi in zip(edges[:-1], edges[1:])]
+                      for v in all_sq_jumps])
+    theta = np.maximum(theta, 1e-12)
+    weights = np.full((nlags, ncomponents), 1 / ncomponents)
+    loglike = np.full(nlags, -np.inf)
+
+    for iteration in range(max_iter):
+        log_prior = np.log(weights) - np.log(theta)
+        rate = 1 / theta
+
+        new_loglike = np.zeros(nlags)
+        resp_sum = np.zeros((nlags, ncomponents))
+        u_resp_sum = np.zeros((nlags, ncomponents))
+
+        for l, u in enumerate(all_sq_jumps):
+            for start in range(0, len(u), chunk_size):
+                u_chunk = u[start:start + chunk_size]
+
+                # E-step: component log densities of shape (jumps, components)
+                log_p = log_prior[l] - u_chunk[:, None] * rate[l]
+                log_max = log_p.max(axis=1)
+                resp = np.exp(log_p - log_max[:, None])
+                resp_norm = resp.sum(axis=1)
+                resp /= resp_norm[:, None]
+
+                new_loglike[l] += np.sum(log_max + np.log(resp_norm))
+                resp_sum[l] += resp.sum(axis=0)
+                u_resp_sum[l] += u_chunk @ resp
+
+        # M-step
+        weights = np.maximum(resp_sum / np.maximum(counts, 1)[:, None], 1e-12)
+        theta = np.maximum(u_resp_sum / np.maximum(resp_sum, 1e-300), 1e-12)
+
+        # stop when the log-likelihood per jump has converged for every lag
+        converged = np.abs(new_loglike - loglike) <= tol * np.maximum(counts, 1)
+        loglike = new_loglike
+        if converged.all():
+            break
+
+    # order components from slow to fast
+    order = np.argsort(theta, axis=1)
+    theta = np.take_along_axis(theta, order, axis=1)
+    weights = np.take_along_axis(weights, order, axis=1)
+
+    return weights, theta, loglike, counts
+
+# Jump distance analysis with 1 to max_components diffusive components
+@timed
+def calc_JumpDistance(data, max_lag=4, max_components=3, max_iter=500, time_interval=0.022):
+    all_sq_jumps = calc_JumpDistances(data, max_lag)
+    lags = np.arange(1, max_lag + 1)
+
+    jd_data = []
+    for ncomponents in range(1, max_components + 1):
+        weights, theta, loglike, counts = fit_RayleighMixture(all_sq_jumps, ncomponents, max_iter)
+        bic = -2 * loglike + (2 * ncomponents - 1) * np.log(np.maximum(counts, 1))
+
+        jd_data.append(pd.DataFrame(
+            {
+                'Lag' : np.repeat(lags, ncomponents),
+                'Time' : np.round(np.repeat(lags, ncomponents) * time_interval, 3),
+                'Count' : np.repeat(counts, ncomponents),
+                'N_Components' : ncomponents,
+                'Component' : np.tile(np.arange(1, ncomponents + 1), max_lag),
+                'Fraction' : weights.ravel(),
+                'D' : (theta / (4 * lags[:, None] * time_interval)).ravel(),
+                'LogLikelihood' : np.repeat(loglike, ncomponents),
+                'BIC' : np.repeat(bic, ncomponents)
+            }
+        ))
+
+    jd_data = pd.concat(jd_data, ignore_index=True)
+    jd_data = jd_data[jd_data.Count > 0].sort_values(["Lag", "N_Components", "Component"]).reset_index(drop=True)
+
+    # number of components preferred by BIC at every lag
+    best = jd_data.loc[jd_data.groupby("Lag").BIC.idxmin(), ["Lag", "N_Components"]]
+    jd_data["Best"] = jd_data.N_Components.to_numpy() == jd_data.Lag.map(best.set_index("Lag").N_Components).to_numpy()
+
+    return jd_data
+
 # Plot data
+@timed
 def plotData(msd_data, outname, save=True):
+    # plotting libraries are only loaded when plots are made
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
     # Restrict x-axis to data with greater than equal to 30 counts in MSD determination
     xlimit = round(msd_data.loc[msd_data.Count >= 30, :].Time.max(), 1)
@@ -116,6 +496,7 @@ def plotData(msd_data, outname, save=True):
         outname = f'{outname}_MSDplot.png'
         # plt.show()
         plot.savefig(f"{outname}", dpi=300)
+        plt.close(plot.figure)
     else:
         plt.show()
 
@@ -127,21 +508,99 @@ def dataOUT(msd_data, outname):
     outname = f'{outname}_MSD-data.csv'
     msd_data.to_csv(outname, index = False)
 
-# Main function
-def main():
-    filename = sys.argv[1]                              # input file name
+# Write per-track data
+def dataOUT_tracks(track_data, outname):
+    # add column with filename
+    track_data["Filename"] = outname
+
+    outname = f'{outname}_MSD-tracks.csv'
+    track_data.to_csv(outname, index = False, float_format = "%.5g")
+
+# Write step size data and histogram
+# Histograms of step size data files are named after the file they were made from, without _stepsize-data
+def dataOUT_steps(data, hist_data, filename, write_stepsize=False):
+    suffix = '_stepsize-data.csv' if filename.endswith('_stepsize-data.csv') else '.csv'
+    outname = filename[:-len(suffix)]
+
+    # step size data in the format of StepSize-distribution.R
+    if write_stepsize:
+        columns = ["TRACK_ID", "FRAME", "POSITION_X", "POSITION_Y", "DEL_X", "DEL_Y", "SQ_DISP", "STEP_SIZE", "DEL_FRAME"]
+        data[columns].to_csv(f'{outname}_stepsize-data.csv', index = False)
+
+    hist_data.to_csv(f'{outname}_stepsize-hist.csv', index = False, float_format = "%.5g")
+
+# Write jump distance fits
+def dataOUT_jumps(jd_data, outname):
+    # add column with filename
+    jd_data["Filename"] = outname
+
+    outname = f'{outname}_JD-fit.csv'
+    jd_data.to_csv(outname, index = False, float_format = "%.5g")
+
+# Analyse a single file
+def analyse_file(filename, args):
     outname = '_'.join(filename.split('_')[:3])         # output file name prefix
-    data = dataIN(filename)                             # get data
-    data = calc_time(data)                              # calculate time
-    data = calc_lifetime(data)                          # calculate lifetime
-    msd_data = calc_MSD(data)                           # calculated MSDs
-    plotData(msd_data, outname)                         # plot data
-    dataOUT(msd_data, outname)                          # write MSD data
+    instrument = Instrumentation(args.profile == 'True')   # stage timings
+
+    with instrument:
+        data = dataIN(filename)                         # get data
+        data = calc_StepSize(data)                      # calculate step sizes
+        hist_data = calc_StepHistogram(data, args.hist_binwidth, args.hist_max) # step size histogram
+        write_stepsize = args.write_stepsize == 'True' and not filename.endswith('_stepsize-data.csv')
+        dataOUT_steps(data, hist_data, filename, write_stepsize)                # write step size data
+        data = calc_time(data, args.time_resolution)    # calculate time
+        data = calc_lifetime(data)                      # calculate lifetime
+        msd_data = calc_MSD(data, args.time_resolution) # calculated MSDs
+        plotData(msd_data, outname)                     # plot data
+        dataOUT(msd_data, outname)                      # write MSD data
+
+        # per-track diffusion fits
+        if args.per_track == 'True':
+            track_data = fit_TrackDiffusion(data, args.fit_lags, args.time_resolution)
+            dataOUT_tracks(track_data, outname)
+
+        # jump distance mixture fits
+        if args.jump_distance == 'True':
+            jd_data = calc_JumpDistance(data, args.jd_lags, args.jd_components, args.jd_max_iter, args.time_resolution)
+            dataOUT_jumps(jd_data, outname)
+
+        print(f"Analysed {filename}")
+
+    # stage timings
+    instrument.dataOUT(f'{outname}_timings.json', f'{outname}_profile.prof')
+
+# Main function
+def main(argv=None):
+    args = get_args(argv)                               # input arguments
+
+    # spread files over processes
+    processes = max(1, min(args.processes, len(args.files)))
+    if processes == 1:
+        for filename in args.files:
+            analyse_file(filename, args)
+    else:
+        with mp.Pool(processes) as pool:
+            pool.starmap(analyse_file, [(filename, args) for filename in args.files])
 
 # Run main
-main()
+if __name__ == '__main__':
+    main()
 
 # Ankit Roy
 # 25th March, 2024
 # 26th March, 2024      >>      Now adds a column with filename in output file
-#                       >>      Also rounds the time column to 3 decimal places
\ No newline at end of file
+#                       >>      Also rounds the time column to 3 decimal places
+# 19th October, 2026    >>      MSD is now the time-averaged MSD over all lags, computed per track with FFTs
+#                       >>      Count is the number of tracks contributing to each lag
+#                       >>      Track lifetimes are computed without a per-track lambda
+#                       >>      Accepts several input files and analyses them in parallel
+#                       >>      Added per-track mode fitting D and alpha for all tracks at once (_MSD-tracks.csv)
+#                       >>      Reads TrackMate exports directly and computes step sizes without StepSize-distribution.R
+#                       >>      Writes a step size histogram (_stepsize-hist.csv) for every input file
+#                       >>      Added jump distance analysis with 1-3 component Rayleigh mixtures fitted by EM (_JD-fit.csv)
+#                       >>      Records wall time, CPU time, peak memory and row counts of every stage (_timings.json)
+#                       >>      Added --profile to write cProfile stats for every input file (_profile.prof)
+#                       >>      matplotlib and seaborn are imported only when plots are made; main() takes an optional argument list
+#                       >>      Step size histograms of _stepsize-data.csv inputs are named <prefix>_stepsize-hist.csv
+#                       >>      Jump distance EM sums over the jumps of every lag in chunks instead of building padded lag x jump x component arrays
+#                       >>      "None" TRACK_IDs of untracked spots are kept as text, so that they are removed with current pandas versions
@@ -20,6 +20,7 @@ import argparse
 import pandas as pd
 import numpy as np
 import multiprocessing as mp
+from instrumentation import Instrumentation, timed
 
 __author__ = "Ankit Roy"
 __copyright__ = "Copyright 2021, Bieling Lab, Max Planck Institute of Molecular Physiology"
@@ -28,7 +29,7 @@ __maintainer__ = "Ankit Roy"
 __status__ = "Development"
 
 #--- Fetch arguments
-def get_args():
+def get_args(argv=None):
 	parser = argparse.ArgumentParser()
 
 	# Required arguments group
@@ -101,19 +102,34 @@ def get_args():
 								help = "(default = Colocalization.csv) Output file name",
 								default = "Colocalization.csv")
 
-	args = parser.parse_args()
+	# Number of processes
+	parser.add_argument("--processes",
+								help = "(default = all cores) Number of processes for colocalization calculations",
+								default = mp.cpu_count(),
+								type = int)
+
+	# Profiling
+	parser.add_argument("--profile",
+								help = "(default = False) Write cProfile stats of the run to <outfile>_profile.prof",
+								choices = ['True', 'False'],
+								default = 'False')
+
+	args = parser.parse_args(argv)
 
 	return args
 
 #--- Get data
+@timed
 def dataIN(filename):
-	data = pd.read_csv(filename)
+	# TRACK_ID is read as text; spots that are not part of tracks keep their "None" TRACK_ID instead of NaN
+	data = pd.read_csv(filename, dtype = {"TRACK_ID" : str})
+	data["TRACK_ID"] = data["TRACK_ID"].fillna("None")
 	return data
 
 #--- Tracks for control cases
-def get_control_tracks(data):
+def get_control_tracks(data, control_frame_limit):
 	# control tracks
-	control_tracks = set(data[data["FRAME"] <= args.control_frame_limit]["PSEUDO_TRACK_ID"])
+	control_tracks = set(data[data["FRAME"] <= control_frame_limit]["PSEUDO_TRACK_ID"])
 
 	# Keep only control tracks
 	data = data[data["PSEUDO_TRACK_ID"].isin(control_tracks)]
@@ -121,9 +137,9 @@ def get_control_tracks(data):
 	return data
 
 #--- Eliminate tracks that appear before first frame
-def eliminate_preexisting_tracks(data):
+def eliminate_preexisting_tracks(data, first_frame):
 	# pre-existing tracks
-	preexisting_tracks = set(data[data["FRAME"] < args.first_frame]["TRACK_ID"])
+	preexisting_tracks = set(data[data["FRAME"] < first_frame]["TRACK_ID"])
 	preexisting_tracks = [n for n in preexisting_tracks if n != "None"]
 	
 	# eliminate tracks
@@ -133,28 +149,21 @@ def eliminate_preexisting_tracks(data):
 	return data
 
 #--- Remove spot data
+@timed
 def remove_spots(data):
 	# removing spots
 	data = data[data["TRACK_ID"] != "None"]
 	return data
 
 #--- Remove short tracks
-def remove_short_tracks(data):
-	# group by TRACK_ID and remove smaller tracks
-	groupings = data.groupby(["TRACK_ID"])
+@timed
+def remove_short_tracks(data, min_length):
+	# first and last frame of every track
+	frames = data.groupby("TRACK_ID")["FRAME"].agg(["min", "max"])
+	track_length = frames["max"] - frames["min"] + 1	# frame length
 
-	# long tracks
-	long_track_ids = []
-
-	# get TRACK_ID of long tracks
-	for gid, group in groupings:
-		min_frame = min(group["FRAME"])				# first frame
-		max_frame = max(group["FRAME"])				# last frame
-		track_length = max_frame - min_frame + 1	# frame length
-
-		# keep track of long tracks
-		if track_length >= args.gtpase_track_min_length:
-			long_track_ids.append(gid)
+	# TRACK_ID of long tracks
+	long_track_ids = track_length.index[track_length >= min_length]
 
 	# keep only long tracks
 	data = data[data["TRACK_ID"].isin(long_track_ids)]
@@ -163,38 +172,40 @@ def remove_short_tracks(data):
 
 
 #--- Keep specified frames
-def filter_frames(data):
+@timed
+def filter_frames(data, first_frame, last_frame, control=False, control_frame_limit=3):
 
 	# limit analysis to initial frames for control cases
-	if args.control == "True":
-		data_filtered = get_control_tracks(data)
+	if control:
+		data_filtered = get_control_tracks(data, control_frame_limit)
 
 	else:
 		# filter frames according to user specifed first and last frame
-		if (args.first_frame >= 0) and (args.last_frame >= 0):
+		if (first_frame >= 0) and (last_frame >= 0):
 			# eliminate tracks that originate before first frame
-			data = eliminate_preexisting_tracks(data)
+			data = eliminate_preexisting_tracks(data, first_frame)
 			# filter by start and end frame
-			data_filtered = data[(data["FRAME"] >= args.first_frame) & (data["FRAME"] < args.last_frame)]
+			data_filtered = data[(data["FRAME"] >= first_frame) & (data["FRAME"] < last_frame)]
 
 		# keep all frames after first
-		elif args.first_frame >= 0:
+		elif first_frame >= 0:
 			# eliminate tracks that originate before first frame
-			data = eliminate_preexisting_tracks(data)
+			data = eliminate_preexisting_tracks(data, first_frame)
 			# filter by start frame
-			data_filtered = data[data["FRAME"] >= args.first_frame]
+			data_filtered = data[data["FRAME"] >= first_frame]
 
 		# keep all frames up till the last
 		else:
-			data_filtered = data[data["FRAME"] < args.last_frame]
+			data_filtered = data[data["FRAME"] < last_frame]
 
 	return data_filtered
 
 #--- Exclude spots outside field of view
-def filter_fov(data):
+@timed
+def filter_fov(data, field, pixel_size=0.178, image_size=512):
 
 	# field of view threshold
-	threshold = args.image_size * args.pixel_size * args.field
+	threshold = image_size * pixel_size * field
 
 	# outlier pseudo ids
 	data_outliers = data.loc[(data["POSITION_X"] >= threshold) | (data["POSITION_Y"] >= threshold), "PSEUDO_TRACK_ID"]
@@ -219,12 +230,12 @@ def get_coloc_single(gtpase_data_frame, gdi_data_frame, frame, dist):
 	# colocalized GTPase spots
 	gtpase_coloc = gtpase_data_frame
 	gtpase_coloc["COLOCALIZED_SPOT"] = False
-	gtpase_coloc["COLOCALIZATION_ID"] = np.nan
+	gtpase_coloc["COLOCALIZATION_ID"] = pd.Series(np.nan, index=gtpase_coloc.index, dtype=object)	# text ids, missing until colocalized
 	
 	# colocalized GDI spots
 	gdi_coloc = gdi_data_frame
 	gdi_coloc["COLOCALIZED_SPOT"] = False
-	gdi_coloc["COLOCALIZATION_ID"] = np.nan
+	gdi_coloc["COLOCALIZATION_ID"] = pd.Series(np.nan, index=gdi_coloc.index, dtype=object)	# text ids, missing until colocalized
 
 	# Calculate colocalizations in a single frame
 	for gtpase_index in range(len(gtpase_data_frame)):
@@ -260,19 +271,21 @@ def get_coloc_single(gtpase_data_frame, gdi_data_frame, frame, dist):
 	return [gtpase_coloc, gdi_coloc]
 
 #--- Add pseudo track IDs
+@timed
 def add_PsedoTrackID(data):
 	data = data.copy()
 	data["PSEUDO_TRACK_ID"] = data.apply(lambda x: x["TRACK_ID"] if x["TRACK_ID"] != "None" else x["Label"], axis=1)
 	return data
 
 #--- Get all colocalizations
-def get_coloc(gtpase_data, gdi_data):
+@timed
+def get_coloc(gtpase_data, gdi_data, dist=0.5, processes=1):
 
 	# total number of frames
 	total_frames = min(max(gtpase_data["FRAME"]), max(gdi_data["FRAME"]))
 
-	# processes for parallelization
-	processes = []
+	# frames for parallelization
+	jobs = []
 
 	# Calculate colocalization for every pair of spots per frame
 	for frame in range(0, total_frames):
@@ -286,12 +299,11 @@ def get_coloc(gtpase_data, gdi_data):
 			continue
 
 		# add sub-process
-		processes.append((gtpase_data_frame, gdi_data_frame, frame, args.dist))
+		jobs.append((gtpase_data_frame, gdi_data_frame, frame, dist))
 
-	# start multiprocessing
-	pool = mp.Pool(mp.cpu_count())
-	results = pool.starmap(get_coloc_single, processes)
-	pool.close
+	# start multiprocessing; workers are terminated if a frame fails
+	with mp.Pool(max(1, processes)) as pool:
+		results = pool.starmap(get_coloc_single, jobs)
 
 	# combine colocalization results from single frames
 	gtpase_coloc = pd.concat([gp[0] for gp in results if not gp[0].empty])
@@ -303,6 +315,7 @@ def get_coloc(gtpase_data, gdi_data):
 	return (gtpase_coloc, gdi_coloc)
 
 #--- Combine channels to single output
+@timed
 def combine_channels(gtpase_coloc, gdi_coloc):
 	gtpase_coloc["CHANNEL"] = "GTPase"
 	gdi_coloc["CHANNEL"] = "GDI"
@@ -311,29 +324,24 @@ def combine_channels(gtpase_coloc, gdi_coloc):
 	return combine_channels
 
 #--- Write output files
-def dataOUT(data_frame, outname):
+@timed
+def dataOUT(data_frame, outname, args):
 	# write parameters as meta data
 	with open(outname, "w") as fh:
 		fh.write("# {:=^40}\n".format(" Meta-data lines "))
 		for arg in vars(args):
+			# number of processes and profiling do not change results
+			if arg in ["processes", "profile"]:
+				continue
 			fh.write("# {}: {}\n".format(arg, getattr(args, arg)))
 		fh.write("# {:=^40}\n".format(" Colocalization data lines "))
 
 	# write CSV file for colocalization events
 	data_frame.to_csv(outname, index=False, float_format="%.3f", mode="a")
 
-#--- Main function
-def main():
-	global args
-
-	args = get_args()					# input arguments
-	gtpase_data = dataIN(args.gtpase)	# GTPase data
-	gdi_data = dataIN(args.gdi)			# GDI data
-
-	# progress status
-	print("# {:>20s} : {:^50s}".format("GTPase file", args.gtpase))
-	print("# {:>20s} : {:^50s}".format("GDI file", args.gdi))
-	print("# Data imported")
+#--- Colocalizations of GTPase and GDI spot data
+def colocalize(gtpase_data, gdi_data, first_frame, last_frame, dist=0.5, field=1.0, pixel_size=0.178, image_size=512,
+				control=False, control_frame_limit=3, gtpase_track_min_length=5, processes=1):
 
 	# Add pseudo track IDs
 	gtpase_data = add_PsedoTrackID(gtpase_data)
@@ -343,42 +351,68 @@ def main():
 	print("# Psedo Track IDs assigned")
 
 	# remove spot data for GTPase channel
-	if args.gtpase_track_min_length > 1:
+	if gtpase_track_min_length > 1:
 		gtpase_data = remove_spots(gtpase_data)
-		gtpase_data = remove_short_tracks(gtpase_data)
+		gtpase_data = remove_short_tracks(gtpase_data, gtpase_track_min_length)
 
 	# filter by first and last frame
-	gtpase_data	= filter_frames(gtpase_data)
-	gdi_data = filter_frames(gdi_data)
+	gtpase_data	= filter_frames(gtpase_data, first_frame, last_frame, control, control_frame_limit)
+	gdi_data = filter_frames(gdi_data, first_frame, last_frame, control, control_frame_limit)
 
 	# progress status
 	print("# Frames filtered")
 
 	# filter if custom field of view is set
-	if args.field != 1.0:
-		gtpase_data_fov = filter_fov(gtpase_data)	# filter field of view - GTPase
-		gdi_data_fov = filter_fov(gdi_data)			# filter field of view - GDI
-	else:
-		gtpase_data_fov = gtpase_data
-		gdi_data_fov = gdi_data
+	if field != 1.0:
+		gtpase_data = filter_fov(gtpase_data, field, pixel_size, image_size)	# filter field of view - GTPase
+		gdi_data = filter_fov(gdi_data, field, pixel_size, image_size)			# filter field of view - GDI
 
 	# progress status
 	print("# Field of view filtered")
 
 	# Get colocalization
-	gtpase_coloc, gdi_coloc = get_coloc(gtpase_data_fov, gdi_data_fov)
+	gtpase_coloc, gdi_coloc = get_coloc(gtpase_data, gdi_data, dist, processes)
 
 	# progress status
 	print("# Colocalizations computed")
 
 	# combine output
-	combined_coloc = combine_channels(gtpase_coloc, gdi_coloc)
+	return combine_channels(gtpase_coloc, gdi_coloc)
 
-	# Write colocalization file
-	dataOUT(combined_coloc, args.outfile)
+#--- Main function
+def main(argv=None):
+	args = get_args(argv)					# input arguments
+	instrument = Instrumentation(args.profile == 'True')	# stage timings
 
-	# progress status
-	print("# Output written to: {:^50s}".format(args.outfile))
+	with instrument:
+		gtpase_data = dataIN(args.gtpase)	# GTPase data
+		gdi_data = dataIN(args.gdi)			# GDI data
+
+		# progress status
+		print("# {:>20s} : {:^50s}".format("GTPase file", args.gtpase))
+		print("# {:>20s} : {:^50s}".format("GDI file", args.gdi))
+		print("# Data imported")
+
+		# Colocalizations of both channels
+		combined_coloc = colocalize(gtpase_data, gdi_data, args.first_frame, args.last_frame,
+									dist = args.dist,
+									field = args.field,
+									pixel_size = args.pixel_size,
+									image_size = args.image_size,
+									control = args.control == "True",
+									control_frame_limit = args.control_frame_limit,
+									gtpase_track_min_length = args.gtpase_track_min_length,
+									processes = args.processes)
+
+		# Write colocalization file
+		dataOUT(combined_coloc, args.outfile, args)
+
+		# progress status
+		print("# Output written to: {:^50s}".format(args.outfile))
+
+	# Write stage timings
+	outname = args.outfile.split('.csv')[0]
+	instrument.dataOUT("{}_timings.json".format(outname), "{}_profile.prof".format(outname))
 
 
 #--- Run main function
@@ -423,3 +457,11 @@ if __name__ == '__main__':
 # 28th January, 2022
 #	--> Universal GTPase track length parameter added
 #	--> Now eliminates entire tracks that move out of the field of view even momentarily
+# 19th October, 2026
+#	--> Number of processes can be set with --processes, so that several analyses can share a machine.
+#	--> Records wall time, CPU time, peak memory and row counts of every stage (<outfile>_timings.json).
+#	--> Added --profile to write cProfile stats.
+#	--> Analysis steps take their parameters explicitly; colocalize() runs the analysis on loaded spot data.
+#	--> Short GTPase tracks are removed with current pandas versions (grouping by a list returned tuple keys, which removed all tracks).
+#	--> TRACK_ID is read as text and untracked spots keep "None", so pseudo track and colocalization ids of tracked spots are integers with current pandas versions.
+#	--> Worker processes are terminated if colocalization of a frame fails.
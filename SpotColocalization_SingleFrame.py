@@ -3,6 +3,7 @@
 import argparse
 import pandas as pd
 import numpy as np
+from scipy.spatial import cKDTree
 
 __author__ = "Ankit Roy"
 __copyright__ = "Copyright 2021, Bieling Lab, Max Planck Institute of Molecular Physiology"
@@ -11,7 +12,7 @@ __maintainer__ = "Ankit Roy"
 __status__ = "Development"
 
 #--- Fetch arguments
-def get_args():
+def get_args(argv=None):
 	parser = argparse.ArgumentParser()
 
 	# Required arguments group
@@ -51,92 +52,112 @@ def get_args():
 								default = 512,
 								type = int)
 
-	args = parser.parse_args()
+	# Number of frames to sample
+	parser.add_argument("--frames",
+								help = "(default = all spots) Number of evenly spaced frames to sample from a full movie for quick-look statistics. Spots are only paired within the same frame.",
+								type = int)
+
+	args = parser.parse_args(argv)
 
 	return args
 
 #--- Get data
 def dataIN(filename):
-	data = pd.read_csv(filename)
+	data = pd.read_csv(filename, usecols = ["FRAME", "POSITION_X", "POSITION_Y"])
 	return data
 
-#--- Exclude spots outside field of view
-def filter_fov(data):
+#--- Keep a sample of evenly spaced frames
+def sample_frames(gtpase_data, gdi_data, nframes):
 
-	# spot data in the field of view
-	data_fov = pd.DataFrame(columns = data.columns.values)
+	# frames with spots in either channel
+	all_frames = np.union1d(gtpase_data["FRAME"].unique(), gdi_data["FRAME"].unique())
 
-	# field of view threshold
-	threshold = args.image_size * args.pixel_size * args.field
+	# evenly spaced frames
+	nframes = min(nframes, len(all_frames))
+	sampled = all_frames[np.unique(np.linspace(0, len(all_frames) - 1, nframes).round().astype(int))]
 
-	# filter spots inside field of view
-	for index in range(len(data)):
-		x = data.loc[index,]["POSITION_X"]
-		y = data.loc[index,]["POSITION_Y"]
+	gtpase_data = gtpase_data[gtpase_data["FRAME"].isin(sampled)].reset_index(drop = True)
+	gdi_data = gdi_data[gdi_data["FRAME"].isin(sampled)].reset_index(drop = True)
 
-		# ignore spots outside field of view
-		if (x > threshold) or (y > threshold):
-			continue
+	return (gtpase_data, gdi_data)
 
-		# add spots within field of view
-		data_fov = data_fov.append(data.loc[index,], ignore_index=True)
+#--- Exclude spots outside field of view
+def filter_fov(data, field, pixel_size=0.178, image_size=512):
+
+	# field of view threshold
+	threshold = image_size * pixel_size * field
+
+	# keep spots inside field of view
+	inside = (data["POSITION_X"] <= threshold) & (data["POSITION_Y"] <= threshold)
+	data_fov = data[inside].reset_index(drop = True)
 
 	return data_fov
 
 #--- Calculate distance
 def calc_dist(x1, y1, x2, y2):
 	d = np.sqrt((x1 - x2)**2 + (y1 - y2)**2)
-	return round(d, 2)
+	return np.round(d, 2)
+
+#--- Spot coordinates for the pair search
+def get_coords(data, by_frame, frame_spacing):
+	coords = data[["POSITION_X", "POSITION_Y"]].to_numpy(dtype = float)
+
+	# spots from different frames are placed further apart than the search radius
+	if by_frame:
+		frame_coord = data["FRAME"].to_numpy(dtype = float) * frame_spacing
+		coords = np.column_stack((coords, frame_coord))
+
+	return coords
 
 #--- Get colocalization
-def get_coloc(gtpase_data, gdi_data):
-
-	# colocalized GTPase spots
-	gtpase_coloc = pd.DataFrame(columns = gtpase_data.columns.values)
-	# colocalized GDI spots
-	gdi_coloc = pd.DataFrame(columns = gdi_data.columns.values)
-
-	# Calculate colocalization for every pair of spots
-	for gtpase_index in range(len(gtpase_data)):
-		for gdi_index in range(len(gdi_data)):
-			# GTPase spot coordinates
-			x1 = gtpase_data.loc[gtpase_index,]["POSITION_X"]
-			y1 = gtpase_data.loc[gtpase_index,]["POSITION_Y"]
-
-			# GDI spot coordinates
-			x2 = gdi_data.loc[gdi_index,]["POSITION_X"]
-			y2 = gdi_data.loc[gdi_index,]["POSITION_Y"]
-
-			# spot distance
-			d = calc_dist(x1, y1, x2, y2)
-
-			# store colocalized spots
-			if d <= args.dist:
-				# Store colocalized GTPase spot
-				gtpase_coloc = gtpase_coloc.append(gtpase_data.loc[gtpase_index,], ignore_index=True)
-				# Store colocalized GDI spot
-				gdi_coloc = gdi_coloc.append(gdi_data.loc[gdi_index,], ignore_index=True)
+def get_coloc(gtpase_data, gdi_data, dist=0.5, by_frame=False):
+
+	# search radius covers distances that round down to the cutoff
+	radius = dist + 0.005
+
+	# candidate spot pairs from KD-trees
+	gtpase_tree = cKDTree(get_coords(gtpase_data, by_frame, 4 * radius))
+	gdi_tree = cKDTree(get_coords(gdi_data, by_frame, 4 * radius))
+	pairs = gtpase_tree.sparse_distance_matrix(gdi_tree, radius, output_type = "ndarray")
+
+	# keep GTPase major pair order
+	pairs = np.sort(pairs, order = ["i", "j"])
+	gtpase_index = pairs["i"]
+	gdi_index = pairs["j"]
+
+	# spot distance
+	d = calc_dist(gtpase_data["POSITION_X"].to_numpy()[gtpase_index],
+				gtpase_data["POSITION_Y"].to_numpy()[gtpase_index],
+				gdi_data["POSITION_X"].to_numpy()[gdi_index],
+				gdi_data["POSITION_Y"].to_numpy()[gdi_index])
+
+	# colocalized spot pairs
+	coloc = d <= dist
+	gtpase_coloc = gtpase_data.iloc[gtpase_index[coloc]].reset_index(drop = True)
+	gdi_coloc = gdi_data.iloc[gdi_index[coloc]].reset_index(drop = True)
 
 	return (gtpase_coloc, gdi_coloc)
 
 #--- Main function
-def main():
-	global args
-
-	args = get_args()					# input arguments
+def main(argv=None):
+	args = get_args(argv)				# input arguments
 	gtpase_data = dataIN(args.gtpase)	# GTPase data
 	gdi_data = dataIN(args.gdi)			# GDI data
 
+	# quick-look on a sample of frames
+	if args.frames:
+		gtpase_data, gdi_data = sample_frames(gtpase_data, gdi_data, args.frames)
+
 	# filter if custom field of view is set
 	if args.field != 1.0:
-		gtpase_data_fov = filter_fov(gtpase_data)	# filter field of view - GTPase
-		gdi_data_fov = filter_fov(gdi_data)			# filter field of view - GDI
+		gtpase_data_fov = filter_fov(gtpase_data, args.field, args.pixel_size, args.image_size)	# filter field of view - GTPase
+		gdi_data_fov = filter_fov(gdi_data, args.field, args.pixel_size, args.image_size)		# filter field of view - GDI
 	else:
 		gtpase_data_fov = gtpase_data
 		gdi_data_fov = gdi_data
 
 	# Get colocalization
-	gtpase_coloc, gdi_coloc = get_coloc(gtpase_data_fov, gdi_data_fov)
+	gtpase_coloc, gdi_coloc = get_coloc(gtpase_data_fov, gdi_data_fov, args.dist, bool(args.frames))
 
 	gtpase_count = len(gtpase_data_fov)			# count GTPase spots
 	gdi_count = len(gdi_data_fov)				# count GDI spots
@@ -151,7 +172,13 @@ def main():
 
 
 #--- Run main function
-main()
+if __name__ == '__main__':
+	main()
 
 # Ankit Roy
 # 11th November, 2020
+# 19th October, 2026
+#	--> Field of view filter and colocalization search are now vectorized (KD-tree pair query).
+#	--> Only the spot coordinate and frame columns are read from input files.
+#	--> Added --frames option for quick-look statistics on a sample of frames from a full movie.
+#	--> Functions take their parameters explicitly and the script can be imported without running.
@@ -1,32 +1,265 @@
 #!/Users/roy/mambaforge/bin/python
 
-import sys
+import argparse
+import os
+import glob
+import json
+import shutil
+import time
+import multiprocessing as mp
+from functools import partial
+from contextlib import nullcontext
+from itertools import chain, islice
+# OpenCV, scikit-image and pandas are imported in the functions that use them, so that importing this script is fast
 import numpy as np
-import matplotlib.pyplot as plt
-import cv2
 from scipy import ndimage as nd
-from skimage import img_as_float, img_as_ubyte, io
-from skimage.restoration import denoise_nl_means, estimate_sigma
-from skimage.filters import threshold_otsu
-from skimage.segmentation import random_walker
+from tiff_stack import TiffStack, outName
+from mask_archive import maskWriter
+from instrumentation import Instrumentation, timed
+
+# Arguments are taken from the command line unless given as a list
+def get_args(argv=None):
+    parser = argparse.ArgumentParser()
+
+    # Lipid channel image stack
+    parser.add_argument("filename",
+                        help = "Lipid channel image stack")
+
+    # Number of processes
+    parser.add_argument("--processes",
+                        help = "(default = all cores) Number of frames segmented in parallel",
+                        default = mp.cpu_count(),
+                        type = int)
+
+    # Denoising method
+    parser.add_argument("--denoiser",
+                        help = "(default = nlm) Denoising method: non-local means (nlm), non-local means fast mode (nlm_fast), OpenCV non-local means (cv2_nlm), bilateral filter (bilateral) or median over a sliding window of frames (temporal_median)",
+                        choices = ['nlm', 'nlm_fast', 'cv2_nlm', 'bilateral', 'temporal_median'],
+                        default = 'nlm')
+
+    # Frame window for temporal median denoising
+    parser.add_argument("--temporal_window",
+                        help = "(default = 3) Number of frames in the sliding window used by the temporal_median denoiser",
+                        default = 3,
+                        type = int)
+
+    # Random walker solver
+    parser.add_argument("--solver",
+                        help = "(default = bf) Random walker solver; cg_mg requires pyamg",
+                        choices = ['bf', 'cg', 'cg_j', 'cg_mg'],
+                        default = 'bf')
+
+    # Multiscale random walker
+    parser.add_argument("--multiscale",
+                        help = "(default = 1) Downsampling factor for a coarse random walker solve that is refined at label boundaries; 1 solves at full resolution",
+                        default = 1,
+                        type = int)
+
+    # Refinement band for multiscale random walker
+    parser.add_argument("--band",
+                        help = "(default = 2) Half-width in coarse pixels of the boundary band refined at full resolution",
+                        default = 2,
+                        type = int)
+
+    # Incremental segmentation
+    parser.add_argument("--incremental",
+                        help = "(default = False) Seed the random walker from the previous frame and copy masks of frames that barely change",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    # Frame change below which masks are copied
+    parser.add_argument("--skip_threshold",
+                        help = "(default = 0.01) Mean absolute intensity change, relative to the last segmented frame, below which the previous mask is copied",
+                        default = 0.01,
+                        type = float)
+
+    # Erosion of previous labels used as seeds
+    parser.add_argument("--seed_erosion",
+                        help = "(default = 1 px) Erosion of the previous frame's random walker foreground and background used as seeds; only the eroded-away band around patch boundaries is solved; wider bands let masks drift over consecutive seeded frames",
+                        default = 1,
+                        type = int)
+
+    # Frames between full re-segmentations
+    parser.add_argument("--refresh",
+                        help = "(default = 10) Number of frames after which incremental segmentation restarts from scratch; blocks of this size are segmented in parallel",
+                        default = 10,
+                        type = int)
+
+    # Seed disagreement that triggers a full re-segmentation
+    parser.add_argument("--drift_tolerance",
+                        help = "(default = 0.01) Fraction of seeded pixels whose intensity is on the wrong side of the median of the other label's seeds, above which a frame is segmented from scratch instead of seeded",
+                        default = 0.01,
+                        type = float)
+
+    # Dice overlap required between incremental and full segmentation
+    parser.add_argument("--check_dice",
+                        help = "(default = 0, disabled) Minimum Dice overlap between the incremental and full segmentation of the last frame of every refresh block; blocks below it are segmented from scratch; the check segments one extra frame per block",
+                        default = 0,
+                        type = float)
+
+    # Temporal smoothing of masks
+    parser.add_argument("--temporal_smoothing",
+                        help = "(default = 1) Number of frames in a sliding window over which each mask pixel is set by majority vote; 1 disables smoothing",
+                        default = 1,
+                        type = int)
+
+    # Checkpoint interval
+    parser.add_argument("--checkpoint_every",
+                        help = "(default = 50) Number of frames per checkpoint block saved while segmenting; in incremental mode blocks follow --refresh; 0 disables checkpoints",
+                        default = 50,
+                        type = int)
+
+    # Resume from checkpoints
+    parser.add_argument("--resume",
+                        help = "(default = False) Reuse checkpointed blocks of an interrupted run with the same parameters instead of segmenting them again",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    # Bit-packed mask output
+    parser.add_argument("--bitpacked",
+                        help = "(default = False) Write masks as bit-packed (1 bit) pages instead of uint8",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    # Mask file format
+    parser.add_argument("--mask_format",
+                        help = "(default = tif) Write masks as a TIFF stack or as a compressed bit-packed mask archive (npz)",
+                        choices = ['tif', 'npz'],
+                        default = 'tif')
+
+    # Solver benchmark
+    parser.add_argument("--benchmark",
+                        help = "(default = False) Report runtime and Dice overlap with the bf solver for all solvers instead of segmenting the stack",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    # Denoiser autotune
+    parser.add_argument("--autotune",
+                        help = "(default = False) Report runtime and Dice overlap with the nlm denoiser for all denoisers instead of segmenting the stack",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    # Frames used for benchmarks
+    parser.add_argument("--benchmark_frames",
+                        help = "(default = 5) Number of evenly spaced frames used for benchmarks and autotune",
+                        default = 5,
+                        type = int)
+
+    # Parameter sweep
+    parser.add_argument("--sweep",
+                        help = "(default = False) Cache the denoised and equalized stack and report patch area and count for a grid of segmentation parameters instead of segmenting the stack",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    # Marker threshold modifiers for the sweep
+    parser.add_argument("--sweep_modifier",
+                        help = "(default = 0.1 0.2 0.3) Foreground marker threshold modifiers evaluated in the sweep",
+                        nargs = '+',
+                        default = [0.1, 0.2, 0.3],
+                        type = float)
+
+    # Cleanup kernel sizes for the sweep
+    parser.add_argument("--sweep_kernel",
+                        help = "(default = 7 9 11) Cleanup opening kernel sizes (px) evaluated in the sweep",
+                        nargs = '+',
+                        default = [7, 9, 11],
+                        type = int)
+
+    # Cleanup rounds for the sweep
+    parser.add_argument("--sweep_rounds",
+                        help = "(default = 3 5) Numbers of cleanup rounds evaluated in the sweep",
+                        nargs = '+',
+                        default = [3, 5],
+                        type = int)
+
+    # Frames used in the sweep
+    parser.add_argument("--sweep_frames",
+                        help = "(default = all) Number of evenly spaced frames evaluated in the sweep",
+                        default = 0,
+                        type = int)
+
+    # Profiling
+    parser.add_argument("--profile",
+                        help = "(default = False) Write cProfile stats of the run (_profile.prof)",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    args = parser.parse_args(argv)
+
+    return args
 
 def readImg(filename):
-    img = img_as_float(io.imread(filename))
+    img = TiffStack(filename)
     return img
 
+# Open the image stack in the current process; frames are read on demand
+@timed
+def openStack(filename):
+    global stack
+    stack = readImg(filename)
+
 def denoiseImg(img):
-    sigma_est = np.mean(estimate_sigma(img, channel_axis=None))
-    denoise = denoise_nl_means(img, h=1.15 * sigma_est, fast_mode=False, patch_size=5, patch_distance=6)
+    from skimage import restoration
+    sigma_est = np.mean(restoration.estimate_sigma(img, channel_axis=None))
+    denoise = restoration.denoise_nl_means(img, h=1.15 * sigma_est, fast_mode=False, patch_size=5, patch_distance=6)
+    return denoise
+
+# Non-local means fast mode; skimage recommends a lower filter strength than for the slow mode
+def denoiseImg_fast(img):
+    from skimage import restoration
+    sigma_est = np.mean(restoration.estimate_sigma(img, channel_axis=None))
+    denoise = restoration.denoise_nl_means(img, h=0.8 * sigma_est, fast_mode=True, patch_size=5, patch_distance=6, sigma=sigma_est)
     return denoise
 
+# OpenCV non-local means on 8-bit frames with the same patch size and search window as denoiseImg
+def denoiseImg_cv2(img):
+    import cv2
+    from skimage import util, restoration
+    sigma_est = np.mean(restoration.estimate_sigma(img, channel_axis=None))
+    img = util.img_as_ubyte(np.clip(img, 0, 1))
+    denoise = cv2.fastNlMeansDenoising(img, None, h=float(1.15 * sigma_est * 255), templateWindowSize=5, searchWindowSize=13)
+    return denoise.astype(np.float32) / 255
+
+# Bilateral filter over the same neighbourhood as the non-local means search window
+def denoiseImg_bilateral(img, diameter=13):
+    import cv2
+    from skimage import restoration
+    sigma_est = np.mean(restoration.estimate_sigma(img, channel_axis=None))
+    denoise = cv2.bilateralFilter(img.astype(np.float32), diameter, sigmaColor=float(sigma_est), sigmaSpace=diameter/2)
+    return denoise
+
+# Median of each pixel over a window of frames centred on frame t
+def denoiseImg_temporal(img, t, window=3):
+    start = min(max(0, t - window//2), max(0, len(img) - window))
+    frames = img[start:start + window]
+    denoise = np.median(frames, axis=0)
+    return denoise
+
+# Denoise frame t of an image stack
+@timed
+def denoiseFrame(img, t, denoiser='nlm', window=3):
+    if denoiser == 'temporal_median':
+        return denoiseImg_temporal(img, t, window)
+
+    denoise = {'nlm': denoiseImg,
+               'nlm_fast': denoiseImg_fast,
+               'cv2_nlm': denoiseImg_cv2,
+               'bilateral': denoiseImg_bilateral}[denoiser]
+
+    return denoise(img[t])
+
+@timed
 def runCLAHE(img, size=4):
-    img = img_as_ubyte(img)
+    import cv2
+    from skimage import util
+    img = util.img_as_ubyte(img)
     clahe = cv2.createCLAHE(clipLimit = np.max(img), tileGridSize = (size,size))
     equalized = clahe.apply(img)
     return equalized
 
-def segment_RandomWalker(img, modifier=0.2):
-    threshold = threshold_otsu(img)
+def get_Markers(img, modifier=0.2):
+    from skimage import filters
+    threshold = filters.threshold_otsu(img)
 
     markers = np.zeros(img.shape, dtype=np.uint)
     markers[(img >= (threshold * (1+modifier)))] = 2
@@ -34,49 +267,529 @@ def segment_RandomWalker(img, modifier=0.2):
 #    markers[(img < (threshold * (1-modifier)))] = 1
     markers[(img < (threshold * (1)))] = 1
 
-    labels = random_walker(img, markers, beta=10, mode='bf')
-    
-    return labels
+    return markers
+
+# Random walker on given markers, at full resolution or multiscale
+def solve_RandomWalker(img, markers, mode='bf', multiscale=1, band=2):
+    from skimage import segmentation
+    if multiscale > 1:
+        return multiscale_RandomWalker(img, markers, mode, multiscale, band)
+
+    return segmentation.random_walker(img, markers, beta=10, mode=mode)
+
+# Solve on a downsampled image, then re-solve only a band around label boundaries at full resolution
+def multiscale_RandomWalker(img, markers, mode='bf', scale=2, band=2):
+    from skimage import segmentation, transform
+    coarse_img = transform.downscale_local_mean(img, (scale, scale)).round().astype(img.dtype)
+    coarse_markers = markers[::scale, ::scale]
+    coarse_labels = segmentation.random_walker(coarse_img, coarse_markers, beta=10, mode=mode)
+
+    labels = np.repeat(np.repeat(coarse_labels, scale, axis=0), scale, axis=1)[:img.shape[0], :img.shape[1]]
+
+    foreground = labels == 2
+    boundary = nd.binary_dilation(foreground, iterations=band*scale) & ~nd.binary_erosion(foreground, iterations=band*scale, border_value=1)
+
+    refine_markers = labels.astype(markers.dtype)
+    refine_markers[boundary] = markers[boundary]
+    if not np.any(refine_markers == 0):
+        return refine_markers
+
+    return segmentation.random_walker(img, refine_markers, beta=10, mode=mode)
+
+@timed
+def segment_RandomWalker(img, modifier=0.2, mode='bf', multiscale=1, band=2):
+    markers = get_Markers(img, modifier)
+
+    return solve_RandomWalker(img, markers, mode, multiscale, band)
+
+# Kernel anchor as in scipy.ndimage: erosion centres kernels at size//2, dilation at (size-1)//2
+# The two differ for even kernel sizes, where the default OpenCV anchor (size//2) would shift dilations by a pixel
+def kernelAnchor(operation, kernel):
+    import cv2
+    rows, cols = kernel.shape
+    if operation is cv2.dilate:
+        return ((cols - 1) // 2, (rows - 1) // 2)
+
+    return (cols // 2, rows // 2)
+
+# Binary morphology with OpenCV on uint8 frames
+# Pixels outside the frame are background, which reproduces scipy.ndimage binary morphology exactly
+# Stacks are processed frame by frame, i.e. with structuring elements of depth 1 along time
+def morphology(img, operation, kernel, iterations=1):
+    import cv2
+    img = np.asarray(img, dtype=np.uint8)
+    if img.ndim == 3:
+        return np.array([morphology(frame, operation, kernel, iterations) for frame in img])
+
+    return operation(img, kernel, anchor=kernelAnchor(operation, kernel), iterations=iterations, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+
+def closing(img, kernel):
+    import cv2
+    return morphology(morphology(img, cv2.dilate, kernel), cv2.erode, kernel)
 
+def opening(img, kernel):
+    import cv2
+    return morphology(morphology(img, cv2.erode, kernel), cv2.dilate, kernel)
+
+@timed
 def cleanUp(img, kernel_size=(9,9), rounds=5):
+    img = np.asarray(img, dtype=np.uint8)
     for run in range(rounds):
-        img = nd.binary_closing(img, np.ones((3,3)))
-        img = nd.binary_opening(img, np.ones(kernel_size))
-        
-    return img
+        img = closing(img, np.ones((3,3), dtype=np.uint8))
+        img = opening(img, np.ones(kernel_size, dtype=np.uint8))
+
+    return img.astype(bool)
 
+# Dilation with the 3x3 cross used by default in scipy.ndimage
+@timed
 def dilate(img, rounds=1):
-    for run in range(rounds):
-        img = nd.binary_dilation(img)
-        
-    return img
+    import cv2
+    img = morphology(img, cv2.dilate, cv2.getStructuringElement(cv2.MORPH_CROSS, (3,3)), rounds)
+
+    return img.astype(bool)
+
+# Majority vote of each mask pixel over a window of frames centred on every frame
+# Results are (mask, time, status) tuples in frame order; only the frames in the window are kept in memory
+def smoothMasks(results, nframes, window=3):
+    results = iter(results)
+    buffer = {}
+    read = 0
+    for t in range(nframes):
+        start = min(max(0, t - window//2), max(0, nframes - window))
+        stop = min(start + window, nframes)
+
+        while read < stop:
+            buffer[read] = next(results)
+            read += 1
+        for old in [i for i in buffer if i < start]:
+            del buffer[old]
+
+        votes = np.sum([buffer[i][0] for i in range(start, stop)], axis=0)
+        yield (votes > (stop - start) / 2,) + tuple(buffer[t][1:])
+
+def preprocessFrame(img, t, denoiser='nlm', window=3):
+    denoise = denoiseFrame(img, t, denoiser, window)
+    equalized = runCLAHE(denoise, 2)
+
+    return equalized
+
+def segmentEqualized(equalized, solver='bf', multiscale=1, band=2, modifier=0.2, kernel_size=(9,9), rounds=5):
+    labels = segment_RandomWalker(equalized, modifier, solver, multiscale, band)
+    segment = labels == 2
+    cleaned_seg = cleanUp(segment, kernel_size, rounds)
+    dilated_seg = dilate(cleaned_seg, 3)
+
+    return dilated_seg
+
+def segmentFrame(img, t, solver='bf', multiscale=1, band=2, denoiser='nlm', window=3):
+    equalized = preprocessFrame(img, t, denoiser, window)
+
+    return segmentEqualized(equalized, solver, multiscale, band)
+
+def segmentFrame_timed(img, t, **params):
+    start = time.perf_counter()
+    segment = segmentFrame(img, t, **params)
+
+    return segment, time.perf_counter() - start, 'full'
+
+def segmentChunk(bounds, **params):
+    return [segmentFrame_timed(stack, t, **params) for t in range(*bounds)]
+
+def frameChange(frame, reference):
+    return np.mean(np.abs(frame - reference)) / max(np.mean(reference), np.finfo(float).eps)
+
+# Markers from the eroded foreground and background of the previous frame's random walker labels
+# Only the band of about twice the erosion around previous patch boundaries is left unlabelled and solved; no intensity threshold is computed
+# Previous labels are taken before cleanup, so that cleanup does not shrink masks a little more on every frame
+def seed_Markers(previous, erosion=1):
+    markers = np.zeros(previous.shape, dtype=np.uint)
+    markers[nd.binary_erosion(previous, iterations=erosion, border_value=1)] = 2
+    markers[nd.binary_erosion(~previous, iterations=erosion, border_value=1)] = 1
+
+    return markers
+
+# Random walker on seeds of the previous frame; frames without unlabelled pixels keep their seeds
+@timed
+def seeded_RandomWalker(img, markers, mode='bf', multiscale=1, band=2):
+    if not np.any(markers == 0):
+        return markers
+
+    return solve_RandomWalker(img, markers, mode, multiscale, band)
+
+# Fraction of seeded pixels whose intensity is on the wrong side of the median of the other label's seeds
+# Grows when patches move beyond the seeded band or appear in seeded background; without both labels seeds cannot be checked
+def seedDisagreement(img, markers):
+    foreground = img[markers == 2]
+    background = img[markers == 1]
+    if len(foreground) == 0 or len(background) == 0:
+        return 1.0
+
+    wrong = np.count_nonzero(foreground <= np.median(background)) + np.count_nonzero(background >= np.median(foreground))
+
+    return wrong / (len(foreground) + len(background))
+
+# Segment consecutive frames, reusing random walker labels of the previous frame
+# Frames whose seeds disagree with their intensities by more than drift_tolerance are segmented from scratch instead of being seeded
+def segmentChunk_incremental(bounds, solver='bf', multiscale=1, band=2, skip_threshold=0.01, erosion=1, drift_tolerance=0.01,
+                             check_dice=0, denoiser='nlm', window=3):
+    results = []
+    reference = previous = segment = None
+
+    for t in range(*bounds):
+        start = time.perf_counter()
+        frame = stack[t]
+
+        if reference is not None and frameChange(frame, reference) < skip_threshold:
+            status = 'copied'
+        else:
+            equalized = preprocessFrame(stack, t, denoiser, window)
+            status = 'full'
+
+            if previous is not None:
+                markers = seed_Markers(previous, erosion)
+                status = 'seeded' if seedDisagreement(equalized, markers) <= drift_tolerance else 'full (drift)'
+
+            if status == 'seeded':
+                labels = seeded_RandomWalker(equalized, markers, solver, multiscale, band)
+            else:
+                labels = segment_RandomWalker(equalized, 0.2, solver, multiscale, band)
+
+            previous = labels == 2
+            segment = dilate(cleanUp(previous), 3)
+            reference = frame
+
+        results.append((segment, time.perf_counter() - start, status))
+
+    # optionally, the last frame, which carries the most accumulated error, is compared with a full segmentation and the block is segmented from scratch if they depart
+    if check_dice > 0 and any(status != 'full' for _, _, status in results):
+        full = segmentFrame(stack, bounds[1] - 1, solver, multiscale, band, denoiser, window)
+        dice = calc_Dice(results[-1][0], full)
+        if dice < check_dice:
+            print(f"Frames {bounds[0]}-{bounds[1] - 1}: Dice overlap {dice:.4f} of incremental and full segmentation is below {check_dice}; segmenting from scratch")
+            return [mask[:2] + ('full (check)',) for mask in segmentChunk(bounds, solver=solver, multiscale=multiscale, band=band, denoiser=denoiser, window=window)]
+
+    return results
+
+def calc_Dice(a, b):
+    total = a.sum() + b.sum()
+    if total == 0:
+        return 1.0
+
+    return 2 * np.logical_and(a, b).sum() / total
+
+def sampleFrames(img, nframes):
+    return np.unique(np.linspace(0, len(img) - 1, min(nframes, len(img))).round().astype(int))
+
+# Runtime and Dice overlap with the brute force solver for every solver setting
+@timed
+def benchmarkSolvers(img, frames, multiscale=2, band=2, denoiser='nlm', window=3):
+    import pandas as pd
+    equalized = [preprocessFrame(img, t, denoiser, window) for t in frames]
+    settings = [(solver, scale) for scale in sorted({1, max(multiscale, 2)}) for solver in ['bf', 'cg', 'cg_j', 'cg_mg']]
+
+    reference = None
+    benchmark = []
+    for solver, scale in settings:
+        start = time.perf_counter()
+        segments = [segmentEqualized(frame, solver, scale, band) for frame in equalized]
+        runtime = (time.perf_counter() - start) / len(frames)
+
+        if reference is None:
+            reference = segments
+
+        dice = np.mean([calc_Dice(seg, ref) for seg, ref in zip(segments, reference)])
+        benchmark.append((solver, scale, len(frames), runtime, dice))
+        print(f"{solver:>6s}  x{scale:<2d}  {runtime:8.3f} s/frame    Dice {dice:.4f}")
+
+    return pd.DataFrame(benchmark, columns=['Solver', 'Multiscale', 'Frames', 'Time_per_frame', 'Dice'])
+
+# Runtime and Dice overlap of the final segmentation with the nlm denoiser for every denoiser
+@timed
+def autotuneDenoisers(img, frames, window=3, solver='bf', multiscale=1, band=2):
+    import pandas as pd
+    reference = None
+    autotune = []
+    for denoiser in ['nlm', 'nlm_fast', 'cv2_nlm', 'bilateral', 'temporal_median']:
+        start = time.perf_counter()
+        denoised = [denoiseFrame(img, t, denoiser, window) for t in frames]
+        denoise_time = (time.perf_counter() - start) / len(frames)
+
+        segments = [segmentEqualized(runCLAHE(frame, 2), solver, multiscale, band) for frame in denoised]
+        runtime = (time.perf_counter() - start) / len(frames)
+
+        if reference is None:
+            reference = segments
+
+        dice = np.mean([calc_Dice(seg, ref) for seg, ref in zip(segments, reference)])
+        autotune.append((denoiser, len(frames), denoise_time, runtime, dice))
+        print(f"{denoiser:>15s}  {denoise_time:8.3f} s/frame denoising  {runtime:8.3f} s/frame total    Dice {dice:.4f}")
+
+    return pd.DataFrame(autotune, columns=['Denoiser', 'Frames', 'Denoise_time_per_frame', 'Time_per_frame', 'Dice'])
+
+def preprocessChunk(bounds, denoiser='nlm', window=3):
+    return [preprocessFrame(stack, t, denoiser, window) for t in range(*bounds)]
+
+# Denoised and equalized stack cached next to the image stack as .npy
+# The cache is rebuilt when it is older than the image stack
+@timed
+def cacheEqualized(filename, processes=1, denoiser='nlm', window=3):
+    suffix = f'equalized-{denoiser}' + (f'-{window}' if denoiser == 'temporal_median' else '')
+    cachename = outName(filename, suffix, 'npy')
+
+    if os.path.exists(cachename) and os.path.getmtime(cachename) >= os.path.getmtime(filename):
+        if np.load(cachename, mmap_mode='r').shape == stack.shape:
+            print(f"Using cached preprocessed stack {cachename}")
+            return cachename
+
+    equalized = np.lib.format.open_memmap(cachename + '.tmp', mode='w+', dtype=np.uint8, shape=stack.shape)
+    chunks = [(t, t + 1) for t in range(len(stack))]
+    preprocess = partial(preprocessChunk, denoiser=denoiser, window=window)
+
+    # the pool is terminated when preprocessing fails, and the partial cache is removed
+    processes = max(1, min(processes, len(chunks)))
+    with (mp.Pool(processes, initializer=openStack, initargs=(filename,)) if processes > 1 else nullcontext()) as pool:
+        results = pool.imap(preprocess, chunks) if pool is not None else map(preprocess, chunks)
+
+        try:
+            start = time.perf_counter()
+            for t, frame in enumerate(chain.from_iterable(results)):
+                equalized[t] = frame
+                print(f"Preprocessed {t+1:>5d} of {len(stack)}    {time.perf_counter() - start:8.1f} s elapsed")
+        except BaseException:
+            del equalized
+            os.remove(cachename + '.tmp')
+            raise
+
+    equalized.flush()
+    del equalized
+    os.replace(cachename + '.tmp', cachename)
+
+    return cachename
+
+# Open the cached preprocessed stack in the current process
+def openEqualized(cachename):
+    global equalized_stack
+    equalized_stack = np.load(cachename, mmap_mode='r')
+
+# Patch area and count of frame t for every cleanup setting; the random walker is solved once per modifier
+def sweepFrame(job, settings, solver='bf', multiscale=1, band=2):
+    modifier, t = job
+    labels = segment_RandomWalker(np.asarray(equalized_stack[t]), modifier, solver, multiscale, band)
+    segment = labels == 2
+
+    sweep = []
+    for kernel, rounds in settings:
+        mask = dilate(cleanUp(segment, (kernel, kernel), rounds), 3)
+        count = nd.label(mask)[1]
+        sweep.append((modifier, kernel, rounds, t, mask.sum(), mask.size, count))
+
+    return sweep
+
+# Patch statistics per parameter setting, summarised over frames
+@timed
+def sweepParameters(cachename, frames, modifiers, kernels, rounds, processes=1, solver='bf', multiscale=1, band=2):
+    import pandas as pd
+    settings = [(kernel, n) for kernel in kernels for n in rounds]
+    jobs = [(modifier, t) for modifier in modifiers for t in frames]
+    sweep = partial(sweepFrame, settings=settings, solver=solver, multiscale=multiscale, band=band)
+
+    processes = max(1, min(processes, len(jobs)))
+    if processes == 1:
+        openEqualized(cachename)
+        results = list(map(sweep, jobs))
+    else:
+        with mp.Pool(processes, initializer=openEqualized, initargs=(cachename,)) as pool:
+            results = pool.map(sweep, jobs)
+
+    data = pd.DataFrame(list(chain.from_iterable(results)), columns=['Modifier', 'Kernel', 'Rounds', 'Frame', 'Area', 'Pixels', 'Patches'])
+    data['Area_fraction'] = data['Area'] / data['Pixels']
+
+    summary = data.groupby(['Modifier', 'Kernel', 'Rounds']).agg(Frames = ('Frame', 'count'),
+                                                                 Area_fraction = ('Area_fraction', 'mean'),
+                                                                 Area_fraction_SD = ('Area_fraction', 'std'),
+                                                                 Patches = ('Patches', 'mean'),
+                                                                 Patches_SD = ('Patches', 'std'),
+                                                                 Area = ('Area', 'sum'),
+                                                                 Patch_count = ('Patches', 'sum')).reset_index()
+    summary['Mean_patch_area'] = summary['Area'] / summary['Patch_count'].where(summary['Patch_count'] > 0)
+    summary = summary.drop(columns=['Area', 'Patch_count'])
+
+    for row in summary.itertuples():
+        print(f"modifier {row.Modifier:4.2f}  kernel {row.Kernel:>3d}  rounds {row.Rounds:>2d}    area {row.Area_fraction:6.3f}    patches {row.Patches:7.1f}    mean patch area {row.Mean_patch_area:8.1f} px")
+
+    return summary
+
+# Parameters that determine the checkpointed masks
+def checkpointParams(args, shape, block_size):
+    params = {key: getattr(args, key) for key in ['denoiser', 'temporal_window', 'solver', 'multiscale', 'band',
+                                                  'incremental', 'skip_threshold', 'seed_erosion', 'refresh',
+                                                  'drift_tolerance', 'check_dice']}
+    params.update(filename=os.path.basename(args.filename), shape=list(shape), block_size=block_size)
+
+    return params
+
+def blockName(directory, bounds):
+    return os.path.join(directory, f'block_{bounds[0]:06d}_{bounds[1]:06d}.npz')
+
+# Checkpoint directory with the run parameters; blocks of a previous run are kept only when resuming with the same parameters
+def openCheckpoint(directory, params, resume=False):
+    os.makedirs(directory, exist_ok=True)
+    paramfile = os.path.join(directory, 'params.json')
+
+    if resume and os.path.exists(paramfile):
+        with open(paramfile) as fh:
+            saved = json.load(fh)
+        if saved != params:
+            raise ValueError(f"checkpoints in {directory} were written with different parameters; run without --resume to start over")
+        return
+
+    for old in glob.glob(os.path.join(directory, 'block_*.npz')):
+        os.remove(old)
+    with open(paramfile, 'w') as fh:
+        json.dump(params, fh, indent=4)
+
+# Bit-packed masks, frame times and statuses of a block; written to a temporary file first so that blocks are never partial
+def saveBlock(directory, bounds, results):
+    masks, times, statuses = zip(*results)
+    filename = blockName(directory, bounds)
+
+    with open(filename + '.tmp', 'wb') as fh:
+        np.savez_compressed(fh, masks=np.packbits(np.array(masks), axis=-1), times=np.array(times), status=np.array(statuses))
+    os.replace(filename + '.tmp', filename)
+
+def loadBlock(directory, bounds, width):
+    with np.load(blockName(directory, bounds)) as block:
+        masks = np.unpackbits(block['masks'], axis=-1, count=width).astype(bool)
+        times = block['times']
+
+    return [(mask, frame_time, 'resumed') for mask, frame_time in zip(masks, times)]
+
+# Results of all blocks in frame order; finished blocks are read from checkpoints, new blocks are checkpointed
+def streamBlocks(blocks, done, results, directory, width):
+    for bounds in blocks:
+        if bounds in done:
+            yield from loadBlock(directory, bounds, width)
+        else:
+            block = list(islice(results, bounds[1] - bounds[0]))
+            saveBlock(directory, bounds, block)
+            yield from block
+
+def segmentStack(args, instrument):
+    openStack(args.filename)
+
+    if args.benchmark == 'True':
+        benchmark = benchmarkSolvers(stack, sampleFrames(stack, args.benchmark_frames), args.multiscale, args.band, args.denoiser, args.temporal_window)
+        benchmark.to_csv(outName(args.filename, 'solver-benchmark', 'csv'), index=False, float_format='%.4f')
+        return
+
+    if args.autotune == 'True':
+        autotune = autotuneDenoisers(stack, sampleFrames(stack, args.benchmark_frames), args.temporal_window, args.solver, args.multiscale, args.band)
+        autotune.to_csv(outName(args.filename, 'denoiser-autotune', 'csv'), index=False, float_format='%.4f')
+        return
+
+    if args.sweep == 'True':
+        cachename = cacheEqualized(args.filename, args.processes, args.denoiser, args.temporal_window)
+        frames = sampleFrames(stack, args.sweep_frames) if args.sweep_frames > 0 else range(len(stack))
+        sweep = sweepParameters(cachename, frames, args.sweep_modifier, args.sweep_kernel, args.sweep_rounds,
+                                args.processes, args.solver, args.multiscale, args.band)
+        sweep.to_csv(outName(args.filename, 'parameter-sweep', 'csv'), index=False, float_format='%.4f')
+        return
+
+    if args.incremental == 'True':
+        chunk_size = max(1, args.refresh)
+        segment = partial(segmentChunk_incremental, solver=args.solver, multiscale=args.multiscale, band=args.band, skip_threshold=args.skip_threshold,
+                          erosion=args.seed_erosion, drift_tolerance=args.drift_tolerance, check_dice=args.check_dice, denoiser=args.denoiser, window=args.temporal_window)
+    else:
+        chunk_size = 1
+        segment = partial(segmentChunk, solver=args.solver, multiscale=args.multiscale, band=args.band, denoiser=args.denoiser, window=args.temporal_window)
+
+    # checkpoint blocks; incremental blocks match the refresh interval so that resumed runs give the same masks
+    checkpoint = args.checkpoint_every > 0
+    block_size = chunk_size if args.incremental == 'True' or not checkpoint else args.checkpoint_every
+    blocks = [(t, min(t + block_size, len(stack))) for t in range(0, len(stack), block_size)]
+
+    done = set()
+    if checkpoint:
+        directory = outName(args.filename, 'segmented', 'checkpoint')
+        openCheckpoint(directory, checkpointParams(args, stack.shape, block_size), args.resume == 'True')
+        done = {bounds for bounds in blocks if os.path.exists(blockName(directory, bounds))}
+        if done:
+            print(f"Resuming: {sum(stop - start for start, stop in done)} of {len(stack)} frames checkpointed")
+
+    chunks = [(t, min(t + chunk_size, stop)) for start, stop in blocks if (start, stop) not in done for t in range(start, stop, chunk_size)]
+
+    # frames are returned in order as they complete; workers read frames from their own handle
+    # the pool is terminated when segmentation fails, and the partial mask file is removed
+    processes = max(1, min(args.processes, len(chunks)))
+    with (mp.Pool(processes, initializer=openStack, initargs=(args.filename,)) if processes > 1 else nullcontext()) as pool:
+        results = pool.imap(segment, chunks) if pool is not None else map(segment, chunks)
+
+        # masks are written as frames arrive
+        outname = outName(args.filename, 'segmented', args.mask_format)
+        writer = maskWriter(outname, stack.shape, args.mask_format, args.bitpacked == 'True')
+
+        results = chain.from_iterable(results)
+        if checkpoint:
+            results = streamBlocks(blocks, done, results, directory, stack.shape[2])
+        if args.temporal_smoothing > 1:
+            results = smoothMasks(results, len(stack), args.temporal_smoothing)
+
+        # frames are segmented while they are written, so both are timed as one stage; worker CPU time is counted once the pool is joined
+        try:
+            with instrument.stage('segmentFrames') as record:
+                start = time.perf_counter()
+                for t, (segment, frame_time, status) in enumerate(results):
+                    writer.write(segment)
+                    print(f"{t+1:>5d} of {len(stack)}    {frame_time:6.2f} s    {time.perf_counter() - start:8.1f} s elapsed    {status}")
+                record['rows'] = writer.frames
 
-def imageSave(filename, suffix, img):
-    img = np.bool8(img)
+                writer.close()
 
-    outname = '.'.join(filename.split('.')[:-1])
-    outname = f'{outname}_{suffix}.tif'
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+        except BaseException:
+            writer.close()
+            os.remove(outname)
+            raise
 
-    io.imsave(outname, img)
+    # checkpoints are no longer needed once the mask stack is complete
+    if checkpoint:
+        shutil.rmtree(directory)
 
-def main():
-    filename = sys.argv[1]
-    img = readImg(filename)
-    segmented_img = np.zeros(np.shape(img))
+def main(argv=None):
+    args = get_args(argv)
+    instrument = Instrumentation(args.profile == 'True')
 
-    for t in range(len(img)):
-        denoise = denoiseImg(img[t])
-        equalized = runCLAHE(denoise, 2)
-        labels = segment_RandomWalker(equalized, 0.2)
-        segment = labels == 2
-        cleaned_seg = cleanUp(segment)
-        dilated_seg = dilate(cleaned_seg, 3)
-        segmented_img[t] = dilated_seg
-        print(f"{t+1:>5d} of {len(img)}")
+    # steps run in worker processes are only timed individually with --processes 1
+    with instrument:
+        segmentStack(args, instrument)
 
-    imageSave(filename, 'segmented', segmented_img)
+    instrument.dataOUT(outName(args.filename, 'timings', 'json'), outName(args.filename, 'profile', 'prof'))
 
-main()
+if __name__ == '__main__':
+    main()
 
 # Ankit Roy
 # 9th January, 2023
+# 19th October, 2026    >>      Frames can be segmented in parallel with --processes
+#                       >>      Reports per-frame and elapsed time
+#                       >>      Random walker solver can be chosen with --solver (bf, cg, cg_j, cg_mg)
+#                       >>      Added multiscale random walker refined at label boundaries (--multiscale)
+#                       >>      Added solver benchmark reporting runtime and Dice overlap with bf (--benchmark)
+#                       >>      Added incremental mode seeding the random walker from the previous frame (--incremental)
+#                       >>      Frames are read lazily as float32 and masks are written frame by frame by maskWriter, which replaces imageSave (uint8 or --bitpacked)
+#                       >>      Masks can be written as compressed bit-packed mask archives (--mask_format npz)
+#                       >>      Denoising method can be chosen with --denoiser (nlm, nlm_fast, cv2_nlm, bilateral, temporal_median)
+#                       >>      Added denoiser autotune reporting runtime and Dice overlap with nlm (--autotune)
+#                       >>      Mask cleanup uses OpenCV morphology (identical results) and masks can be smoothed along time (--temporal_smoothing)
+#                       >>      Completed frames are checkpointed in blocks and interrupted runs can be resumed (--checkpoint_every, --resume)
+#                       >>      Added parameter sweep over marker threshold and cleanup settings reusing a cached preprocessed stack (--sweep)
+#                       >>      get_args and main accept a list of arguments (batch processing)
+#                       >>      Records wall time, CPU time, peak memory and frame counts of the segmentation steps (_timings.json)
+#                       >>      Added --profile to write cProfile stats (_profile.prof)
+#                       >>      OpenCV, scikit-image and pandas are imported in the functions that use them and matplotlib is no longer imported (faster start)
+#                       >>      OpenCV kernel anchors follow scipy.ndimage, so even cleanup kernel sizes give identical results too
+#                       >>      Incremental mode seeds from uncleaned labels of the previous frame and this frame's intensity markers, honours --multiscale, falls back to full segmentation when the foreground area drifts (--drift_tolerance) or the last frame of a block departs from full segmentation (--check_dice); --refresh defaults to 10
+#                       >>      Worker processes are terminated and the partial mask file is removed when segmentation fails
+#                       >>      Seeded frames are seeded only from the eroded foreground and background of the previous labels (--seed_erosion defaults to 1 px), are checked for drift before solving (--drift_tolerance) so drifting frames are solved once, and the block check (--check_dice) is off by default
@@ -1,92 +1,325 @@
 #!/Users/roy/mambaforge/bin/python
 
-import sys
+import argparse
+import os
+import time
+import multiprocessing as mp
+from functools import partial
+from contextlib import nullcontext
+# OpenCV and scikit-image are imported in the functions that use them, so that importing this script is fast
 import numpy as np
-from skimage import io, img_as_float, img_as_ubyte, filters
-from skimage.restoration import denoise_nl_means, estimate_sigma
-from skimage.segmentation import random_walker
 from scipy import ndimage as nd
-import cv2
-import matplotlib.pyplot as plt
-import pandas as pd
+from tiff_stack import TiffStack, outName
+from mask_archive import maskWriter
+from instrumentation import Instrumentation, timed
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser()
+
+    # Lipid channel image stack
+    parser.add_argument("filename",
+                        help = "Lipid channel image stack")
+
+    # Random walker solver
+    parser.add_argument("--solver",
+                        help = "(default = bf) Random walker solver; cg_mg requires pyamg",
+                        choices = ['bf', 'cg', 'cg_j', 'cg_mg'],
+                        default = 'bf')
+
+    # Multiscale random walker
+    parser.add_argument("--multiscale",
+                        help = "(default = 1) Downsampling factor for a coarse random walker solve that is refined at label boundaries; 1 solves at full resolution",
+                        default = 1,
+                        type = int)
+
+    # Refinement band for multiscale random walker
+    parser.add_argument("--band",
+                        help = "(default = 2) Half-width in coarse pixels of the boundary band refined at full resolution",
+                        default = 2,
+                        type = int)
+
+    # Tile grid
+    parser.add_argument("--grid",
+                        help = "(default = 2x2) Tile grid as ROWSxCOLUMNS",
+                        default = "2x2")
+
+    # Tile overlap
+    parser.add_argument("--halo",
+                        help = "(default = 0 px) Overlap added around every tile",
+                        default = 0,
+                        type = int)
+
+    # Seam handling
+    parser.add_argument("--stitch",
+                        help = "(default = crop) crop keeps only the core of every tile; blend takes a weighted vote in the overlaps",
+                        choices = ['crop', 'blend'],
+                        default = 'crop')
+
+    # Bit-packed mask output
+    parser.add_argument("--bitpacked",
+                        help = "(default = False) Write masks as bit-packed (1 bit) pages instead of uint8",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    # Mask file format
+    parser.add_argument("--mask_format",
+                        help = "(default = tif) Write masks as a TIFF stack or as a compressed bit-packed mask archive (npz)",
+                        choices = ['tif', 'npz'],
+                        default = 'tif')
+
+    # Number of processes
+    parser.add_argument("--processes",
+                        help = "(default = all cores) Number of tiles segmented in parallel",
+                        default = mp.cpu_count(),
+                        type = int)
+
+    # Profiling
+    parser.add_argument("--profile",
+                        help = "(default = False) Write cProfile stats of the run (_profile.prof)",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    args = parser.parse_args(argv)
+
+    return args
 
 def getImage(filename):
-    img = io.imread(filename)
+    img = TiffStack(filename)
     return img
 
+# Open the image stack in the current process; frames are read on demand
+@timed
+def openStack(filename):
+    global stack
+    stack = getImage(filename)
+
+@timed
 def denoiseImg(img):
-    sigma_est = np.mean(estimate_sigma(img, channel_axis=None))
-    denoise = denoise_nl_means(img, h=1.15 * sigma_est, fast_mode=False, patch_size=5, patch_distance=6)
+    from skimage import restoration
+    sigma_est = np.mean(restoration.estimate_sigma(img, channel_axis=None))
+    denoise = restoration.denoise_nl_means(img, h=1.15 * sigma_est, fast_mode=False, patch_size=5, patch_distance=6)
     return denoise
 
+@timed
 def runCLAHE(img, size=4):
-    img = img_as_ubyte(img)
+    import cv2
+    from skimage import util
+    img = util.img_as_ubyte(img)
     clahe = cv2.createCLAHE(clipLimit = np.max(img), tileGridSize = (size,size))
     equalized = clahe.apply(img)
     return equalized
 
-def segment_RandomWalker(img, upper_percentile=70, lower_percentile=30):
+# Solve on a downsampled image, then re-solve only a band around label boundaries at full resolution
+def multiscale_RandomWalker(img, markers, mode='bf', scale=2, band=2):
+    from skimage import segmentation, transform
+    coarse_img = transform.downscale_local_mean(img, (scale, scale)).round().astype(img.dtype)
+    coarse_markers = markers[::scale, ::scale]
+    coarse_labels = segmentation.random_walker(coarse_img, coarse_markers, beta=10, mode=mode)
+
+    labels = np.repeat(np.repeat(coarse_labels, scale, axis=0), scale, axis=1)[:img.shape[0], :img.shape[1]]
+
+    foreground = labels == 2
+    boundary = nd.binary_dilation(foreground, iterations=band*scale) & ~nd.binary_erosion(foreground, iterations=band*scale, border_value=1)
+
+    refine_markers = labels.astype(markers.dtype)
+    refine_markers[boundary] = markers[boundary]
+    if not np.any(refine_markers == 0):
+        return refine_markers
+
+    return segmentation.random_walker(img, refine_markers, beta=10, mode=mode)
+
+@timed
+def segment_RandomWalker(img, upper_percentile=70, lower_percentile=30, mode='bf', multiscale=1, band=2):
+    from skimage import segmentation
 
     markers = np.zeros(img.shape, dtype=np.uint)
     markers[(img >= np.percentile(img, upper_percentile))] = 2
     markers[(img <= np.percentile(img, lower_percentile))] = 1
 
-    labels = random_walker(img, markers, beta=10, mode='bf')
-    
+    if multiscale > 1:
+        labels = multiscale_RandomWalker(img, markers, mode, multiscale, band)
+    else:
+        labels = segmentation.random_walker(img, markers, beta=10, mode=mode)
+
     return labels
 
+# Kernel anchor as in scipy.ndimage: erosion centres kernels at size//2, dilation at (size-1)//2
+# The two differ for even kernel sizes, where the default OpenCV anchor (size//2) would shift dilations by a pixel
+def kernelAnchor(operation, kernel):
+    import cv2
+    rows, cols = kernel.shape
+    if operation is cv2.dilate:
+        return ((cols - 1) // 2, (rows - 1) // 2)
+
+    return (cols // 2, rows // 2)
+
+# Binary morphology with OpenCV on uint8 frames
+# Pixels outside the frame are background, which reproduces scipy.ndimage binary morphology exactly
+def morphology(img, operation, kernel, iterations=1):
+    import cv2
+    img = np.asarray(img, dtype=np.uint8)
+
+    return operation(img, kernel, anchor=kernelAnchor(operation, kernel), iterations=iterations, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+
+def closing(img, kernel):
+    import cv2
+    return morphology(morphology(img, cv2.dilate, kernel), cv2.erode, kernel)
+
+def opening(img, kernel):
+    import cv2
+    return morphology(morphology(img, cv2.erode, kernel), cv2.dilate, kernel)
+
+@timed
 def cleanUp(img, kernel_size=(9,9), rounds=5):
+    img = np.asarray(img, dtype=np.uint8)
     for run in range(rounds):
-        img = nd.binary_closing(img, np.ones((5,5)))
-        img = nd.binary_opening(img, np.ones(kernel_size))
-        
-    return img
+        img = closing(img, np.ones((5,5), dtype=np.uint8))
+        img = opening(img, np.ones(kernel_size, dtype=np.uint8))
+
+    return img.astype(bool)
 
+# Dilation with the 3x3 cross used by default in scipy.ndimage
 def dilate(img, rounds=1):
+    import cv2
+    img = np.asarray(img, dtype=np.uint8)
     for run in range(rounds):
-        img = nd.binary_dilation(img)
-        img = nd.binary_closing(img, np.ones((5,5)))
-        img = nd.binary_opening(img, np.ones((5,5)))
-        
-    return img
+        img = morphology(img, cv2.dilate, cv2.getStructuringElement(cv2.MORPH_CROSS, (3,3)))
+        img = closing(img, np.ones((5,5), dtype=np.uint8))
+        img = opening(img, np.ones((5,5), dtype=np.uint8))
+
+    return img.astype(bool)
+
+def parseGrid(grid):
+    rows, cols = grid.lower().split('x')
+    return int(rows), int(cols)
+
+# Core and halo-extended slices of every tile, row by row
+def tileBounds(shape, grid=(2,2), halo=0):
+    row_edges = np.linspace(0, shape[0], grid[0]+1, dtype=int)
+    col_edges = np.linspace(0, shape[1], grid[1]+1, dtype=int)
+
+    tiles = []
+    for r0, r1 in zip(row_edges[:-1], row_edges[1:]):
+        for c0, c1 in zip(col_edges[:-1], col_edges[1:]):
+            core = (slice(r0, r1), slice(c0, c1))
+            outer = (slice(max(r0-halo, 0), min(r1+halo, shape[0])), slice(max(c0-halo, 0), min(c1+halo, shape[1])))
+            tiles.append((core, outer))
+
+    return tiles
+
+# Weights falling off linearly across the halo of a tile
+def tileWeights(core, outer, halo):
+    weights = []
+    for core_axis, outer_axis in zip(core, outer):
+        position = np.arange(outer_axis.start, outer_axis.stop)
+        ramp = np.ones(len(position))
+        before = position < core_axis.start
+        after = position >= core_axis.stop
+        ramp[before] = (position[before] - (core_axis.start - halo) + 1) / (halo + 1)
+        ramp[after] = ((core_axis.stop + halo) - position[after]) / (halo + 1)
+        weights.append(ramp)
+
+    return np.outer(weights[0], weights[1])
+
+@timed
+def spliceTiles(shape, tiles, segments, halo=0, stitch='crop'):
+    if stitch == 'crop' or halo == 0:
+        spliced_img = np.zeros(shape, dtype=bool)
+        for (core, outer), segment in zip(tiles, segments):
+            inner = tuple(slice(c.start - o.start, c.stop - o.start) for c, o in zip(core, outer))
+            spliced_img[core] = segment[inner]
+
+        return spliced_img
+
+    votes = np.zeros(shape)
+    total_weights = np.zeros(shape)
+    for (core, outer), segment in zip(tiles, segments):
+        weights = tileWeights(core, outer, halo)
+        votes[outer] += weights * segment
+        total_weights[outer] += weights
+
+    return votes > 0.5 * total_weights
+
+def segmentTile(tile, upper_thr=50, lower_thr=20, solver='bf', multiscale=1, band=2):
+    denoise = denoiseImg(tile)
+    equalized = runCLAHE(denoise, 2)
+    labels = segment_RandomWalker(equalized, upper_thr, lower_thr, solver, multiscale, band)
+
+    return labels == 2
+
+# Segment tile number index of frame t
+def segmentTileJob(job, tiles, **params):
+    t, index = job
+    core, outer = tiles[index]
+
+    return segmentTile(stack.raw(t)[outer], **params)
+
+def segmentStack(args, instrument):
+    filename = args.filename
+    openStack(filename)
 
-def imageSave(filename, suffix, img):
-    img = np.bool8(img)
+    tiles = tileBounds(stack.shape[1:], parseGrid(args.grid), args.halo)
+    segment = partial(segmentTileJob, tiles=tiles, upper_thr=50, lower_thr=20, solver=args.solver, multiscale=args.multiscale, band=args.band)
+    jobs = [(t, index) for t in range(len(stack)) for index in range(len(tiles))]
 
-    outname = '.'.join(filename.split('.')[:-1])
-    outname = f'{outname}_{suffix}.tif'
+    # tiles are returned in order as they complete; workers read frames from their own handle
+    # the pool is terminated when segmentation fails, and the partial mask file is removed
+    processes = max(1, min(args.processes, len(jobs)))
+    with (mp.Pool(processes, initializer=openStack, initargs=(filename,)) if processes > 1 else nullcontext()) as pool:
+        results = pool.imap(segment, jobs) if pool is not None else map(segment, jobs)
 
-    io.imsave(outname, img)
+        # masks are written as frames are completed
+        outname = outName(filename, 'segmented', args.mask_format)
+        writer = maskWriter(outname, stack.shape, args.mask_format, args.bitpacked == 'True')
 
-def main():
-    filename = sys.argv[1]
-    img = getImage(filename)
+        # tiles are segmented while frames are spliced and written, so all are timed as one stage; worker CPU time is counted once the pool is joined
+        try:
+            with instrument.stage('segmentFrames') as record:
+                start = time.perf_counter()
+                for t in range(len(stack)):
+                    segments = [next(results) for tile in tiles]
+                    spliced_img = spliceTiles(stack.shape[1:], tiles, segments, args.halo, args.stitch)
 
-    slices = np.linspace(0, img.shape[1], 3, dtype=int)
+                    cleaned_seg = cleanUp(spliced_img)
+                    # dilated_seg = dilate(cleaned_seg, 2)
+                    writer.write(cleaned_seg)
+                    print(f"{t+1:>5d} of {len(stack)}    {time.perf_counter() - start:8.1f} s elapsed")
+                record['rows'] = writer.frames
 
-    segmented_img = np.zeros(img.shape)
+                writer.close()
 
-    for t in range(len(img)):
-        spliced_img = np.zeros(img[t].shape, dtype=bool)
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+        except BaseException:
+            writer.close()
+            os.remove(outname)
+            raise
 
-        for x_index in range(len(slices)-1):
-            for y_index in range(len(slices)-1):
-                
-                denoise = denoiseImg(img[t,slices[x_index]:slices[x_index+1]:,slices[y_index]:slices[y_index+1]:])
-                equalized = runCLAHE(denoise, 2)
-                upper_thr, lower_thr = (50, 20)
-                labels = segment_RandomWalker(equalized, upper_thr, lower_thr)
-                segment = labels == 2
-                spliced_img[slices[x_index]:slices[x_index+1], slices[y_index]:slices[y_index+1]] = segment
+def main(argv=None):
+    args = get_args(argv)
+    instrument = Instrumentation(args.profile == 'True')
 
-        cleaned_seg = cleanUp(spliced_img)
-        # dilated_seg = dilate(cleaned_seg, 2)
-        segmented_img[t] = cleaned_seg
-        print(f"{t+1:>5d} of {len(img)}")
+    # steps run in worker processes are only timed individually with --processes 1
+    with instrument:
+        segmentStack(args, instrument)
 
-    imageSave(filename, 'segmented', segmented_img)
+    instrument.dataOUT(outName(args.filename, 'timings', 'json'), outName(args.filename, 'profile', 'prof'))
 
-main()
+if __name__ == '__main__':
+    main()
 
 # Ankit Roy
-# 7th June, 2024
\ No newline at end of file
+# 7th June, 2024
+# 19th October, 2026    >>      Random walker solver can be chosen with --solver (bf, cg, cg_j, cg_mg)
+#                       >>      Added multiscale random walker refined at label boundaries (--multiscale)
+#                       >>      Tile grid is configurable (--grid) and tiles follow both image axes
+#                       >>      Tiles can overlap (--halo) and are cropped or blended at seams (--stitch)
+#                       >>      Tiles are segmented in parallel (--processes)
+#                       >>      Frames are read lazily and masks are written frame by frame by maskWriter, which replaces imageSave (uint8 or --bitpacked)
+#                       >>      Masks can be written as compressed bit-packed mask archives (--mask_format npz)
+#                       >>      Mask cleanup uses OpenCV morphology (identical results)
+#                       >>      OpenCV and scikit-image are imported in the functions that use them; unused matplotlib and pandas imports removed (faster start)
+#                       >>      OpenCV kernel anchors follow scipy.ndimage, so even cleanup kernel sizes give identical results too
+#                       >>      Worker processes are terminated and the partial mask file is removed when segmentation fails
+#                       >>      Stage timings are written to _timings.json; added --profile to write cProfile stats
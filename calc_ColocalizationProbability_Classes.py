@@ -1,8 +1,9 @@
 #!/Users/roy/anaconda3/bin/python
 
+import argparse
 import pandas as pd
-import sys
 import numpy as np
+from instrumentation import Instrumentation, timed
  
 __author__ = "Ankit Roy"
 __copyright__ = "Copyright 2022, Bieling Lab, Max Planck Institute of Molecular Physiology"
@@ -11,18 +12,20 @@ __maintainer__ = "Ankit Roy"
 __status__ = "Development"
 
 # Get data
+@timed
 def dataIN(filename):
 	data = pd.read_csv(filename, comment='#')
 	return data
 
 # Get single channel data
 # Default: GTPase channel
-def singleChannel(data):
+@timed
+def singleChannel(data, channel="GTPase"):
 	data = data[data["CHANNEL"] == channel]
 	return data
 
 # Get recruitment frames
-def get_recruitmentFrames(data):
+def get_recruitmentFrames(data, frame_threshold=3):
 	max_rec_frame = min(data["FRAME"]) + frame_threshold			# max recruitment frame number
 	subset_data = data.loc[(data["FRAME"] < max_rec_frame), ]		# recruitment frame data
 
@@ -32,7 +35,7 @@ def get_recruitmentFrames(data):
 	return (recruitment_events, total_frames, round(recruitment_events/frame_threshold, 2))
 
 # Get extraction frames
-def get_extractionFrames(data):
+def get_extractionFrames(data, frame_threshold=3):
 	min_ext_frame = max(data["FRAME"]) - frame_threshold			# min extraction frame number
 	subset_data = data.loc[(data["FRAME"] > min_ext_frame), ]		# extraction frame data
 
@@ -42,7 +45,7 @@ def get_extractionFrames(data):
 	return (extraction_events, total_frames, round(extraction_events/frame_threshold, 2))
 
 # Get internal frames
-def get_internalFrames(data):
+def get_internalFrames(data, frame_threshold=3):
 	min_int_frame = min(data["FRAME"]) + frame_threshold			# min internal frame number
 	max_int_frame = max(data["FRAME"]) - frame_threshold			# max internal frame number
 	subset_data = data.loc[(data["FRAME"] >= min_int_frame) & (data["FRAME"] <= max_int_frame), ]	# internal frame data
@@ -57,11 +60,12 @@ def get_internalFrames(data):
 		return (internal_events, total_frames, 'NA')
 
 # Get recruitment frames
-# Default: First 3 frames
-def classifyFrames(data):
+# Default: First 3 frames, tracks of at least 5 frames
+@timed
+def classifyFrames(data, frame_threshold=3, min_track_length=5):
 
 	# group by pseudo track ids
-	groupings = data.groupby(["PSEUDO_TRACK_ID"])
+	groupings = data.groupby("PSEUDO_TRACK_ID")
 
 	# recruitment, extraction and internal colocalization statistics
 	# for each pseudo track id stores a tuple with 3 values:
@@ -92,9 +96,9 @@ def classifyFrames(data):
 		if track_length < min_track_length:
 			continue
 
-		recruitmentStats[gid] = get_recruitmentFrames(group)		# recruitment statistics
-		extractionStats[gid] = get_extractionFrames(group)			# extraction statistics
-		internalStats[gid] = get_internalFrames(group)				# internal colocalization statistics
+		recruitmentStats[gid] = get_recruitmentFrames(group, frame_threshold)	# recruitment statistics
+		extractionStats[gid] = get_extractionFrames(group, frame_threshold)		# extraction statistics
+		internalStats[gid] = get_internalFrames(group, frame_threshold)			# internal colocalization statistics
 
 		recruitmentProbs.append(recruitmentStats[gid][2])			# store recruitment probabilities
 		extractionProbs.append(extractionStats[gid][2])				# store extraction probabilities
@@ -109,6 +113,7 @@ def classifyFrames(data):
 	return recruitmentProbs, extractionProbs, internalProbs, data
 
 # Generate plotabble output
+@timed
 def gen_plotOut(recruitmentProbs, extractionProbs, internalProbs):
 
 	values = []						# probabilities
@@ -130,6 +135,7 @@ def gen_plotOut(recruitmentProbs, extractionProbs, internalProbs):
 	return plotData
 
 # Generate plot file
+@timed
 def gen_plotFile(data, filename):
 
 	outname = filename[:-4]
@@ -138,36 +144,64 @@ def gen_plotFile(data, filename):
 	# write plot file
 	data.to_csv(outname, index=False, float_format="%.3f")
 
+# Fetch arguments
+def get_args(argv=None):
+	parser = argparse.ArgumentParser()
+
+	# Colocalization subset file
+	parser.add_argument("filename",
+								help = "Colocalized track subset file (_subset.csv) from getStat_TracksColocalized.py")
+
+	# Profiling
+	parser.add_argument("--profile",
+								help = "(default = False) Write cProfile stats of the run to <filename>_probPlot_profile.prof",
+								choices = ['True', 'False'],
+								default = 'False')
+
+	args = parser.parse_args(argv)
+
+	return args
+
 # Main function
-def main():
+def main(argv=None):
 
-	global frame_threshold
-	global min_track_length
-	global channel
+	args = get_args(argv)
+	instrument = Instrumentation(args.profile == 'True')	# stage timings
 
 	frame_threshold = 3				# frames to consider for recruitment and extraction
 	min_track_length = 5			# minimum track length to consider for analysis
 	channel = "GTPase"				# channel for analysis
 
 	pd.set_option('display.max_columns', None)
-	filename = sys.argv[1]			# input colocalization subset file name
-	data = dataIN(filename)			# colocalization subset data
+	filename = args.filename		# input colocalization subset file name
 
-	data = singleChannel(data)		# GTPase channel data
+	with instrument:
+		data = dataIN(filename)			# colocalization subset data
 
-	# classify frames into recruitment, extraction or internal and calculate probabilities
-	recruitmentProbs, extractionProbs, internalProbs, data = classifyFrames(data)
+		data = singleChannel(data, channel)		# GTPase channel data
 
-	# generate data frame with plottable data
-	plotData = gen_plotOut(recruitmentProbs, extractionProbs, internalProbs)
+		# classify frames into recruitment, extraction or internal and calculate probabilities
+		recruitmentProbs, extractionProbs, internalProbs, data = classifyFrames(data, frame_threshold, min_track_length)
 
-	# write plot file
-	gen_plotFile(plotData, filename)
+		# generate data frame with plottable data
+		plotData = gen_plotOut(recruitmentProbs, extractionProbs, internalProbs)
+
+		# write plot file
+		gen_plotFile(plotData, filename)
+
+	# Write stage timings
+	outname = f"{filename[:-4]}_probPlot"
+	instrument.dataOUT(f"{outname}_timings.json", f"{outname}_profile.prof")
 
 # Run main function
-main()
+if __name__ == '__main__':
+	main()
 
 # Ankit Roy
 # 21st January, 2022
 # 25th January, 2022		>>		Classifies tracks into recruitment, extraction and internal frames and returns event probabilities
 # 27th January, 2022		>>		Now writes out a file with colocalization probabilities in a plotable format
+# 19th October, 2026		>>		Thresholds are passed to functions explicitly and the script can be imported without running
+#							>>		Tracks are grouped by a single key, so that track start frames are found with current pandas versions
+#							>>		Arguments are parsed with argparse (--help)
+#							>>		Stage timings are written to _probPlot_timings.json; added --profile to write cProfile stats
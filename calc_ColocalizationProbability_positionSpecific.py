@@ -1,9 +1,11 @@
 #!/Users/roy/anaconda3/bin/python
 
-import sys
+import argparse
 import pandas as pd
+from instrumentation import Instrumentation, timed
 
 #--- Get data
+@timed
 def dataIN(filename):
 	data = pd.read_csv(filename, comment="#",
 			dtype = {
@@ -16,18 +18,20 @@ def dataIN(filename):
 	return data
 
 #--- Get single channel data
+@timed
 def get_singleChannel(data, channel="GTPase"):
 	data = data[data["CHANNEL"] == channel]
 	return data
 
 #--- Normalize track start
+@timed
 def normalize_trackStart(data):
 
 	# stores data for all track starting positions
 	all_trackStarts = {}
 
 	# group tracks according to pseudo track id
-	groupings = data.groupby(["PSEUDO_TRACK_ID"])
+	groupings = data.groupby("PSEUDO_TRACK_ID")
 	
 	# find and store track start for all tracks
 	for gid, group in groupings:
@@ -39,6 +43,7 @@ def normalize_trackStart(data):
 	return data
 
 #--- Get position specific colocalization probabilities
+@timed
 def get_posProbs(data):
 
 	# stores all position specific colocalization probabilities and observation counts
@@ -48,7 +53,7 @@ def get_posProbs(data):
 	posProbs = {}
 
 	# group data according to the normalized frame
-	groupings = data.groupby(["NORM_FRAME"])
+	groupings = data.groupby("NORM_FRAME")
 
 	# calculate the colocalization probability at every position and store along with the number of observations at that position
 	for gid, group in groupings:
@@ -61,6 +66,7 @@ def get_posProbs(data):
 	return posProbs
 
 #--- Generate plotabble data
+@timed
 def gen_plotOut(posProbs, time_resolution):
 
 	frames = sorted(list(posProbs.keys()))			# normalized frames
@@ -80,6 +86,7 @@ def gen_plotOut(posProbs, time_resolution):
 	return posProbs_df
 
 #--- Generate plot file
+@timed
 def gen_plotFile(posProbs, filename):
 
 	outname = filename[:-4]
@@ -88,29 +95,59 @@ def gen_plotFile(posProbs, filename):
 	# write plot file
 	posProbs.to_csv(outname, index=False, float_format="%.4f")
 
+#--- Fetch arguments
+def get_args(argv=None):
+	parser = argparse.ArgumentParser()
+
+	# Colocalization subset file
+	parser.add_argument("filename",
+								help = "Colocalized track subset file (_subset.csv) from getStat_TracksColocalized.py")
+
+	# Profiling
+	parser.add_argument("--profile",
+								help = "(default = False) Write cProfile stats of the run to <filename>_posProbPlot_profile.prof",
+								choices = ['True', 'False'],
+								default = 'False')
+
+	args = parser.parse_args(argv)
+
+	return args
+
 #--- Main function
-def main():
-	filename = sys.argv[1]				# file name
+def main(argv=None):
+	args = get_args(argv)
+	filename = args.filename			# file name
+	instrument = Instrumentation(args.profile == 'True')	# stage timings
 
 	time_resolution = 0.022				# s
 
-	data = dataIN(filename)				# load single molecule data
-	pd.set_option('display.max_columns', None)
+	with instrument:
+		data = dataIN(filename)				# load single molecule data
+		pd.set_option('display.max_columns', None)
+
+		data = get_singleChannel(data)		# get single channel
 
-	data = get_singleChannel(data)		# get single channel
+		data = normalize_trackStart(data)	# normalize track start positions
 
-	data = normalize_trackStart(data)	# normalize track start positions
+		posProbs = get_posProbs(data)		# positional colocalization probability and observation counts
 
-	posProbs = get_posProbs(data)		# positional colocalization probability and observation counts
+		posProbs = gen_plotOut(posProbs, time_resolution)	# convert to plottable data frame
 
-	posProbs = gen_plotOut(posProbs, time_resolution)	# convert to plottable data frame
+		gen_plotFile(posProbs, filename)	# generate plot file
 
-	gen_plotFile(posProbs, filename)	# generate plot file
+	# Write stage timings
+	outname = f"{filename[:-4]}_posProbPlot"
+	instrument.dataOUT(f"{outname}_timings.json", f"{outname}_profile.prof")
 
 #--- Run main
-main()
+if __name__ == '__main__':
+	main()
 
 # Ankit Roy
 # 2nd February, 2022
 # 10th February, 2022	--> Explicitly states the data types for certain columns of input file
-# 9th February, 2024	--> Now calculates lifetime from time resolution
\ No newline at end of file
+# 9th February, 2024	--> Now calculates lifetime from time resolution
+# 19th October, 2026	--> Can be imported without running; main() takes an optional argument list
+#						--> Tracks and frames are grouped by a single key, so that track starts and frames are found with current pandas versions
+#						--> Arguments are parsed with argparse (--help)
+#						--> Stage timings are written to _posProbPlot_timings.json; added --profile to write cProfile stats
@@ -1,18 +1,20 @@
 #!/Users/roy/anaconda3/bin/python
 
+import argparse
 import numpy as np
 import pandas as pd
-import sys
+from instrumentation import Instrumentation, timed
 
 
 #--- Get input data
+@timed
 def dataIN(filename):
 	data = pd.read_csv(filename)
 	return data
 
 
 #--- Get number of bins
-def get_numBins(data):
+def get_numBins(data, binsize=5):
 	x_bins = int((max(data["POSITION_X"]) // binsize) + 1)				# bins in x-axis
 	y_bins = int((max(data["POSITION_X"]) // binsize) + 1)				# bins in y-axis
 
@@ -20,7 +22,7 @@ def get_numBins(data):
 
 
 #--- Bin coordinates of a single frame
-def bin_SingleFrame(data):
+def bin_SingleFrame(data, x_bins, y_bins, binsize=5):
 
 	# store binned frame data
 	binnedFrame = [[[] for yi in range(y_bins)] for xi in range(x_bins)]
@@ -39,7 +41,8 @@ def bin_SingleFrame(data):
 
 
 #--- Bin spots from all frames
-def SpotBinning(data):
+@timed
+def SpotBinning(data, x_bins, y_bins, binsize=5):
 	start_frame = int(min(data["FRAME"]))				# start frame
 	end_frame = int(max(data["FRAME"]))					# end frame
 
@@ -48,14 +51,14 @@ def SpotBinning(data):
 	# bin spots from every frame
 	for frame in range(start_frame, end_frame + 1):
 		frameData = data[data["FRAME"] == frame]		# single frame data
-		binnedFrame = bin_SingleFrame(frameData)		# binned data from single frame
+		binnedFrame = bin_SingleFrame(frameData, x_bins, y_bins, binsize)		# binned data from single frame
 		binnedData[frame] = binnedFrame					# store single frame binned data
 
 	return binnedData
 
 
 #--- Get neighbouring bins
-def get_Neighbours(xi, yi):
+def get_Neighbours(xi, yi, x_bins, y_bins):
 
 	x_search = [xi+t for t in [1, 0, -1] if (xi+t >= 0) and (xi+t < x_bins)]			# x index of neighbouring bins
 	y_search = [yi+t for t in [1, 0, -1] if (yi+t >= 0) and (yi+t < y_bins)]			# y index of neighbouring bins
@@ -120,7 +123,8 @@ def calc_minPairwiseDistances(cellCoords, neighbourCoords):
 
 
 #--- Get distances for spots in binned data
-def get_Distances(binnedData):
+@timed
+def get_Distances(binnedData, x_bins, y_bins):
 
 	pairwiseDists = {}					# store pairwise distances
 
@@ -134,7 +138,7 @@ def get_Distances(binnedData):
 		for xi in range(len(binnedFrame)):
 			for yi in range(len(binnedFrame[xi])):
 				cellCoords = binnedFrame[xi][yi]			# central cell coordinates
-				neighbours = get_Neighbours(xi, yi)			# search space
+				neighbours = get_Neighbours(xi, yi, x_bins, y_bins)		# search space
 				neighbourCoords = []						# stores all coordinates from search space
 
 				# store all coordinates from search space
@@ -148,6 +152,7 @@ def get_Distances(binnedData):
 
 
 #--- Write data
+@timed
 def dataOUT(filename, distData):
 
 	outname = filename[:-4]
@@ -169,24 +174,52 @@ def dataOUT(filename, distData):
 	distData.to_csv(outname, index=False, float_format="%.3f")
 
 
-#--- Main function
-def main():
-	filename = sys.argv[1]					# filename
+#--- Fetch arguments
+def get_args(argv=None):
+	parser = argparse.ArgumentParser()
+
+	# Spot statistics file
+	parser.add_argument("filename",
+								help = "Spot statistics file (TrackMate All Spots statistics)")
+
+	# Profiling
+	parser.add_argument("--profile",
+								help = "(default = False) Write cProfile stats of the run to <filename>_dist_profile.prof",
+								choices = ['True', 'False'],
+								default = 'False')
+
+	args = parser.parse_args(argv)
 
-	global x_bins, y_bins, binsize
+	return args
+
+#--- Main function
+def main(argv=None):
+	args = get_args(argv)
+	filename = args.filename				# filename
+	instrument = Instrumentation(args.profile == 'True')	# stage timings
 
 	binsize = 5								# binsize in µm
 
-	data = dataIN(filename)					# spot data
-	x_bins, y_bins = get_numBins(data)		# number of bins in x axis and y axis
+	with instrument:
+		data = dataIN(filename)					# spot data
+		x_bins, y_bins = get_numBins(data, binsize)		# number of bins in x axis and y axis
+
+		binnedData = SpotBinning(data, x_bins, y_bins, binsize)		# binned spot data
 
-	binnedData = SpotBinning(data)			# binned spot data
+		pairwiseDists = get_Distances(binnedData, x_bins, y_bins)		# minimum pairwise distances for all spots
 
-	pairwiseDists = get_Distances(binnedData)		# minimum pairwise distances for all spots
+		dataOUT(filename, pairwiseDists)		# write data out
 
-	dataOUT(filename, pairwiseDists)		# write data out
+	# Write stage timings
+	outname = f"{filename[:-4]}_dist"
+	instrument.dataOUT(f"{outname}_timings.json", f"{outname}_profile.prof")
 
-main()
+if __name__ == '__main__':
+	main()
 
 # Ankit Roy
 # 1st December, 2021
+# 19th October, 2026
+#	--> Bin size and bin counts are passed to functions explicitly and the script can be imported without running
+#	--> Arguments are parsed with argparse (--help)
+#	--> Stage timings are written to _dist_timings.json; added --profile to write cProfile stats.
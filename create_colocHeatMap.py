@@ -1,9 +1,11 @@
 #!/Users/roy/anaconda3/bin/python
 
-import sys
+import argparse
 import pandas as pd
+from instrumentation import Instrumentation, timed
 
 #--- Get data
+@timed
 def dataIN(filename):
 	data = pd.read_csv(filename,
 		comment="#",
@@ -18,6 +20,7 @@ def dataIN(filename):
 	return data
 
 #--- Get start and end frame for all tracks
+@timed
 def get_frame_limits(data):
 
 	# group by tracks from different channels
@@ -37,6 +40,7 @@ def get_frame_limits(data):
 	return all_track_starts, all_track_ends
 
 #--- Normalize frame start and end
+@timed
 def normalize_frames(data, all_track_starts, all_track_ends):
 
 	# normalize start position
@@ -48,6 +52,7 @@ def normalize_frames(data, all_track_starts, all_track_ends):
 	return data
 
 #--- Generate plotting data
+@timed
 def gen_plotData(data):
 
 	data["COLOCALIZATION_STATUS"] = "None"
@@ -60,6 +65,7 @@ def gen_plotData(data):
 	return plotdata
 
 #--- Write plot data
+@timed
 def writeOUT(plotdata, filename):
 
 	# output file name
@@ -69,19 +75,50 @@ def writeOUT(plotdata, filename):
 	# write output file
 	plotdata.to_csv(outname, index=False)
 
+#--- Fetch arguments
+def get_args(argv=None):
+	parser = argparse.ArgumentParser()
+
+	# Colocalization subset file
+	parser.add_argument("filename",
+								help = "Colocalized track subset file (_subset.csv) from getStat_TracksColocalized.py")
+
+	# Profiling
+	parser.add_argument("--profile",
+								help = "(default = False) Write cProfile stats of the run to <filename>_heatPlotData_profile.prof",
+								choices = ['True', 'False'],
+								default = 'False')
+
+	args = parser.parse_args(argv)
+
+	return args
+
 #--- Main function
-def main():
-	filename = sys.argv[1]				# input file name
-	data = dataIN(filename)				# colocalization data
-
-	all_track_starts, all_track_ends = get_frame_limits(data)				# store track start and end positions
-	data = normalize_frames(data, all_track_starts, all_track_ends)			# normalize frames to start and end positions
-	plotdata = gen_plotData(data)											# generate plotable data
-	writeOUT(plotdata, filename)											# write plot file
+def main(argv=None):
+	args = get_args(argv)
+	filename = args.filename			# input file name
+	instrument = Instrumentation(args.profile == 'True')	# stage timings
+
+	with instrument:
+		data = dataIN(filename)				# colocalization data
+
+		all_track_starts, all_track_ends = get_frame_limits(data)				# store track start and end positions
+		data = normalize_frames(data, all_track_starts, all_track_ends)			# normalize frames to start and end positions
+		plotdata = gen_plotData(data)											# generate plotable data
+		writeOUT(plotdata, filename)											# write plot file
+
+	# Write stage timings
+	outname = f"{filename[:-4]}_heatPlotData"
+	instrument.dataOUT(f"{outname}_timings.json", f"{outname}_profile.prof")
 	
 
 #--- Run main function
-main()
+if __name__ == '__main__':
+	main()
 
 # Ankit Roy
 # 15th February, 2022
+# 19th October, 2026
+#	--> Can be imported without running; main() takes an optional argument list
+#	--> Arguments are parsed with argparse (--help)
+#	--> Stage timings are written to _heatPlotData_timings.json; added --profile to write cProfile stats.
@@ -5,6 +5,7 @@ import pandas as pd
 import numpy as np
 import sys
 from collections import Counter
+from instrumentation import Instrumentation, timed
 
 __author__ = "Ankit Roy"
 __copyright__ = "Copyright 2021, Bieling Lab, Max Planck Institute of Molecular Physiology"
@@ -13,7 +14,7 @@ __maintainer__ = "Ankit Roy"
 __status__ = "Development"
 
 #--- Fetch arguments
-def get_args():
+def get_args(argv=None):
 	parser = argparse.ArgumentParser()
 
 	# Required arguments group
@@ -71,12 +72,19 @@ def get_args():
 								help = "(default = 0.022 s) Time resolution",
 								default = 0.022,
 								type = float)
+
+	# Profiling
+	parser.add_argument("--profile",
+								help = "(default = False) Write cProfile stats of the run to <colocalization file>_subset_profile.prof",
+								choices = ['True', 'False'],
+								default = 'False')
 	
-	args = parser.parse_args()
+	args = parser.parse_args(argv)
 
 	return args
 
 #--- Get data
+@timed
 def dataIN(filename):
 	data = pd.read_csv(filename,
 		comment="#",
@@ -95,6 +103,7 @@ def modifyField(data, condition, name, value):
 	return data
 
 #--- Get colocalized tracks
+@timed
 def get_ColocalizedTracks(data):
 	data = data.copy()
 	data["COLOCALIZED_TRACK"] = False
@@ -114,12 +123,14 @@ def get_ColocalizedTracks(data):
 	return data
 
 #--- Subset colocalized tracks
+@timed
 def subsetData(data):
 	data = data.copy()
 	data = data[data["COLOCALIZED_TRACK"]]
 	return data
 
 #--- Count the number of colocalized frames
+@timed
 def count_ColocalizedFrames(data):
 	data = data.copy()
 	data["TOTAL_FRAME_COUNT"] = 0
@@ -159,6 +170,7 @@ def filter_channel(data, channel, pseudo_ids):
 	return data
 
 #--- Filter GDI tracks based on un-colocalized frames
+@timed
 def filter_freeFrames(data, count):
 	data = data.copy()
 
@@ -283,6 +295,7 @@ def annotateTracks(data, recruitment_events, extraction_events):
 	return data
 
 #--- Annotate events as recruitment or extraction events
+@timed
 def annotateEvents(data, recruitment_frame_threshold, extraction_frame_threshold):
 	data = data.copy()
 
@@ -308,11 +321,8 @@ def annotateEvents(data, recruitment_frame_threshold, extraction_frame_threshold
 	return data
 
 #--- Calculate landing rate
-def calcLandingRate(data):
-	fov = args.field				# field of view
-	image_size = args.image_size	# image size in pixels
-	pixel_size = args.pixel_size	# pixel size in µm
-	time_resolution = args.time_resolution	# time resolution in s
+# fov: field of view, image_size: image size in pixels, pixel_size: pixel size in µm, time_resolution: time resolution in s
+def calcLandingRate(data, fov=1.0, image_size=512, pixel_size=0.178, time_resolution=0.022):
 
 	# Total number of frames
 	total_frames = max(set(data["FRAME"]))
@@ -328,7 +338,8 @@ def calcLandingRate(data):
 	return (gtpase_landing_rate, gdi_landing_rate)
 
 #--- All colocalization statistics:
-def getStat(all_data, subset_data, input_file):
+@timed
+def getStat(all_data, subset_data, input_file, fov=1.0, image_size=512, pixel_size=0.178, time_resolution=0.022):
 	# Count all GTPase tracks
 	total_gtpase_tracks = len(set(all_data.loc[all_data["CHANNEL"] == "GTPase", "PSEUDO_TRACK_ID"]))
 	# Count all GDI tracks
@@ -367,7 +378,7 @@ def getStat(all_data, subset_data, input_file):
 	percentage_intersection_gdi = intersection_gdi/total_gdi_tracks * 100
 
 	# Calculate landing rate
-	gtpase_landing_rate, gdi_landing_rate = calcLandingRate(all_data)
+	gtpase_landing_rate, gdi_landing_rate = calcLandingRate(all_data, fov, image_size, pixel_size, time_resolution)
 
 	# Display stats
 	header = "# {},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format("File_Name",
@@ -416,13 +427,17 @@ def getStat(all_data, subset_data, input_file):
 	return (header, stat_line)
 
 #--- Write output files
-def dataOUT(data_frame, outname, header, stat_line):
+@timed
+def dataOUT(data_frame, outname, header, stat_line, args):
 	outname = "{}_subset.csv".format(outname.split('.csv')[0])
 	
 	# write header and statistics
 	with open(outname, 'w') as fh:
 		fh.write("# {:=^40}\n".format(" Meta-data lines "))
 		for arg in vars(args):
+			# profiling does not change results
+			if arg == "profile":
+				continue
 			fh.write("# {}: {}\n".format(arg, getattr(args, arg)))
 		fh.write("# {:=^40}\n".format(" Summary lines "))
 		fh.write(header)
@@ -432,13 +447,9 @@ def dataOUT(data_frame, outname, header, stat_line):
 	# write CSV file for colocalization events
 	data_frame.to_csv(outname, index=False, float_format="%.3f", mode = 'a')
 
-#--- Main function
-def main():
-	global args
-	pd.set_option('display.max_columns', None)
-
-	args = get_args()								# input arguments
-	coloc_data = dataIN(args.colocalization_file)	# Colocalization data
+#--- Annotated subset of colocalized tracks and their statistics
+def annotate(coloc_data, input_file, limit_free_gdi=True, max_gdi_free_frames=3, recruitment_frames=3, extraction_frames=3,
+				fov=1.0, image_size=512, pixel_size=0.178, time_resolution=0.022):
 
 	# Get colocalized tracks
 	coloc_data = get_ColocalizedTracks(coloc_data)
@@ -460,18 +471,45 @@ def main():
 	sub_coloc_data = count_ColocalizedFrames(sub_coloc_data)
 
 	# Filter GDI spots which stay un-colocalized for more than a threshold number of frames	
-	if args.limit_free_gdi == 'True':
+	if limit_free_gdi:
 		# Filter GDI tracks based on the number of uncolocalized frames
-		sub_coloc_data = filter_freeFrames(sub_coloc_data, args.max_gdi_free_frames)
+		sub_coloc_data = filter_freeFrames(sub_coloc_data, max_gdi_free_frames)
 
 	# Annotate recruitment events
-	sub_coloc_data = annotateEvents(sub_coloc_data, args.recruitment_frames, args.extraction_frames)
+	sub_coloc_data = annotateEvents(sub_coloc_data, recruitment_frames, extraction_frames)
 
 	# Show colocalization statistics
-	header, stat_line = getStat(coloc_data, sub_coloc_data, args.colocalization_file)
+	header, stat_line = getStat(coloc_data, sub_coloc_data, input_file, fov, image_size, pixel_size, time_resolution)
+
+	return sub_coloc_data, header, stat_line
+
+#--- Main function
+def main(argv=None):
+	pd.set_option('display.max_columns', None)
+
+	args = get_args(argv)								# input arguments
+	instrument = Instrumentation(args.profile == 'True')			# stage timings
+
+	with instrument:
+		coloc_data = dataIN(args.colocalization_file)	# Colocalization data
+
+		# Annotated subset and statistics
+		sub_coloc_data, header, stat_line = annotate(coloc_data, args.colocalization_file,
+									limit_free_gdi = args.limit_free_gdi == 'True',
+									max_gdi_free_frames = args.max_gdi_free_frames,
+									recruitment_frames = args.recruitment_frames,
+									extraction_frames = args.extraction_frames,
+									fov = args.field,
+									image_size = args.image_size,
+									pixel_size = args.pixel_size,
+									time_resolution = args.time_resolution)
+
+		# Wtite output file
+		dataOUT(sub_coloc_data, args.colocalization_file, header, stat_line, args)
 
-	# Wtite output file
-	dataOUT(sub_coloc_data, args.colocalization_file, header, stat_line)
+	# Write stage timings
+	outname = "{}_subset".format(args.colocalization_file.split('.csv')[0])
+	instrument.dataOUT("{}_timings.json".format(outname), "{}_profile.prof".format(outname))
 
 #--- Run main function
 if __name__ == '__main__':
@@ -508,4 +546,8 @@ if __name__ == '__main__':
 #	--> Annotates recruitment spots after annotating extraction spots to prevent extraction events from overwriting recruitments
 # 29th February, 2024
 #	--> BUG: Forgot to square the image dimensions to calculated landing rate in /frame/µm^2. This has now been fixed.
-#	--> Updated calcLandingRate function to calculate landing rate in units of /s/µm^2 instead of /frame/µm^2.
\ No newline at end of file
+#	--> Updated calcLandingRate function to calculate landing rate in units of /s/µm^2 instead of /frame/µm^2.
+# 19th October, 2026
+#	--> Records wall time, CPU time, peak memory and row counts of every stage (<colocalization file>_subset_timings.json).
+#	--> Added --profile to write cProfile stats.
+#	--> Analysis steps take their parameters explicitly; annotate() runs the analysis on loaded colocalization data.
@@ -0,0 +1,97 @@
+#!/Users/roy/mambaforge/bin/python
+
+# Single command line interface and importable API for the analysis scripts.
+# Every script is a subcommand; its module is imported only when the subcommand runs or is used from Python,
+# so listing commands and running light analyses does not load image processing or plotting libraries.
+#   python gtpase.py colocalize -gp GTPase.csv -gd GDI.csv --first_frame 0 --last_frame 1000
+#   python gtpase.py segment Lipid.tif --processes 4
+# From Python, subcommands are modules (hyphens become underscores) and run() calls a script in-process:
+#   import gtpase
+#   coloc = gtpase.colocalize.colocalize(gtpase_data, gdi_data, 0, 1000, processes=4)
+#   gtpase.run('pattern', [segmented_file, lipid_file, total_file, active_file, 'background_dict.p'])
+
+import os
+import sys
+import argparse
+import importlib
+
+# Script directory, so that scripts are found when this module is imported from elsewhere
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Subcommands: script module and description
+COMMANDS = {
+    'simulate':             ('simulate_DualChannelSpots', 'Simulate dual channel spot statistics files with ground truth'),
+    'colocalize':           ('SpotColocalization', 'Colocalized spots of GTPase and GDI tracks'),
+    'colocalize-frame':     ('SpotColocalization_SingleFrame', 'Spot colocalization counts, optionally on a sample of frames'),
+    'annotate':             ('getStat_TracksColocalized', 'Colocalized tracks annotated with recruitment and extraction events'),
+    'probability-classes':  ('calc_ColocalizationProbability_Classes', 'Recruitment, extraction and internal colocalization probabilities'),
+    'probability-position': ('calc_ColocalizationProbability_positionSpecific', 'Colocalization probability along tracks'),
+    'heatmap':              ('create_colocHeatMap', 'Colocalization heat map data'),
+    'pipeline':             ('ColocalizationPipeline', 'Cached colocalization pipeline for a parameter table'),
+    'distance':             ('calc_InterParticle_Distance', 'Nearest neighbour distances between spots'),
+    'msd':                  ('MSD-distributions', 'Mean squared displacement, step size and jump distance analysis'),
+    'background':           ('pickle_background', 'Background data of all channels'),
+    'segment':              ('autoSegmentation_LipidPatch', 'Lipid patch segmentation'),
+    'segment-tiles':        ('autoSegmentation_dice-N-splice_LipidPatch', 'Lipid patch segmentation in tiles'),
+    'pattern':              ('GTPase_patterning_analysis', 'GTPase patterning in segmented lipid patches'),
+    'batch-pattern':        ('BatchProcess_PatternAnalysis', 'Segmentation and pattern analysis of all stacks in a directory'),
+    'benchmark':            ('benchmark_Pipeline', 'Benchmarks and golden output checks of all stages'),
+}
+
+# Module of a subcommand, imported on first use
+def load(command):
+    if SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, SCRIPT_DIR)
+
+    return importlib.import_module(COMMANDS[command][0])
+
+# Run a script in this process with a list of arguments
+# sys.argv is set as if the script was run directly, for scripts that report their name and arguments
+def run(command, argv):
+    module = load(command)
+    saved = sys.argv
+    sys.argv = [module.__file__] + list(argv)
+    try:
+        return module.main(list(argv))
+    finally:
+        sys.argv = saved
+
+# Subcommand modules as attributes, e.g. gtpase.colocalize or gtpase.probability_classes
+def __getattr__(name):
+    command = name.replace('_', '-')
+    if command not in COMMANDS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    return load(command)
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description = "Analysis of GTPase and GDI single molecule data and GTPase patterning",
+        epilog = "Subcommands:\n" + "\n".join(f"  {command:<22s}{description}" for command, (_, description) in COMMANDS.items())
+                 + "\n\nOptions of a subcommand are listed with: gtpase.py <subcommand> --help",
+        formatter_class = argparse.RawDescriptionHelpFormatter)
+
+    # Subcommand
+    parser.add_argument("command",
+                        help = "Subcommand",
+                        choices = list(COMMANDS),
+                        metavar = "subcommand")
+
+    # Arguments of the subcommand
+    parser.add_argument("arguments",
+                        help = "Arguments of the subcommand",
+                        nargs = argparse.REMAINDER)
+
+    args = parser.parse_args(argv)
+
+    return args
+
+def main(argv=None):
+    args = get_args(argv)
+    run(args.command, args.arguments)
+
+if __name__ == '__main__':
+    main()
+
+# Ankit Roy
+# 19th October, 2026
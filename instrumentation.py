@@ -0,0 +1,120 @@
+# Stage timings, memory use and profiling of analysis runs.
+# Stages are timed with Instrumentation.stage or with functions decorated with timed, while an Instrumentation is active.
+# Wall time, CPU time (including finished child processes, e.g. multiprocessing pools), peak resident memory
+# and the number of rows returned are recorded per stage name, summed over calls.
+# Decorated functions run untimed when no Instrumentation is active, e.g. when they are imported by other scripts.
+# Timings are written to separate files (dataOUT), so that analysis outputs of repeated runs are identical.
+
+import os
+import sys
+import json
+import time
+import cProfile
+import resource
+import functools
+from contextlib import contextmanager
+
+# Instrumentations of the running analyses, innermost last
+active = []
+
+# ru_maxrss in MB; it is in kB on Linux and in bytes on macOS
+def maxrssMB(maxrss):
+    scale = 2**20 if sys.platform == 'darwin' else 2**10
+    return maxrss / scale
+
+# Peak resident memory in MB of this process, or of its largest finished child process
+def peakRSS(who=resource.RUSAGE_SELF):
+    return maxrssMB(resource.getrusage(who).ru_maxrss)
+
+# CPU time of this process and its finished child processes
+def cpuTime():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+# Number of rows in a result: length of tables (pandas) and lists, summed over tuples of them
+# Images and other arrays are not counted
+def countRows(result):
+    if isinstance(result, tuple):
+        counts = [countRows(item) for item in result]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+    if hasattr(result, 'index') and hasattr(result, 'shape'):
+        return len(result)
+    if isinstance(result, list):
+        return len(result)
+
+    return None
+
+class Instrumentation:
+
+    def __init__(self, profile=False):
+        self.stages = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self.start = time.perf_counter()
+        self.start_cpu = cpuTime()
+
+    def __enter__(self):
+        active.append(self)
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.disable()
+        active.remove(self)
+
+    # Time a block of code; rows can be set on the returned record
+    @contextmanager
+    def stage(self, name):
+        record = {'rows': None}
+        start, start_cpu = time.perf_counter(), cpuTime()
+        try:
+            yield record
+        finally:
+            self.add(name, time.perf_counter() - start, cpuTime() - start_cpu, record['rows'])
+
+    def add(self, name, wall_time, cpu_time, rows=None):
+        stage = self.stages.setdefault(name, {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'rows': None})
+        stage['calls'] += 1
+        stage['wall_time'] += wall_time
+        stage['cpu_time'] += cpu_time
+        stage['peak_rss_mb'] = max(peakRSS(), peakRSS(resource.RUSAGE_CHILDREN))
+        if rows is not None:
+            stage['rows'] = (stage['rows'] or 0) + rows
+
+    def summary(self):
+        return {
+            'script': os.path.basename(sys.argv[0]),
+            'argv': sys.argv[1:],
+            'wall_time': time.perf_counter() - self.start,
+            'cpu_time': cpuTime() - self.start_cpu,
+            'peak_rss_mb': max(peakRSS(), peakRSS(resource.RUSAGE_CHILDREN)),
+            'stages': self.stages,
+        }
+
+    # Timings as JSON and, when profiling, cProfile stats (readable with pstats or snakeviz)
+    def dataOUT(self, json_name, profile_name=None):
+        with open(json_name, 'w') as fh:
+            json.dump(self.summary(), fh, indent=4)
+
+        if self.profiler is not None and profile_name is not None:
+            self.profiler.dump_stats(profile_name)
+
+# Time every call of a function as a stage named after it
+def timed(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not active:
+            return func(*args, **kwargs)
+
+        with active[-1].stage(func.__name__) as record:
+            result = func(*args, **kwargs)
+            record['rows'] = countRows(result)
+
+        return result
+
+    return wrapper
+
+# Ankit Roy
+# 19th October, 2026
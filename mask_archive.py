@@ -0,0 +1,108 @@
+# Compact storage of segmentation mask stacks.
+# Every frame is bit-packed and stored as its own deflate-compressed member of an .npz (zip) archive,
+# so single frames can be read without decompressing the rest of the stack.
+
+import zipfile
+import numpy as np
+from tiff_stack import TiffStack, MaskWriter
+
+# Member name of a frame
+def frameKey(t):
+    return f'frame_{t:06d}'
+
+# Mask archive written frame by frame
+class MaskArchiveWriter:
+
+    def __init__(self, filename, compresslevel=6):
+        self.filename = filename
+        self.zip = zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        self.frame_shape = None
+        self.frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def writeArray(self, key, array):
+        with self.zip.open(f'{key}.npy', 'w', force_zip64=True) as fh:
+            np.lib.format.write_array(fh, np.asarray(array), allow_pickle=False)
+
+    def write(self, frame):
+        frame = np.asarray(frame, dtype=bool)
+
+        # frame shape is stored with the first frame
+        if self.frame_shape is None:
+            self.frame_shape = frame.shape
+            self.writeArray('frame_shape', np.array(frame.shape, dtype=np.int64))
+        elif frame.shape != self.frame_shape:
+            raise ValueError(f"frame shape {frame.shape} does not match {self.frame_shape}")
+
+        self.writeArray(frameKey(self.frames), np.packbits(frame, axis=None))
+        self.frames += 1
+
+    def close(self):
+        self.zip.close()
+
+# Lazy mask archive
+# Indexing with a frame number returns a boolean frame
+class MaskArchive:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.npz = np.load(filename)
+        frame_shape = tuple(int(n) for n in self.npz['frame_shape'])
+        nframes = sum(key.startswith('frame_') and key != 'frame_shape' for key in self.npz.files)
+        self.shape = (nframes,) + frame_shape
+        self.dtype = np.dtype(bool)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.npz.close()
+
+    def __getitem__(self, t):
+        if isinstance(t, slice):
+            return np.array([self[i] for i in range(*t.indices(len(self)))])
+
+        if t < 0:
+            t += len(self)
+        if not 0 <= t < len(self):
+            raise IndexError(f"frame {t} out of range for {len(self)} frames")
+
+        packed = self.npz[frameKey(t)]
+        count = int(np.prod(self.shape[1:]))
+
+        return np.unpackbits(packed, count=count).view(bool).reshape(self.shape[1:])
+
+    def raw(self, t):
+        return self[t]
+
+    def __iter__(self):
+        for t in range(len(self)):
+            yield self[t]
+
+# Open a mask stack stored as a TIFF or a mask archive
+def openMask(filename):
+    if filename.endswith('.npz'):
+        return MaskArchive(filename)
+
+    return TiffStack(filename, mask=True)
+
+# Mask writer for TIFF ('tif') or mask archive ('npz') output
+def maskWriter(filename, shape=None, mask_format='tif', bitpacked=False):
+    if mask_format == 'npz':
+        return MaskArchiveWriter(filename)
+
+    return MaskWriter(filename, shape, bitpacked)
+
+# Ankit Roy
+# 19th October, 2026
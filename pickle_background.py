@@ -1,49 +1,129 @@
 #!/Users/roy/mambaforge/bin/python
 
 import os
-import sys
+import argparse
 import numpy as np
 import pickle
 import glob
-from skimage import img_as_float, io
+from tiff_stack import TiffStack
+from instrumentation import Instrumentation, timed
 
 # Read image file
+# Frames are read lazily as float32
 def readImg(filename):
-    img = img_as_float(io.imread(filename))
+    img = TiffStack(filename)
     return img
 
-# Calculate mean intensity for background in a given channel
-def mean_channelBackground(background_dir, channel=""):
+# Streaming per-pixel background statistics of a given channel
+# Frames are read in blocks and merged into running per-pixel means and sums of squared deviations
+@timed
+def accumulate_channelBackground(background_dir, channel="", block_size=64):
 
     path_regex = os.path.join(background_dir, f"*{channel}.tif")
-    imgs = np.array([readImg(file) for file in glob.glob(path_regex)])
 
-    return imgs.mean()
+    n = 0               # number of frames
+    mean = None         # per-pixel mean
+    m2 = None           # per-pixel sum of squared deviations
+
+    for file in sorted(glob.glob(path_regex)):
+        with readImg(file) as img:
+            for start in range(0, len(img), block_size):
+                block = img[start:start + block_size]
+
+                # statistics of the block
+                n_block = len(block)
+                mean_block = block.mean(axis=0, dtype=np.float64)
+                m2_block = ((block - mean_block)**2).sum(axis=0)
+
+                if mean is None:
+                    n, mean, m2 = n_block, mean_block, m2_block
+                    continue
+                if mean_block.shape != mean.shape:
+                    raise ValueError(f"frame shape {mean_block.shape} of {file} does not match background frame shape {mean.shape}")
+
+                # merge with the running statistics
+                delta = mean_block - mean
+                total = n + n_block
+                mean = mean + delta * n_block / total
+                m2 = m2 + m2_block + delta**2 * n * n_block / total
+                n = total
+
+    if mean is None:
+        raise ValueError(f"no background images found for channel {channel} in {background_dir}")
+
+    return n, mean, m2 / max(n - 1, 1)
 
 # Compute backgrounds for all channels
+# Returns the mean intensity per channel and per-pixel background models (frames, mean and variance images)
 def compute_channelBackground(background_dir, channels):
 
-    ch_backgrounds = {ch: mean_channelBackground(background_dir, ch) for ch in channels}
-    return ch_backgrounds
+    ch_models = {ch: accumulate_channelBackground(background_dir, ch) for ch in channels}
+    ch_backgrounds = {ch: ch_models[ch][1].mean() for ch in channels}
+
+    return ch_backgrounds, ch_models
 
 # Pickle output file
+@timed
 def dataOUT(backgrounds, filename="background_dict.p"):
     with open(filename, "wb") as fh:
         pickle.dump(backgrounds, fh)
 
+# Per-pixel background models
+# Stored as <channel>_frames, <channel>_scalar, <channel>_mean and <channel>_var arrays
+@timed
+def dataOUT_model(backgrounds, models, filename="background_model.npz"):
+    arrays = {}
+    for ch, (frames, mean, var) in models.items():
+        arrays[f"{ch}_frames"] = frames
+        arrays[f"{ch}_scalar"] = backgrounds[ch]
+        arrays[f"{ch}_mean"] = mean.astype(np.float32)
+        arrays[f"{ch}_var"] = var.astype(np.float32)
+
+    np.savez_compressed(filename, **arrays)
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser()
+
+    # Background images
+    parser.add_argument("background_dir",
+                        help = "Directory with background image stacks of the Lipid, Total and Active channels")
+
+    # Profiling
+    parser.add_argument("--profile",
+                        help = "(default = False) Write cProfile stats of the run (background_profile.prof).",
+                        choices = ['True', 'False'],
+                        default = 'False')
+
+    args = parser.parse_args(argv)
+
+    return args
+
 # Main function
-def main():
-    background_dir = sys.argv[1]                # path to images for background calculation
+def main(argv=None):
+    args = get_args(argv)
     channels = ["Lipid", "Total", "Active"]     # channel names
+    instrument = Instrumentation(args.profile == 'True')   # stage timings
 
-    # store background values for all channels
-    ch_backgrounds = compute_channelBackground(background_dir, channels)
-    
-    # pickle dictionary with background values
-    dataOUT(ch_backgrounds)
+    with instrument:
+        # store background values and per-pixel background models for all channels
+        ch_backgrounds, ch_models = compute_channelBackground(args.background_dir, channels)
+
+        # pickle dictionary with background values
+        dataOUT(ch_backgrounds)
+        # save per-pixel background models
+        dataOUT_model(ch_backgrounds, ch_models)
+
+    # write stage timings
+    instrument.dataOUT('background_timings.json', 'background_profile.prof')
     
 # Run main
-main()
+if __name__ == '__main__':
+    main()
 
 # Ankit Roy
-# 19th June, 2023
\ No newline at end of file
+# 19th June, 2023
+# 19th October, 2026    >>      Background frames are accumulated lazily in blocks instead of being loaded at once.
+#                       >>      Per-pixel background mean and variance images are saved to background_model.npz.
+#                       >>      Can be imported without running; main() takes an optional argument list.
+#                       >>      Arguments are parsed with argparse (--help).
+#                       >>      Stage timings are written to background_timings.json; added --profile to write cProfile stats.
@@ -0,0 +1,351 @@
+#!/Users/roy/anaconda3/bin/python3
+
+"""
+Simulates dual channel single molecule data in the format of TrackMate spot statistics files (All Spots statistics).
+
+Writes one spot statistics file each for the GTPase and the GDI channel, which can be used as input for
+SpotColocalization.py and MSD-distributions.py, and a ground truth file of all truly colocalized spots.
+Model:
+--> Molecules land on the field of view (image size x pixel size) as a Poisson process with a constant rate per frame
+--> Landed molecules diffuse freely (2D Brownian motion, reflected at the edges) for an exponentially distributed dwell time
+--> A fraction of GTPase molecules is recruited by a GDI: both land together and stay bound for an exponentially distributed time
+--> A fraction of GTPase molecules is extracted by a GDI: the GDI binds before the GTPase track ends and both leave together
+--> Bound GDI spots follow their GTPase with independent localization errors
+--> Every frame contains additional untracked spots (TRACK_ID None)
+Generation is vectorized over all spots, so files with 10^7 spots are simulated in seconds.
+Ground truth file fields:
+--> FRAME, GTPASE_LABEL, GTPASE_TRACK_ID, GDI_LABEL, GDI_TRACK_ID: colocalized spot pair
+--> COLOCALIZATION_ID: <GTPase TRACK_ID>-<GDI TRACK_ID>, as assigned by SpotColocalization.py
+--> EVENT: Recruitment or Extraction
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+
+__author__ = "Ankit Roy"
+__copyright__ = "Copyright 2026, Bieling Lab, Max Planck Institute of Molecular Physiology"
+__license__ = "GPL"
+__maintainer__ = "Ankit Roy"
+__status__ = "Development"
+
+#--- Fetch arguments
+def get_args(argv=None):
+	parser = argparse.ArgumentParser()
+
+	# Number of frames
+	parser.add_argument("-f", "--frames",
+								help = "(default = 1000) Number of frames",
+								default = 1000,
+								type = int)
+
+	# Pixel size
+	parser.add_argument("-ps", "--pixel_size",
+								help = "(default = 0.178 µm) Pixel size",
+								default = 0.178,
+								type = float)
+
+	# Image size
+	parser.add_argument("-is", "--image_size",
+								help = "(default = 512 px) Image size",
+								default = 512,
+								type = int)
+
+	# Time resolution
+	parser.add_argument("-tr", "--time_resolution",
+								help = "(default = 0.022 s) Time resolution",
+								default = 0.022,
+								type = float)
+
+	# GTPase landing rate
+	parser.add_argument("--gtpase_rate",
+								help = "(default = 2) Number of GTPase molecules landing per frame",
+								default = 2,
+								type = float)
+
+	# GTPase dwell time
+	parser.add_argument("--gtpase_dwell",
+								help = "(default = 20 frames) Mean dwell time of GTPase molecules",
+								default = 20,
+								type = float)
+
+	# GTPase diffusion coefficient
+	parser.add_argument("--gtpase_diffusion",
+								help = "(default = 0.5 µm^2/s) Diffusion coefficient of GTPase molecules",
+								default = 0.5,
+								type = float)
+
+	# GDI landing rate
+	parser.add_argument("--gdi_rate",
+								help = "(default = 2) Number of free GDI molecules landing per frame",
+								default = 2,
+								type = float)
+
+	# GDI dwell time
+	parser.add_argument("--gdi_dwell",
+								help = "(default = 5 frames) Mean dwell time of free GDI molecules",
+								default = 5,
+								type = float)
+
+	# GDI diffusion coefficient
+	parser.add_argument("--gdi_diffusion",
+								help = "(default = 1.0 µm^2/s) Diffusion coefficient of free GDI molecules",
+								default = 1.0,
+								type = float)
+
+	# Recruited fraction
+	parser.add_argument("--recruitment_fraction",
+								help = "(default = 0.2) Fraction of GTPase molecules recruited by a GDI",
+								default = 0.2,
+								type = float)
+
+	# Extracted fraction
+	parser.add_argument("--extraction_fraction",
+								help = "(default = 0.1) Fraction of GTPase molecules extracted by a GDI",
+								default = 0.1,
+								type = float)
+
+	# Bound time
+	parser.add_argument("--bound_dwell",
+								help = "(default = 4 frames) Mean time a GDI stays bound to a GTPase",
+								default = 4,
+								type = float)
+
+	# Untracked spots
+	parser.add_argument("--untracked_rate",
+								help = "(default = 1) Number of untracked spots (TRACK_ID None) per frame in each channel",
+								default = 1,
+								type = float)
+
+	# Localization error
+	parser.add_argument("--localization_error",
+								help = "(default = 0.03 µm) Standard deviation of spot localization errors",
+								default = 0.03,
+								type = float)
+
+	# Random seed
+	parser.add_argument("--seed",
+								help = "(default = 0) Random seed",
+								default = 0,
+								type = int)
+
+	# Output file prefix
+	parser.add_argument("--outfile",
+								help = "(default = Synthetic) Output file prefix; writes <prefix>_GTPase.csv, <prefix>_GDI.csv and <prefix>_ground-truth.csv",
+								default = "Synthetic")
+
+	# Number of processes
+	parser.add_argument("--processes",
+								help = "(default = all cores) Number of processes formatting output files",
+								default = mp.cpu_count(),
+								type = int)
+
+	args = parser.parse_args(argv)
+
+	return args
+
+#--- Exponential dwell times in whole frames (at least 1)
+def draw_lengths(rng, n, mean):
+	return np.maximum(1, np.ceil(rng.exponential(mean, n))).astype(np.int64)
+
+#--- First spot of every track, and track and position within the track of every spot
+def expand_tracks(lengths):
+	offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+	track = np.repeat(np.arange(len(lengths)), lengths)
+	step = np.arange(track.size) - offsets[track]
+	return offsets, track, step
+
+#--- Reflect coordinates at the edges of the field of view
+def reflect(x, size):
+	x = np.mod(x, 2 * size)
+	return np.where(x > size, 2 * size - x, x)
+
+#--- Freely diffusing tracks
+# Landing frames are uniform for a Poisson number of landings; tracks are cut at the last frame
+def simulate_tracks(rng, rate, dwell, diffusion, fov, frames, time_resolution=0.022):
+	n = rng.poisson(rate * frames)
+	starts = rng.integers(0, frames, n)
+	lengths = np.minimum(draw_lengths(rng, n, dwell), frames - starts)
+
+	offsets, track, step = expand_tracks(lengths)
+
+	# random walks as cumulative sums of displacements, restarted at every track start
+	sigma = np.sqrt(2 * diffusion * time_resolution)
+	displacements = rng.normal(0, sigma, (track.size, 2))
+	displacements[offsets] = 0
+	walks = np.cumsum(displacements, axis=0)
+	walks -= walks[offsets][track]
+	positions = reflect(rng.uniform(0, fov, (n, 2))[track] + walks, fov)
+
+	return {"start" : starts, "length" : lengths, "offset" : offsets, "frame" : starts[track] + step, "position" : positions}
+
+#--- GDI tracks bound to a fraction of GTPase tracks
+# Recruiting GDIs land with the GTPase, extracting GDIs bind before the GTPase track ends and leave with it
+def bind_tracks(rng, gtpase, fraction, event, bound_dwell=4):
+	selected = np.flatnonzero(rng.random(len(gtpase["start"])) < fraction)
+	gtpase_lengths = gtpase["length"][selected]
+	lengths = np.minimum(draw_lengths(rng, len(selected), bound_dwell), gtpase_lengths)
+	shift = np.zeros_like(lengths) if event == "Recruitment" else gtpase_lengths - lengths
+
+	offsets, track, step = expand_tracks(lengths)
+
+	# GTPase spot followed by every bound GDI spot
+	partner_spots = gtpase["offset"][selected][track] + shift[track] + step
+
+	return {"start" : gtpase["start"][selected] + shift, "length" : lengths, "offset" : offsets,
+			"frame" : gtpase["frame"][partner_spots], "position" : gtpase["position"][partner_spots],
+			"partner_spot" : partner_spots, "partner_track" : selected[track], "event" : event}
+
+#--- Untracked spots, uniformly distributed over frames and field of view
+def untracked_spots(rng, fov, rate, frames):
+	n = rng.poisson(rate * frames)
+	return {"frame" : rng.integers(0, frames, n), "position" : rng.uniform(0, fov, (n, 2))}
+
+#--- Spot statistics table of one channel
+# Track groups are numbered consecutively; spots are sorted by frame and numbered in that order
+# Returns the table and the row of every simulated spot
+def spot_table(rng, groups, untracked, fov, localization_error=0.03, time_resolution=0.022):
+	frames = np.concatenate([group["frame"] for group in groups] + [untracked["frame"]])
+	positions = np.concatenate([group["position"] for group in groups] + [untracked["position"]])
+
+	track_ids = []
+	first_id = 0
+	for group in groups:
+		track_ids.append(first_id + np.repeat(np.arange(len(group["length"])), group["length"]))
+		first_id += len(group["length"])
+	track_ids = np.concatenate(track_ids + [np.full(len(untracked["frame"]), -1)])
+
+	# localization errors, independent for every spot
+	positions = reflect(positions + rng.normal(0, localization_error, positions.shape), fov)
+
+	order = np.argsort(frames, kind="stable")
+	rows = np.empty_like(order)
+	rows[order] = np.arange(len(order))
+
+	track_ids = track_ids[order]
+	track_labels = pd.Series(track_ids).astype(str).where(track_ids >= 0, "None")
+
+	data = pd.DataFrame({
+		"Label" : "ID" + pd.Series(np.arange(len(order))).astype(str),
+		"ID" : np.arange(len(order)),
+		"TRACK_ID" : track_labels,
+		"QUALITY" : rng.gamma(4, 10, len(order)),
+		"POSITION_X" : positions[order, 0],
+		"POSITION_Y" : positions[order, 1],
+		"POSITION_Z" : 0.0,
+		"POSITION_T" : frames[order] * time_resolution,
+		"FRAME" : frames[order],
+		"RADIUS" : 0.25,
+		"VISIBILITY" : 1,
+		})
+
+	return data, rows
+
+#--- Ground truth of truly colocalized spot pairs
+def ground_truth(gtpase_data, gtpase_rows, gdi_data, gdi_rows, bound_groups, first_spot, first_track):
+	truth = []
+	for group in bound_groups:
+		gtpase_index = gtpase_rows[group["partner_spot"]]
+		gdi_index = gdi_rows[first_spot + np.arange(len(group["frame"]))]
+		gtpase_tracks = group["partner_track"].astype(str)
+		gdi_tracks = (first_track + np.repeat(np.arange(len(group["length"])), group["length"])).astype(str)
+
+		truth.append(pd.DataFrame({
+			"FRAME" : group["frame"],
+			"GTPASE_LABEL" : gtpase_data["Label"].to_numpy()[gtpase_index],
+			"GTPASE_TRACK_ID" : gtpase_tracks,
+			"GDI_LABEL" : gdi_data["Label"].to_numpy()[gdi_index],
+			"GDI_TRACK_ID" : gdi_tracks,
+			"COLOCALIZATION_ID" : np.char.add(np.char.add(gtpase_tracks, "-"), gdi_tracks),
+			"EVENT" : group["event"],
+			}))
+
+		first_spot += len(group["frame"])
+		first_track += len(group["length"])
+
+	return pd.concat(truth).sort_values(["FRAME", "GTPASE_TRACK_ID"], kind="stable")
+
+#--- CSV lines of a block of spots
+def format_spots(data_frame):
+	return data_frame.to_csv(index=False, header=False, float_format="%.4f")
+
+#--- Write spot statistics file
+# Formatting dominates writing large files, so blocks of spots are formatted in parallel and written in order
+def dataOUT(data_frame, outname, processes=1, block_size=2**18):
+	blocks = (data_frame.iloc[start:start + block_size] for start in range(0, len(data_frame), block_size))
+
+	with open(outname, "w") as fh:
+		fh.write(",".join(data_frame.columns) + "\n")
+
+		if processes > 1:
+			with mp.Pool(processes) as pool:
+				fh.writelines(pool.imap(format_spots, blocks))
+		else:
+			fh.writelines(map(format_spots, blocks))
+
+#--- Write ground truth file with parameters as meta data
+def dataOUT_truth(data_frame, outname, args):
+	with open(outname, "w") as fh:
+		fh.write("# {:=^40}\n".format(" Meta-data lines "))
+		for arg in vars(args):
+			# number of processes does not change results
+			if arg == "processes":
+				continue
+			fh.write("# {}: {}\n".format(arg, getattr(args, arg)))
+		fh.write("# {:=^40}\n".format(" Ground truth lines "))
+
+	data_frame.to_csv(outname, index=False, mode="a")
+
+#--- Spot statistics tables of both channels and ground truth of colocalized spot pairs
+def simulate(frames=1000, pixel_size=0.178, image_size=512, time_resolution=0.022,
+				gtpase_rate=2, gtpase_dwell=20, gtpase_diffusion=0.5, gdi_rate=2, gdi_dwell=5, gdi_diffusion=1.0,
+				recruitment_fraction=0.2, extraction_fraction=0.1, bound_dwell=4, untracked_rate=1, localization_error=0.03, seed=0):
+	rng = np.random.default_rng(seed)		# random number generator
+	fov = image_size * pixel_size			# field of view in µm
+
+	# freely diffusing molecules
+	gtpase = simulate_tracks(rng, gtpase_rate, gtpase_dwell, gtpase_diffusion, fov, frames, time_resolution)
+	gdi = simulate_tracks(rng, gdi_rate, gdi_dwell, gdi_diffusion, fov, frames, time_resolution)
+
+	# GDIs bound to GTPases
+	recruitments = bind_tracks(rng, gtpase, recruitment_fraction, "Recruitment", bound_dwell)
+	extractions = bind_tracks(rng, gtpase, extraction_fraction, "Extraction", bound_dwell)
+
+	# progress status
+	print("# Tracks simulated")
+
+	# spot statistics tables
+	gtpase_data, gtpase_rows = spot_table(rng, [gtpase], untracked_spots(rng, fov, untracked_rate, frames), fov, localization_error, time_resolution)
+	gdi_data, gdi_rows = spot_table(rng, [gdi, recruitments, extractions], untracked_spots(rng, fov, untracked_rate, frames), fov, localization_error, time_resolution)
+
+	# bound GDI spots and tracks follow the free GDI spots and tracks
+	truth = ground_truth(gtpase_data, gtpase_rows, gdi_data, gdi_rows, [recruitments, extractions], len(gdi["frame"]), len(gdi["length"]))
+
+	return gtpase_data, gdi_data, truth
+
+#--- Main function
+def main(argv=None):
+	args = get_args(argv)						# input arguments
+
+	# simulation parameters are all arguments except output options
+	params = {arg: value for arg, value in vars(args).items() if arg not in ["outfile", "processes"]}
+	gtpase_data, gdi_data, truth = simulate(**params)
+
+	# progress status
+	print("# {} GTPase spots, {} GDI spots, {} colocalized spot pairs".format(len(gtpase_data), len(gdi_data), len(truth)))
+
+	# Write output files
+	dataOUT(gtpase_data, "{}_GTPase.csv".format(args.outfile), args.processes)
+	dataOUT(gdi_data, "{}_GDI.csv".format(args.outfile), args.processes)
+	dataOUT_truth(truth, "{}_ground-truth.csv".format(args.outfile), args)
+
+	# progress status
+	print("# Output written to: {}_GTPase.csv, {}_GDI.csv, {}_ground-truth.csv".format(args.outfile, args.outfile, args.outfile))
+
+#--- Run main function
+if __name__ == '__main__':
+	main()
+
+# Ankit Roy
+# 19th October, 2026
@@ -0,0 +1,127 @@
+# Lazy frame access to TIFF image stacks and incremental writing of segmentation masks.
+# Frames are read on demand (memory-mapped where the file layout allows it, page by page otherwise),
+# so memory use does not depend on the number of frames in a stack.
+
+import numpy as np
+import tifffile
+
+# Scaling that maps a frame to floats in the same way as img_as_float
+def floatScale(dtype):
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'ui':
+        return 1 / np.iinfo(dtype).max
+
+    return 1
+
+# Lazy TIFF stack
+# Indexing with a frame number returns a float32 frame scaled like img_as_float,
+# or a boolean frame for masks
+class TiffStack:
+
+    def __init__(self, filename, mask=False):
+        self.filename = filename
+        self.mask = mask
+        self.tif = tifffile.TiffFile(filename)
+
+        series = self.tif.series[0]
+
+        # single page series, e.g. bit-packed masks: one frame per page
+        if series.ndim == 2 and len(self.tif.series) > 1:
+            self.shape = (len(self.tif.pages),) + tuple(series.shape)
+            self.paged = True
+        else:
+            self.shape = (1,) * (3 - series.ndim) + tuple(series.shape[-3:])
+            self.paged = False
+
+        self.dtype = series.dtype
+        self.scale = np.float32(floatScale(self.dtype))
+
+        # memory map uncompressed contiguous stacks
+        self.memmap = None
+        if not self.paged:
+            try:
+                self.memmap = tifffile.memmap(filename, mode='r').reshape(self.shape)
+            except (ValueError, TypeError):
+                pass
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.memmap = None
+        self.tif.close()
+
+    # Frame in the data type stored in the file
+    def raw(self, t):
+        if t < 0:
+            t += len(self)
+        if not 0 <= t < len(self):
+            raise IndexError(f"frame {t} out of range for {len(self)} frames")
+
+        if self.memmap is not None:
+            return np.asarray(self.memmap[t])
+        if self.paged:
+            return self.tif.pages[t].asarray()
+        if len(self) == 1:
+            return self.tif.asarray().reshape(self.shape[1:])
+
+        return self.tif.asarray(key=t)
+
+    def __getitem__(self, t):
+        if isinstance(t, slice):
+            return np.array([self[i] for i in range(*t.indices(len(self)))])
+
+        frame = self.raw(t)
+        if self.mask:
+            return frame != 0
+
+        return frame.astype(np.float32) * self.scale
+
+    def __iter__(self):
+        for t in range(len(self)):
+            yield self[t]
+
+# Output file name with suffix
+def outName(filename, suffix, extension='tif'):
+    outname = '.'.join(filename.split('.')[:-1])
+    return f'{outname}_{suffix}.{extension}'
+
+# Mask stack written frame by frame
+# Frames are stored as uint8 (0/255) pages of a single stack, or as bit-packed (1 bit) pages
+# BigTIFF is only used when the expected stack shape does not fit a classic TIFF
+class MaskWriter:
+
+    def __init__(self, filename, shape=None, bitpacked=False):
+        self.filename = filename
+        self.bitpacked = bitpacked
+        bigtiff = shape is not None and np.prod(shape, dtype=np.int64) > 2**31
+        self.tif = tifffile.TiffWriter(filename, bigtiff=bigtiff)
+        self.frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, frame):
+        frame = np.asarray(frame, dtype=bool)
+
+        if self.bitpacked:
+            self.tif.write(frame, photometric='minisblack', contiguous=False)
+        else:
+            self.tif.write(frame.astype(np.uint8) * 255, photometric='minisblack', contiguous=True)
+
+        self.frames += 1
+
+    def close(self):
+        self.tif.close()
+
+# Ankit Roy
+# 19th October, 2026